@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: benchmark_wmt16_pairwise_export.py [-h] [--repeat REPEAT]
+                                          [--max-systems MAX_SYSTEMS]
+
+Benchmarks RankingResult.export_to_pairwise_csv() for worst-case segments
+in which all translations are tied multi-systems.  Results are built in
+memory, the database is not accessed.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --repeat REPEAT       Number of exports per multi-system size.
+  --max-systems MAX_SYSTEMS
+                        Maximum number of systems per multi-system.
+
+"""
+from timeit import default_timer
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Benchmarks pairwise CSV " \
+  "export for worst-case segments in which all translations are tied " \
+  "multi-systems.")
+PARSER.add_argument("--repeat", action="store", default=10, dest="repeat",
+  help="Number of exports per multi-system size.", type=int)
+PARSER.add_argument("--max-systems", action="store", default=64,
+  dest="max_systems", help="Maximum number of systems per multi-system.",
+  type=int)
+
+# Number of translations per segment, as in WMT16 HITs.
+TRANSLATIONS_PER_SEGMENT = 5
+
+HIT_XML = u'<hit block-id="-1" source-language="ces" ' \
+  'target-language="eng">{0}</hit>'
+
+SEGMENT_XML = u'<seg id="1"><source id="1">Source</source>' \
+  '<reference>Reference</reference>{0}</seg>'
+
+TRANSLATION_XML = u'<translation system="{0}">Translation {1}</translation>'
+
+
+def create_worst_case_result(systems_per_translation):
+    """
+    Creates an unsaved RankingResult with tied multi-system translations.
+    """
+    from django.contrib.auth.models import User
+    from appraise.wmt16.models import HIT, RankingTask, RankingResult
+
+    translations = []
+    for index in range(TRANSLATIONS_PER_SEGMENT):
+        _systems = ['system-{0}-{1}'.format(index, x)
+          for x in range(systems_per_translation)]
+        translations.append(TRANSLATION_XML.format(','.join(_systems), index))
+
+    segment_xml = SEGMENT_XML.format(u''.join(translations))
+    hit = HIT(hit_id='00000000', block_id=-1, language_pair='ces2eng',
+      hit_xml=HIT_XML.format(segment_xml))
+    task = RankingTask(hit=hit, item_xml=segment_xml)
+    user = User(username='benchmark')
+
+    raw_result = ','.join(['1'] * TRANSLATIONS_PER_SEGMENT)
+    return RankingResult(item=task, user=user, raw_result=raw_result)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+
+    print 'Systems     Rows   Seconds per export'
+
+    systems_per_translation = 1
+    while systems_per_translation <= args.max_systems:
+        result = create_worst_case_result(systems_per_translation)
+
+        start = default_timer()
+        for _ in range(args.repeat):
+            rows = result.export_to_pairwise_csv().count(u'\n') + 1
+        duration = (default_timer() - start) / args.repeat
+
+        print '{0:>7} {1:>8} {2:>20.6f}'.format(
+          systems_per_translation * TRANSLATIONS_PER_SEGMENT, rows, duration)
+
+        systems_per_translation = systems_per_translation * 2
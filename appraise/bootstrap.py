@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Shared plumbing for parallel bootstrap resampling, used by the ranking
+cluster engine and compute_agreement_scores.py.
+
+Resamples are split into shards of a language pair, each with a seed that
+is derived from a master seed;  results are therefore reproducible,
+regardless of the number of worker processes.  Per language pair data is
+made available to workers once, when the pool is created.
+
+This module must not depend on Django, as compute_agreement_scores.py is
+used without it.
+
+"""
+from hashlib import md5
+from multiprocessing import Pool
+
+import numpy as np
+
+
+def derive_seed(seed, language_pair, shard):
+    """
+    Derives the random seed for the given bootstrap shard from a master seed.
+
+    Seeds only depend on the master seed, the language pair and the shard's
+    index;  hence results do not depend on the number of worker processes.
+
+    """
+    _key = u'{0}:{1}:{2}'.format(seed, language_pair, shard).encode('utf-8')
+    return int(md5(_key).hexdigest()[:8], 16)
+
+
+def compute_bootstrap_shards(language_pair, number_of_resamples, seed,
+  resamples_per_shard, first_shard=0):
+    """
+    Splits number_of_resamples bootstrap resamples for the given language
+    pair into shards of at most resamples_per_shard resamples, starting
+    with shard index first_shard.
+
+    Returns a list of (language_pair, index, seed, number_of_resamples)
+    tuples.
+
+    """
+    shards = []
+    for offset, first in enumerate(range(0, number_of_resamples,
+      resamples_per_shard)):
+        _index = first_shard + offset
+        _resamples = min(resamples_per_shard, number_of_resamples - first)
+        _seed = derive_seed(seed, language_pair, _index)
+        shards.append((language_pair, _index, _seed, _resamples))
+    return shards
+
+
+# Data per language pair, shared with bootstrap workers.
+SHARED_DATA = {}
+
+
+def _initialize_worker(shared_data):
+    """
+    Makes the given data available inside a bootstrap worker.
+    """
+    SHARED_DATA.clear()
+    SHARED_DATA.update(shared_data)
+
+
+def _compute_shard(task):
+    """
+    Computes the given (compute_shard, shard) task, see iter_shard_results().
+    """
+    compute_shard, (language_pair, index, seed, number_of_resamples) = task
+    random_state = np.random.RandomState(seed)
+    result = compute_shard(SHARED_DATA[language_pair], number_of_resamples,
+      random_state)
+    return (language_pair, index, result)
+
+
+def create_pool(shared_data, processes=1):
+    """
+    Makes shared_data, a dictionary mapping language pairs to data, available
+    for computing bootstrap shards.
+
+    Data is always made available in this process, as single shards are
+    computed here.  Returns a Pool of initialized workers if processes > 1,
+    None otherwise;  the caller has to close it.
+
+    """
+    _initialize_worker(shared_data)
+
+    if processes > 1:
+        return Pool(processes=processes, initializer=_initialize_worker,
+          initargs=(shared_data,))
+
+    return None
+
+
+def iter_shard_results(compute_shard, shards, pool=None):
+    """
+    Yields (language_pair, index, result) tuples for the given shards.
+
+    compute_shard is a module-level function which is called with the shared
+    data of a shard's language pair, its number of resamples and a NumPy
+    RandomState seeded with the shard's seed.  If a pool is given and there
+    is more than one shard, shards are computed by its workers and yielded
+    in order of completion.
+
+    """
+    tasks = [(compute_shard, x) for x in shards]
+    if pool is not None and len(tasks) > 1:
+        return pool.imap_unordered(_compute_shard, tasks)
+
+    return (_compute_shard(x) for x in tasks)
@@ -6,12 +6,16 @@ Project: Appraise evaluation system
 
 usage: python compute_agreement_scores.py [-h] [--processes PROCESSES]
                                           [--inter] [--intra] [--verbose]
+                                          [--stream] [--sort]
+                                          [--bootstrap RESAMPLES]
+                                          [--seed SEED]
                                           results-file
 
 Computes agreement scores for the given results file in WMT format.
 
 positional arguments:
-  results-file          Comma-separated results file in WMT format.
+  results-file          Comma-separated results file in WMT format, may be
+                        compressed using gzip, or NumPy .npz export.
 
 optional arguments:
   -h, --help            Show this help message and exit.
@@ -20,20 +24,39 @@ optional arguments:
   --inter               Compute inter-annotator agreement.
   --intra               Compute intra-annotator agreement.
   --verbose             Display additional information on kappa values.
+  --stream              Process input sorted by language pair and segment
+                        with bounded memory.
+  --sort                Sort input on disk first, implies --stream.
+  --bootstrap RESAMPLES
+                        Computes bootstrap percentile intervals for kappa
+                        using the given number of resamples.
+  --seed SEED           Sets the random seed for bootstrap resampling.
 
 """
 from __future__ import print_function, unicode_literals
 
 import argparse
+import gzip
+import os
+import sys
 from collections import defaultdict
+from cPickle import dump, load, HIGHEST_PROTOCOL
 from csv import DictReader
+from heapq import merge
 from itertools import combinations
 from multiprocessing import Pool, cpu_count
+from tempfile import mkstemp
+
+import numpy as np
+
+from bootstrap import compute_bootstrap_shards, create_pool, \
+  iter_shard_results
 
 PARSER = argparse.ArgumentParser(description="Computes agreement scores " \
   "for the given results file in WMT format.")
-PARSER.add_argument("results_file", type=file, metavar="results-file",
-  help="Comma-separated results file in WMT format.")
+PARSER.add_argument("results_file", type=str, metavar="results-file",
+  help="Comma-separated results file in WMT format, may be compressed " \
+  "using gzip, or NumPy .npz export.")
 PARSER.add_argument("--processes", action="store", default=cpu_count(),
   dest="processes", help="Sets the number of parallel processes.", type=int)
 PARSER.add_argument("--inter", action="store_true", default=False,
@@ -44,102 +67,224 @@ PARSER.add_argument("--verbose", action="store_true", default=False,
   dest="verbose", help="Display additional information on kappa values.")
 PARSER.add_argument("--points", action="store_true", default=False,
   dest="points", help="Display total number of data points in output table.")
+PARSER.add_argument("--stream", action="store_true", default=False,
+  dest="stream", help="Process input sorted by language pair and segment " \
+  "with bounded memory.")
+PARSER.add_argument("--sort", action="store_true", default=False,
+  dest="sort", help="Sort input on disk first, implies --stream.")
+PARSER.add_argument("--bootstrap", action="store", default=0,
+  dest="bootstrap", metavar="RESAMPLES", help="Computes bootstrap " \
+  "percentile intervals for kappa using the given number of resamples.",
+  type=int)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Sets the random seed for bootstrap resampling.", type=int)
+
+
+# Integer codes for pairwise ranking decisions, i.e., A>B, A<B and A=B.
+VERDICT_BETTER = 0
+VERDICT_WORSE = 1
+VERDICT_TIE = 2
+NUMBER_OF_VERDICTS = 3
 
 
-def extract_system_ids_from_label(label):
+def _count_pairs(counts):
     """
-    Extracts the two system IDs from the given label.
+    Returns the number of unordered pairs which can be built from counts.
+    """
+    return counts * (counts - 1) // 2
+
+
+def expand_ranking_decisions(segments, coders, systems, rankings):
     """
-    label_systems = []
-    for separator in ('>', '<', '='):
-        if separator in label:
-            label_systems = label.split(separator)
-            break
-    label_systems.sort()
+    Expands the given integer-encoded rankings into pairwise decisions.
     
-    sorted_and_cleaned_label_systems = []
-    for label_system in label_systems:
-        cleaned_label_systems = label_system.split('+')
-        cleaned_label_systems.sort()
-        sorted_and_cleaned_label_systems.append('+'.join(cleaned_label_systems))
+    Arguments contain one entry per ranking;  systems and rankings have one
+    column per system, padded with -1.  Pairs involving a ranking of -1 are
+    skipped as these don't contribute.
     
-    return sorted_and_cleaned_label_systems
+    Returns a tuple (segments, coders, items, verdicts) of arrays with one
+    entry per pairwise ranking decision.  Items encode the segment and the
+    ordered pair of systems.
+    
+    """
+    _segments, _coders, _items, _verdicts = [], [], [], []
+    _systems = systems.max() + 1
+    for a, b in combinations(range(systems.shape[1]), 2):
+        _valid = (rankings[:, a] != -1) & (rankings[:, b] != -1)
+        
+        _segments.append(segments[_valid])
+        _coders.append(coders[_valid])
+        _items.append((segments[_valid] * _systems + systems[_valid, a]) \
+          * _systems + systems[_valid, b])
+        
+        _first, _second = rankings[_valid, a], rankings[_valid, b]
+        _verdicts.append(np.where(_first < _second, VERDICT_BETTER,
+          np.where(_first > _second, VERDICT_WORSE, VERDICT_TIE)))
+    
+    return tuple(np.concatenate(x) for x in (_segments, _coders, _items,
+      _verdicts))
 
 
-def compute_agreement_scores(data):
+def compute_item_counts(segments, coders, items, verdicts, intra=False):
     """
-    Computes agreement scores for the given data set.
+    Computes agreement counts per item for the given integer-encoded
+    judgements.
+    
+    All arguments are arrays with one entry per pairwise ranking decision.
+    Items identify a segment and an ordered pair of systems;  two decisions
+    on the same item are comparable and identical if their verdicts match.
+    
+    For intra-annotator agreement, only decisions of the same coder on the
+    same item are compared;  coders are only considered for those segments
+    in which they have judged at least one item two or more times.
+    
+    Returns an array with one row of (identical, comparable, ties, total)
+    counts per item, or per coder and item for intra-annotator agreement.
+    
     """
-    # Make triples accessible by item id.
-    _by_items = defaultdict(list)
-    for _unused_coder_name, item, labels in data:
-        _by_items[item].append(labels) # We only need the labels here.
+    if not len(items):
+        return np.zeros((0, 4), dtype=np.int64)
     
-    try:
-        identical_cnt = 0
-        comparable_cnt = 0
-        ties_cnt = 0
-        ties_total = 0
+    if intra:
+        groups = coders * (items.max() + 1) + items
+    else:
+        groups = items
+    
+    # Compute per-group verdict counts, one row per group.
+    _groups, groups = np.unique(groups, return_inverse=True)
+    counts = np.bincount(groups * NUMBER_OF_VERDICTS + verdicts,
+      minlength=len(_groups) * NUMBER_OF_VERDICTS).reshape(
+      (len(_groups), NUMBER_OF_VERDICTS))
+    totals = counts.sum(axis=1)
+    
+    if intra:
+        _owners, owners = np.unique(coders * (segments.max() + 1) + segments,
+          return_inverse=True)
+        group_owners = np.zeros(len(_groups), dtype=np.int64)
+        group_owners[groups] = owners
         
-        for item_labels in _by_items.values():
-            ties_total += len(item_labels)
-            
-            for individual_label in item_labels:
-                if '=' in individual_label:
-                    ties_cnt += 1
-            
-            # cfedermann: combinations() throws a ValueError if x does not
-            # contain two or more elements when using Python 2.6;  hence we
-            # check length of x before using it ;)
-            if len(item_labels) > 1:
-                for first_label, second_label in combinations(item_labels, 2):
-                    #if first_label == second_label:
-                    #    identical_cnt += 1
-                    #comparable_cnt += 1
-                    #continue
-
-                    first_label_systems = extract_system_ids_from_label(first_label)
-                    second_label_systems = extract_system_ids_from_label(second_label)
-                    
-                    if set(first_label_systems) == set(second_label_systems):
-                        comparable_cnt += 1
-                        
-                        if first_label == second_label:
-                            identical_cnt += 1
-                
-        return (identical_cnt, comparable_cnt, ties_cnt, ties_total)
+        # Maximum number of decisions on a single item per segment and coder.
+        maximum_totals = np.zeros(len(_owners), dtype=np.int64)
+        np.maximum.at(maximum_totals, group_owners, totals)
+        
+        _selected = maximum_totals[group_owners] > 1
+        counts = counts[_selected]
+        totals = totals[_selected]
     
-    except:
-        from traceback import print_exc
-        print_exc()
+    return np.column_stack((_count_pairs(counts).sum(axis=1),
+      _count_pairs(totals), counts[:, VERDICT_TIE], totals)).astype(np.int64)
 
-# Use 2 for pairwise rankings and 5 for plain WMT data...
-MAX_NUMBER_OF_SYSTEMS = 5
 
-LANGUAGE_CODE_TO_NAME = {
-  'ces': 'Czech', 'deu': 'German', 'fra': 'French', 'fre': 'French',
-  'esn': 'Spanish', 'fin': 'Finnish', 'rus': 'Russian', 'hin': 'Hindi',
-  'eng': 'English', 'ron': 'Romanian', 'tur': 'Turkish',
-  'Portguese': 'Portuguese'
-}
+def compute_agreement_scores(segments, coders, items, verdicts, intra=False):
+    """
+    Computes agreement scores for the given integer-encoded judgements, see
+    compute_item_counts() for details.
+    
+    Returns a tuple (identical, comparable, ties, total) of counts.
+    
+    """
+    _counts = compute_item_counts(segments, coders, items, verdicts, intra)
+    return tuple(int(x) for x in _counts.sum(axis=0))
 
-if __name__ == "__main__":
-    args = PARSER.parse_args()
+
+def compute_kappa(identical, comparable, ties, total):
+    """
+    Computes a tuple (pA, pE, kappa) from the given agreement counts.
     
-    if not args.inter_annotator_agreement and \
-      not args.intra_annotator_agreement:
-        print("Defaulting to --inter mode.")
-        args.inter_annotator_agreement = True
+    Counts may also be arrays, e.g., one entry per bootstrap resample.
     
-    results_data = defaultdict(lambda: defaultdict(list))
-    for i, row in enumerate(DictReader(args.results_file)):
+    """
+    # Compute p(A) probability.
+    pA = identical / np.maximum(comparable, 1).astype(float)
+    
+    # Compute p(E) empirically, based on the number of observed ties.
+    pTies = ties / np.maximum(total, 1).astype(float)
+    pNoTies = 1.0 - pTies
+    pE = pTies**2 + (pNoTies/2.0)**2 + (pNoTies/2.0)**2
+    
+    # Compute kappa score.
+    kappa = (pA - pE) / (1.0 - pE)
+    
+    return (pA, pE, kappa)
+
+
+def iter_segment_batches(language_pair, segments, coders, systems, rankings,
+  intra=False, batch_size=None):
+    """
+    Splits the given integer-encoded rankings into batches of segments.
+    
+    Batches contain about batch_size rankings but never split a segment as
+    agreement counts are computed per segment.  Yields a tuple
+    (language_pair, intra, segments, coders, systems, rankings) per batch.
+    
+    """
+    if batch_size is None:
+        batch_size = RANKINGS_PER_BATCH
+    
+    _order = np.argsort(segments, kind='mergesort')
+    segments, coders, systems, rankings = segments[_order], coders[_order], \
+      systems[_order], rankings[_order]
+    
+    # Positions at which a new segment starts are valid batch boundaries.
+    _starts = np.flatnonzero(np.diff(segments)) + 1
+    first = 0
+    while first < len(segments):
+        _next = np.searchsorted(_starts, first + batch_size)
+        last = _starts[_next] if _next < len(_starts) else len(segments)
+        yield (language_pair, intra, segments[first:last], coders[first:last],
+          systems[first:last], rankings[first:last])
+        first = last
+
+
+def compute_batch_scores(batch):
+    """
+    Computes agreement scores for a batch from iter_segment_batches().
+    
+    Returns a tuple (language_pair, scores).
+    
+    """
+    language_pair, intra, segments, coders, systems, rankings = batch
+    _decisions = expand_ranking_decisions(segments, coders, systems, rankings)
+    return (language_pair, compute_agreement_scores(*_decisions, intra=intra))
+
+
+def compute_batch_item_counts(batch):
+    """
+    Computes agreement counts per item for a batch from
+    iter_segment_batches().
+    
+    Returns a tuple (language_pair, item_counts).
+    
+    """
+    language_pair, intra, segments, coders, systems, rankings = batch
+    _decisions = expand_ranking_decisions(segments, coders, systems, rankings)
+    return (language_pair, compute_item_counts(*_decisions, intra=intra))
+
+
+def open_results_file(path):
+    """
+    Opens the given results file, decompressing gzip files on the fly.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    
+    return open(path, 'rb')
+
+
+def iter_rankings(results_file):
+    """
+    Yields rankings from the given results file in WMT format.
+    
+    Each ranking is a tuple (language_pair, segment_id, judge_id, systems,
+    rankings).  Rankings with less than two systems are skipped.
+    
+    """
+    for row in DictReader(results_file):
         src_lang = row.get('srclang')
-        if src_lang in LANGUAGE_CODE_TO_NAME.keys():
-            src_lang = LANGUAGE_CODE_TO_NAME[src_lang]
+        src_lang = LANGUAGE_CODE_TO_NAME.get(src_lang, src_lang)
         
         trg_lang = row.get('trglang')
-        if trg_lang in LANGUAGE_CODE_TO_NAME.keys():
-            trg_lang = LANGUAGE_CODE_TO_NAME[trg_lang]
+        trg_lang = LANGUAGE_CODE_TO_NAME.get(trg_lang, trg_lang)
         
         language_pair = '{0}-{1}'.format(src_lang, trg_lang)
         segment_id = int(row.get('srcIndex'))
@@ -150,49 +295,280 @@ if __name__ == "__main__":
         # Filter out results where a user decided to "skip" ranking.
         systems = []
         rankings = []
-        for y in range(MAX_NUMBER_OF_SYSTEMS):
-            system_id = row.get('system{0}Id'.format(y+1), None)
-            system_rank = row.get('system{0}rank'.format(y+1), -1)
+        for id_column, rank_column in SYSTEM_COLUMNS:
+            system_id = row.get(id_column, None)
+            system_rank = row.get(rank_column, -1)
             
             if system_id is not None:
                 systems.append(system_id)
                 rankings.append(int(system_rank))
-
+        
         # We need at least two systems to compare...
         if len(systems) < 2:
             continue
-       
-#        systems = [row.get('system%dId' % (y+1)) for y in range(NUMBER_OF_SYSTEMS)]
-#        rankings = [int(x) for x in \
-#          [row.get('system%drank' % (y+1)) for y in range(NUMBER_OF_SYSTEMS)]]
-#        if all([x == -1 for x in rankings]):
-#            continue
         
-        # Compute individual ranking decisions for this users.
-        for a, b in combinations(range(len(systems)), 2):
-            _c = judge_id
-            _i = '{0}.{1}.{2}'.format(segment_id, systems[a], systems[b])
-            
-            # We have to skip any rankings = -1 as these don't contribute!
-            if rankings[a] == -1 or rankings[b] == -1:
-                continue
-            
-            if rankings[a] < rankings[b]:
-                _v = '{0}>{1}'.format(systems[a], systems[b])
-            elif rankings[a] > rankings[b]:
-                _v = '{0}<{1}'.format(systems[a], systems[b])
-            else:
-                _v = '{0}={1}'.format(systems[a], systems[b])
+        yield (language_pair, segment_id, judge_id, systems, rankings)
+
+
+def load_npz_rankings(path):
+    """
+    Loads integer-encoded rankings from the given NumPy .npz export.
+    
+    Returns a dictionary mapping language pairs to a tuple (segments,
+    coders, systems, rankings) of arrays for iter_segment_batches().  The
+    export's system and judge codes are used as they are.
+    
+    """
+    results_data = {}
+    with np.load(path) as data:
+        language_pairs = data['language_pairs']
+        _columns = [data[x].astype(np.int64) for x in ('segment_ids',
+          'judges', 'systems', 'ranks')]
+        
+        for code, language_pair in enumerate(data['language_pair_names']):
+            _rows = language_pairs == code
+            results_data[language_pair] = tuple(x[_rows] for x in _columns)
+    
+    return results_data
+
+
+def _iter_sorted_chunk(path):
+    """
+    Yields the rankings stored in the given chunk file, then removes it.
+    """
+    try:
+        with open(path, 'rb') as chunk_file:
+            while True:
+                try:
+                    yield load(chunk_file)
+                
+                except EOFError:
+                    break
+    
+    finally:
+        os.remove(path)
+
+
+def sort_rankings(rankings, chunk_size=None):
+    """
+    Sorts the given rankings by language pair and segment, using disk space.
+    
+    Sorted chunks of chunk_size rankings are written to temporary files and
+    merged afterwards, hence at most chunk_size rankings are kept in memory.
+    
+    """
+    if chunk_size is None:
+        chunk_size = RANKINGS_PER_SORT_CHUNK
+    
+    chunk_paths = []
+    try:
+        chunk = []
+        for ranking in rankings:
+            chunk.append(ranking)
+            if len(chunk) >= chunk_size:
+                chunk_paths.append(_write_sorted_chunk(chunk))
+                chunk = []
+        
+        if chunk:
+            chunk_paths.append(_write_sorted_chunk(chunk))
+    
+    except:
+        for path in chunk_paths:
+            os.remove(path)
+        raise
+    
+    return merge(*[_iter_sorted_chunk(x) for x in chunk_paths])
+
+
+def _write_sorted_chunk(chunk):
+    """
+    Writes the given rankings to a temporary file, in sorted order.
+    """
+    chunk.sort()
+    handle, path = mkstemp(prefix='agreement-', suffix='.chunk')
+    with os.fdopen(handle, 'wb') as chunk_file:
+        for ranking in chunk:
+            dump(ranking, chunk_file, HIGHEST_PROTOCOL)
+    
+    return path
+
+
+class RankingEncoder(object):
+    """
+    Integer-encodes rankings for expand_ranking_decisions().
+    """
+    def __init__(self):
+        """
+        Initialises the system and coder code books.
+        """
+        self.system_codes = {}
+        self.coder_codes = {}
+    
+    def encode(self, data, segment_id, judge_id, systems, rankings):
+        """
+        Appends the given ranking to data, a tuple of four lists.
+        """
+        _segments, _coders, _systems, _rankings = data
+        _segments.append(segment_id)
+        _coders.append(self.coder_codes.setdefault(judge_id,
+          len(self.coder_codes)))
+        
+        _padding = [-1] * (MAX_NUMBER_OF_SYSTEMS - len(systems))
+        _systems.append([self.system_codes.setdefault(x,
+          len(self.system_codes)) for x in systems] + _padding)
+        _rankings.append(rankings + _padding)
+
+
+def iter_streamed_batches(rankings, intra=False, batch_size=None):
+    """
+    Yields batches of segments from rankings sorted by language pair and
+    segment, see iter_segment_batches() for the batch format.  Language
+    pairs may come in any order, as long as each one forms a single block.
+    
+    At most one batch of about batch_size rankings is kept in memory.
+    Raises ValueError if rankings are not sorted.
+    
+    """
+    if batch_size is None:
+        batch_size = RANKINGS_PER_BATCH
+    
+    encoder = RankingEncoder()
+    data = ([], [], [], [])
+    finished_language_pairs = set()
+    last_key = None
+    for language_pair, segment_id, judge_id, systems, _rankings in rankings:
+        _key = (language_pair, segment_id)
+        if last_key is not None and _key != last_key:
+            if _key[0] != last_key[0]:
+                finished_language_pairs.add(last_key[0])
             
-            # print('Appending', language_pair, segment_id, _c, _i, _v)
+            if _key[0] in finished_language_pairs or _key < last_key and \
+              _key[0] == last_key[0]:
+                raise ValueError('Input is not sorted by language pair and ' \
+                  'segment, use --sort instead.')
             
-            # Append ranking decision in Artstein and Poesio format.
-            results_data[language_pair][segment_id].append((_c, _i, _v))
+            # Batches end at segment boundaries or if language pair changes.
+            if len(data[0]) >= batch_size or _key[0] != last_key[0]:
+                yield (last_key[0], intra) + tuple(np.array(x,
+                  dtype=np.int64) for x in data)
+                data = ([], [], [], [])
         
-    # We allow to use multi-processing.
-    pool = Pool(processes=args.processes)
+        encoder.encode(data, segment_id, judge_id, systems, _rankings)
+        last_key = _key
+    
+    if data[0]:
+        yield (last_key[0], intra) + tuple(np.array(x, dtype=np.int64)
+          for x in data)
+
+
+def _bootstrap_shard(item_counts, number_of_resamples, random_state):
+    """
+    Computes (pA, pE, kappa) scores for a bootstrap shard of the given item
+    counts, see iter_shard_results().
+    
+    Items are resampled with replacement;  each resample is represented by
+    the number of times every item is drawn, so only one weight vector is
+    kept in memory at a time.  Returns an array with one row of scores per
+    resample.
+    
+    """
+    _items = len(item_counts)
+    scores = np.zeros((number_of_resamples, 3))
+    for resample in range(number_of_resamples):
+        _weights = np.bincount(random_state.randint(_items, size=_items),
+          minlength=_items)
+        scores[resample] = compute_kappa(*_weights.dot(item_counts))
+    
+    return scores
+
+
+def compute_confidence_intervals(item_counts, number_of_resamples, seed,
+  processes=1, confidence=None):
+    """
+    Computes bootstrap percentile intervals for pA, pE and kappa.
+    
+    Item_counts maps language pairs to arrays from compute_item_counts().
+    Given the same seed, results are reproducible, regardless of the number
+    of processes.  Returns a dictionary mapping language pairs to a list of
+    (lower, upper) tuples for pA, pE and kappa.
+    
+    """
+    if confidence is None:
+        confidence = BOOTSTRAP_CONFIDENCE
+    
+    shards = []
+    for language_pair in sorted(item_counts.keys()):
+        if len(item_counts[language_pair]):
+            shards.extend(compute_bootstrap_shards(language_pair,
+              number_of_resamples, seed, RESAMPLES_PER_SHARD))
+    
+    pool = create_pool(item_counts, processes if len(shards) > 1 else 1)
+    scores = defaultdict(dict)
+    try:
+        for language_pair, index, _scores in iter_shard_results(
+          _bootstrap_shard, shards, pool):
+            scores[language_pair][index] = _scores
+    
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    _percentiles = (50 * (1 - confidence), 50 * (1 + confidence))
+    intervals = {}
+    for language_pair, _shards in scores.items():
+        _scores = np.concatenate([_shards[x] for x in sorted(_shards)])
+        _lower, _upper = np.percentile(_scores, _percentiles, axis=0)
+        intervals[language_pair] = zip(_lower, _upper)
+    
+    return intervals
+
+
+# Number of rankings per batch of segments sent to a worker process.
+RANKINGS_PER_BATCH = 25000
+
+# Number of bootstrap resamples per shard sent to a worker process.
+RESAMPLES_PER_SHARD = 100
+
+# Confidence level of bootstrap percentile intervals.
+BOOTSTRAP_CONFIDENCE = 0.95
+
+# Number of rankings per sorted chunk file when sorting on disk.
+RANKINGS_PER_SORT_CHUNK = 500000
+
+# Use 2 for pairwise rankings and 5 for plain WMT data...
+MAX_NUMBER_OF_SYSTEMS = 5
+
+# Names of system id and rank columns in WMT format.
+SYSTEM_COLUMNS = [('system{0}Id'.format(y+1), 'system{0}rank'.format(y+1))
+  for y in range(MAX_NUMBER_OF_SYSTEMS)]
+
+LANGUAGE_CODE_TO_NAME = {
+  'ces': 'Czech', 'deu': 'German', 'fra': 'French', 'fre': 'French',
+  'esn': 'Spanish', 'fin': 'Finnish', 'rus': 'Russian', 'hin': 'Hindi',
+  'eng': 'English', 'ron': 'Romanian', 'tur': 'Turkish',
+  'Portguese': 'Portuguese'
+}
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
+    if not args.inter_annotator_agreement and \
+      not args.intra_annotator_agreement:
+        print("Defaulting to --inter mode.")
+        args.inter_annotator_agreement = True
+    
+    # Random seeds are printed so that intervals can be reproduced.
+    if args.bootstrap and args.seed is None:
+        args.seed = np.random.RandomState().randint(2**31)
+        print("Using random seed {0} for bootstrap resampling.".format(
+          args.seed))
+    
     print('Language pair        pA     pE     kappa  ',
-      end='' if args.verbose or args.points else '\n')
+      end='' if args.verbose or args.points or args.bootstrap else '\n')
+    if args.bootstrap:
+        print('kappa {0:.0%} CI     '.format(BOOTSTRAP_CONFIDENCE),
+          end='' if args.verbose or args.points else '\n')
     if args.points:
         print('Points   ', end='' if args.verbose else '\n')
     if args.verbose:
@@ -207,77 +583,93 @@ if __name__ == "__main__":
       'Turkish-English', 'English-Bulgarian', 'English-Basque',
       'English-Portuguese', 'English-Dutch')
     
-    for language_pair in language_pairs:
-        segments_data = results_data[language_pair]
-        scores = []
-        handles = []
+    # Intra-annotator agreement is solely computed on items for which
+    # an annotator has generated two or more annotations.
+    intra = not args.inter_annotator_agreement
+    
+    # Bootstrap resampling needs agreement counts per item, which are
+    # collected per language pair;  these are much smaller than rankings.
+    if args.bootstrap:
+        compute_batch = compute_batch_item_counts
+    else:
+        compute_batch = compute_batch_scores
+    
+    # In streaming mode, batches are computed one at a time as the process
+    # pool would consume all of them at once.
+    pool = None
+    npz_input = args.results_file.endswith('.npz')
+    if (args.stream or args.sort) and not npz_input:
+        rankings = iter_rankings(open_results_file(args.results_file))
+        if args.sort:
+            rankings = sort_rankings(rankings)
         
-        for segment_id, _judgements in segments_data.items():
-            # Collect judgements on a per-coder-level.
-            _coders = defaultdict(list)
-            for _c, _i, _l in _judgements:
-                _coders[_c].append((_c, _i, _l))
-            
-            # Inter-annotator agreement is computed for all items.
-            if args.inter_annotator_agreement:
-                # Pool compute_agreement_scores() call and save handle.
-                handle = pool.apply_async(compute_agreement_scores,
-                  args=(_judgements,), callback=scores.append)
-                handles.append(handle)
+        _results = (compute_batch(x)
+          for x in iter_streamed_batches(rankings, intra))
+    
+    # Otherwise, rankings are integer-encoded per language pair, with
+    # separate lists for segment ids, coders, systems and rankings.  NumPy
+    # exports are integer-encoded already.
+    else:
+        if npz_input:
+            results_data = load_npz_rankings(args.results_file)
+        
+        else:
+            encoder = RankingEncoder()
+            results_data = defaultdict(lambda: ([], [], [], []))
+            for language_pair, segment_id, judge_id, systems, rankings in \
+              iter_rankings(open_results_file(args.results_file)):
+                encoder.encode(results_data[language_pair], segment_id,
+                  judge_id, systems, rankings)
+        
+        # Batches of segments are computed in parallel;  counts are summed
+        # up per language pair as batches complete.
+        batches = []
+        for language_pair in language_pairs:
+            if not language_pair in results_data:
                 continue
-                
-            # Intra-annotator agreement is solely computed on items for which
-            # an annotator has generated two or more annotations.
-            elif args.intra_annotator_agreement:
-                # Check that we have at least one annotation item with two or
-                # more annotations from the current coder.
-                for _coder, _coder_judgements in _coders.items():
-                    _items = defaultdict(list)
-                    for _, _i, _l in _coder_judgements:
-                        _items[_i].append(_l)
-                    
-                    # If no item has two or more annotations, skip coder.
-                    if all([len(x)<2 for x in _items.values()]):
-                        continue
-                    
-                    # We rename the judgements for the current coder s.t. we
-                    # can compute intra-annotator agreement scores from
-                    # inter-annotator agreement data ;)
-                    renamed_judgements = []
-                    for _i, _ls in _items.items():
-                        for d in range(len(_ls)):
-                            _c = '{0}-{1}'.format(_coder, d)
-                            renamed_judgements.append((_c, _i, _ls[d]))
-                    
-                    # Pool compute_agreement_scores() call and save handle.
-                    handle = pool.apply_async(compute_agreement_scores,
-                      args=(renamed_judgements,), callback=scores.append)
-                    handles.append(handle)
+            
+            batches.extend(iter_segment_batches(language_pair,
+              *[np.array(x, dtype=np.int64)
+              for x in results_data[language_pair]], intra=intra))
         
-        # Block until all async computation processes are completed.
-        while any([not x.ready() for x in handles]):
+        if args.processes > 1 and len(batches) > 1:
+            pool = Pool(processes=args.processes)
+            _results = pool.imap_unordered(compute_batch, batches)
+        else:
+            _results = (compute_batch(x) for x in batches)
+    
+    scores = defaultdict(lambda: [0, 0, 0, 0])
+    item_counts = defaultdict(list)
+    try:
+        for language_pair, _scores in _results:
+            if args.bootstrap:
+                item_counts[language_pair].append(_scores)
+                _scores = [int(x) for x in _scores.sum(axis=0)]
+            
+            for i in range(4):
+                scores[language_pair][i] += _scores[i]
+    
+    except ValueError, msg:
+        print(msg)
+        sys.exit(-1)
+    
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    if args.bootstrap:
+        intervals = compute_confidence_intervals(dict((x, np.concatenate(y))
+          for x, y in item_counts.items()), args.bootstrap, args.seed,
+          args.processes)
+    
+    for language_pair in language_pairs:
+        if not language_pair in scores:
             continue
         
-        # Compute average scores, normalising on per-item level.
-        average_scores = []
-        for i in range(4):
-            average_scores.append(sum([x[i] for x in scores]))
-        
-        _identical = average_scores[0]
+        average_scores = scores[language_pair]
         _comparable = average_scores[1]
-        _ties = average_scores[2]
-        _ties_total = average_scores[3]
-        
-        # Compute p(A) probability.
-        pA = _identical / float(_comparable or 1)
-        
-        # Compute p(E) empirically, based on the number of observed ties.
-        pTies = _ties / float(_ties_total or 1)
-        pNoTies = 1.0 - pTies
-        pE = pTies**2 + (pNoTies/2.0)**2 + (pNoTies/2.0)**2
-        
-        # Compute kappa score.
-        kappa = (pA - pE) / float(1.0 - pE)
+        pA, pE, kappa = compute_kappa(*average_scores)
         
         # No sense to print out empty results
         if _comparable == 0:
@@ -285,7 +677,13 @@ if __name__ == "__main__":
         
         # Display results for current language pair.
         print('{0:>20} {1: 0.3f} {2: 0.3f} {3: 0.3f}'.format(language_pair,
-          pA, pE, kappa), end='' if args.verbose or args.points else '\n')
+          pA, pE, kappa), end='' if args.verbose or args.points or \
+          args.bootstrap else '\n')
+        
+        if args.bootstrap:
+            print(' [{0: 0.3f}, {1: 0.3f}]'.format(
+              *intervals[language_pair][2]), end='' if args.verbose or \
+              args.points else '\n')
         
         if args.points:
             print(' {0:>8}'.format(_comparable), end='' if args.verbose else '\n')
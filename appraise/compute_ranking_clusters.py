@@ -4,21 +4,113 @@
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 
-usage: compute_ranking_clusters.py
+usage: compute_ranking_clusters.py [-h] [--processes PROCESSES]
+                                   [--resamples RESAMPLES]
+                                   [--max-resamples MAX_RESAMPLES]
+                                   [--seed SEED] [--project ANNOTATION_PROJECT]
+                                   [--pairwise]
 
-Computes ranking clusters for all WMT16 language pairss.
+Computes ranking clusters for all WMT16 language pairs.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --processes PROCESSES
+                        Sets the number of parallel processes.
+  --resamples RESAMPLES
+                        Sets a fixed number of bootstrap resamples. By
+                        default, resampling stops once rank ranges are stable,
+                        after at least 100 resamples.
+  --max-resamples MAX_RESAMPLES
+                        Sets the maximum number of adaptive resamples.
+  --seed SEED           Sets the random seed for bootstrap resampling.
+  --project ANNOTATION_PROJECT
+                        Annotation project name.  By default, results from
+                        all projects are used.
+  --pairwise            Prints head-to-head win ratios with sign test and
+                        bootstrap p-values for all system pairs instead.
+
+Computed clusters are stored in the database;  language pairs without new
+or changed results are not re-computed.
 
 """
+from multiprocessing import cpu_count
+import argparse
 import os
 import sys
 
+PARSER = argparse.ArgumentParser(description="Computes ranking clusters " \
+  "for all WMT16 language pairs.")
+PARSER.add_argument("--processes", action="store", default=cpu_count(),
+  dest="processes", help="Sets the number of parallel processes.", type=int)
+PARSER.add_argument("--resamples", action="store", default=None,
+  dest="resamples", help="Sets a fixed number of bootstrap resamples.  By " \
+  "default, resampling stops once rank ranges are stable, after at least " \
+  "100 resamples.", type=int)
+PARSER.add_argument("--max-resamples", action="store", default=2000,
+  dest="max_resamples", help="Sets the maximum number of adaptive " \
+  "resamples.", type=int)
+PARSER.add_argument("--seed", action="store", default=None, dest="seed",
+  help="Sets the random seed for bootstrap resampling.", type=int)
+PARSER.add_argument("--project", action="store", default=None,
+  dest="annotation_project", help="Annotation project name.  By default, " \
+  "results from all projects are used.", type=str)
+PARSER.add_argument("--pairwise", action="store_true", default=False,
+  dest="pairwise", help="Prints head-to-head win ratios with sign test and " \
+  "bootstrap p-values for all system pairs instead.")
+
 
 if __name__ == "__main__":
+    args = PARSER.parse_args()
+    
     # Properly set DJANGO_SETTINGS_MODULE environment variable.
     os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
     PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
     sys.path.append(PROJECT_HOME)
     
     # We have just added appraise to the system path list, hence this works.
-    from appraise.wmt16.views import update_ranking
-    update_ranking()
+    from appraise.wmt16.models import Project
+    from appraise.wmt16.views import _compute_ranking_clusters
+    
+    project_instance = None
+    if args.annotation_project:
+        # Check if annotation project exists.
+        if not Project.objects.filter(name=args.annotation_project).exists():
+            print "Annotation project named '{0}' does not exist!".format(args.annotation_project)
+            sys.exit(-1)
+        project_instance = Project.objects.filter(name=args.annotation_project)[0]
+    
+    clusters = _compute_ranking_clusters(project=project_instance,
+      processes=args.processes,
+      number_of_resamples=args.resamples, seed=args.seed,
+      maximum_resamples=args.max_resamples)
+    
+    # Print out pairwise win ratios and p-values for all system pairs.
+    if args.pairwise:
+        print 'task,system1_id,system2_id,win-ratio,sign-test-p,bootstrap-p'
+        for language_pair, _, resamples, significance in clusters:
+            if not significance:
+                continue
+            
+            systems = significance['systems']
+            for first, system1_id in enumerate(systems):
+                for second, system2_id in enumerate(systems):
+                    win_ratio = significance['win_ratios'][first][second]
+                    if win_ratio is None:
+                        continue
+                    
+                    print u'{0},{1},{2},{3:.3f},{4:.6g},{5:.6g}'.format(
+                      language_pair, system1_id, system2_id, win_ratio,
+                      significance['sign_test'][first][second],
+                      significance['bootstrap'][first][second]).encode('utf-8')
+        
+        sys.exit(0)
+    
+    # Print out clusters in the same format as the former Perl script.
+    print 'task,cluster_id,exp-win-ratio,exp-rank-range,system_id'
+    for language_pair, language_data, resamples, _ in clusters:
+        sys.stderr.write(u'{0}: {1} resamples\n'.format(language_pair,
+          resamples).encode('utf-8'))
+        for cluster_id, cluster in language_data:
+            for win_ratio, rank_range, system_id in cluster:
+                print u'{0},{1},{2:.3f},{3},{4}'.format(language_pair,
+                  cluster_id, win_ratio, rank_range, system_id).encode('utf-8')
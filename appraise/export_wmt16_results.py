@@ -4,20 +4,60 @@
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 
-usage: export_wmt16_results.py
+usage: export_wmt16_results.py [-h] [--project ANNOTATION_PROJECT]
+                               [--format {apf,npz,pairwise-csv,ranking-csv,xml}]
+                               [--since SINCE] [--limit LIMIT]
+                               [--output OUTPUT] [--processes PROCESSES]
 
 Exports WMT16 results for all language pairs, in CSV WMT format.
 
+Results after a given cursor, either a result id or a completion timestamp,
+can be exported using --since.  The cursor for the next page is written to
+stderr.  The npz format writes integer-coded NumPy arrays for analytics.
+
+If an output file is given, results are exported in parallel, sharded by
+language pair, and the number of exported results and failures is reported
+per shard.  Otherwise, results are written to stdout and the export stops
+at the first failure.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --project ANNOTATION_PROJECT
+                        Annotation project name.
+  --format {apf,npz,pairwise-csv,ranking-csv,xml}
+                        Export format, defaults to pairwise-csv.
+  --since SINCE         Only export results after this cursor.
+  --limit LIMIT         Maximum number of results to export.
+  --output OUTPUT       Writes the export to this file, sharded by language
+                        pair.
+  --processes PROCESSES
+                        Sets the number of parallel processes for sharded
+                        exports.
+
 """
 from datetime import datetime
 import argparse
 import os
 import sys
 
+from multiprocessing import cpu_count
+
 PARSER = argparse.ArgumentParser(description="Exports pairwise results for " \
   "the given annotation project to CSV format.")
 PARSER.add_argument("--project", action="store", dest="annotation_project",
   help="Annotation project name.", type=str)
+PARSER.add_argument("--format", action="store", default="pairwise-csv",
+  dest="export_format", choices=("apf", "npz", "pairwise-csv", "ranking-csv",
+  "xml"), help="Export format, defaults to pairwise-csv.")
+PARSER.add_argument("--since", action="store", default=None, dest="since",
+  help="Only export results after this cursor.", type=str)
+PARSER.add_argument("--limit", action="store", default=None, dest="limit",
+  help="Maximum number of results to export.", type=int)
+PARSER.add_argument("--output", action="store", default=None, dest="output",
+  help="Writes the export to this file, sharded by language pair.", type=str)
+PARSER.add_argument("--processes", action="store", default=cpu_count(),
+  dest="processes", help="Sets the number of parallel processes for " \
+  "sharded exports.", type=int)
   
 
 if __name__ == "__main__":
@@ -29,8 +69,9 @@ if __name__ == "__main__":
     sys.path.append(PROJECT_HOME)
     
     # We have just added appraise to the system path list, hence this works.
-    from django.shortcuts import get_object_or_404
-    from appraise.wmt16.models import RankingResult, Project
+    from appraise.wmt16.exports import export_in_shards, get_results_page, \
+      iter_export_rows, iter_npz, iter_ranking_xml, parse_cursor, write_npz
+    from appraise.wmt16.models import Project
     
     # Check if annotation project exists.
     if not Project.objects.filter(name=args.annotation_project).exists():
@@ -38,21 +79,65 @@ if __name__ == "__main__":
         sys.exit(-1)
     project_instance = Project.objects.filter(name=args.annotation_project)[0]
     
-    # Print out results in CSV WMT format.    
-    queryset = RankingResult.objects.filter(item__hit__completed=True,
-      item__hit__project__id=project_instance.id)
-
-    header = u'srclang,trglang,srcIndex,segmentId,judgeId,' \
-      'system1Id,system1rank,system2Id,system2rank,rankingID'
-    
-    print header
-    for result in queryset:
-        if isinstance(result, RankingResult):
-            try:
-                current_csv = result.export_to_pairwise_csv()
-                if current_csv is None:
-                    continue
-                    
-                print current_csv
-            except:
-                pass
+    try:
+        since = parse_cursor(args.since) if args.since else None
+    
+    except ValueError, msg:
+        print msg
+        sys.exit(-1)
+    
+    # Without cursor or limit, all results of completed HITs are exported.
+    results, next_cursor = None, None
+    if since is not None or args.limit:
+        results, next_cursor = get_results_page(project_instance, since,
+          args.limit)
+    
+    # NumPy exports are written in one go, as arrays cannot be concatenated.
+    failures = 0
+    if args.output and args.export_format == 'npz':
+        with open(args.output, 'wb') as output_file:
+            write_npz(project_instance, output_file, results)
+    
+    # Shards only contain results up to the end of the current page.
+    elif args.output:
+        until = None
+        if results is not None:
+            until = next_cursor if next_cursor is not None else 0
+        
+        reports = export_in_shards(project_instance, args.export_format,
+          args.output, args.processes, since, until)
+        
+        sys.stderr.write('Language pair  Exported  Failures\n')
+        for language_pair, exported, _failures in reports:
+            sys.stderr.write('{0:<13} {1:>9} {2:>9}\n'.format(language_pair,
+              exported, len(_failures)))
+            for _id, _msg in _failures:
+                sys.stderr.write('  {0}: {1}\n'.format(_id, _msg))
+            
+            failures = failures + len(_failures)
+    
+    else:
+        if args.export_format == 'xml':
+            chunks = iter_ranking_xml(project_instance, results)
+        
+        elif args.export_format == 'npz':
+            chunks = iter_npz(project_instance, results)
+        
+        else:
+            chunks = iter_export_rows(project_instance, args.export_format,
+              results)
+        
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            
+            sys.stdout.write(chunk)
+    
+    if results is not None:
+        if next_cursor is None:
+            next_cursor = args.since or 0
+        
+        sys.stderr.write('Next cursor: {0}\n'.format(next_cursor))
+    
+    if failures:
+        sys.exit(-1)
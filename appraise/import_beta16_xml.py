@@ -3,13 +3,29 @@
 """
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: python import_beta16_xml.py [-h] [--dry-run] tasks-file [tasks-file ...]
+
+Imports AbsoluteScoringTasks from a given XML file into the Django database.
+
+Segments are parsed incrementally and imported using bulk inserts, so that
+memory use does not depend on file size;  .gz and .xz compressed files are
+decompressed on the fly.  Each file is imported in a single transaction.
+
+positional arguments:
+  tasks-file            XML file(s) containing tasks. Can be multiple files
+                        using patterns such as '*.xml' or similar.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --dry-run             Enable dry run to simulate import.
+
 """
+from itertools import islice
 import argparse
 import os
 import sys
 
-from xml.etree.ElementTree import fromstring, tostring
-
 PARSER = argparse.ArgumentParser(description="Imports tasks from a given " \
   "XML file into the Django database.")
 PARSER.add_argument("tasks_file", metavar="tasks-file", help="XML file(s) " \
@@ -18,17 +34,16 @@ PARSER.add_argument("tasks_file", metavar="tasks-file", help="XML file(s) " \
 PARSER.add_argument("--dry-run", action="store_true", default=False,
   dest="dry_run_enabled", help="Enable dry run to simulate import.")
 
+# Number of tasks inserted per bulk_create() call.
+TASKS_PER_BULK_INSERT = 1000
 
-if __name__ == "__main__":
-    args = PARSER.parse_args()
-
-    # Properly set DJANGO_SETTINGS_MODULE environment variable.
-    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
-    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
-    sys.path.append(PROJECT_HOME)
 
-    # We have just added appraise to the system path list, hence this works.
-    from appraise.beta16.models import AbsoluteScoringTask, MetaData
+def iter_tasks(tasks_file):
+    """
+    Yields unsaved AbsoluteScoringTasks for the given file.
+    """
+    from appraise.beta16.models import AbsoluteScoringTask
+    from appraise.utils import iter_xml_elements
 
     ###
     # <segments>
@@ -40,31 +55,51 @@ if __name__ == "__main__":
     #   ...
     # </segments>
     ###
+    for _child in iter_xml_elements(tasks_file, 'segments'):
+        new_task = AbsoluteScoringTask()
+        new_task.segment_id = _child.attrib["id"]
+        new_task.source_language = _child.attrib["source-language"]
+        new_task.target_language = _child.attrib["target-language"]
+        new_task.system_id = _child.findall("system-id")[0].text
+        new_task.reference = _child.findall("reference")[0].text
+        new_task.candidate = _child.findall("candidate")[-1].text
+        yield new_task
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+
+    # We have just added appraise to the system path list, hence this works.
+    from django.db import transaction
+    from appraise.beta16.models import AbsoluteScoringTask, MetaData
+    from appraise.utils import open_xml_file
+
+    # Django 1.6 has replaced commit_on_success() with atomic().
+    atomic = getattr(transaction, 'atomic', None) \
+      or transaction.commit_on_success
 
     for _tasks_file in args.tasks_file:
-        tasks_xml_string = None
-        with open(_tasks_file) as infile:
-            tasks_xml_string = unicode(infile.read(), "utf-8")
-
-        _tree = fromstring(tasks_xml_string.encode("utf-8"))
-        for _child in _tree:
-            segment_id = _child.attrib["id"]
-            source_language = _child.attrib["source-language"]
-            target_language = _child.attrib["target-language"]
-            system_id = _child.findall("system-id")[0].text
-            reference_text = _child.findall("reference")[0].text
-            for candidate in _child.findall("candidate"):
-                candidate_text = candidate.text
-                print candidate_text.encode('utf-8')
-
-            new_meta = MetaData()
-            new_meta.save()
-
-            new_task = AbsoluteScoringTask()
-            new_task.segment_id = segment_id
-            new_task.source_language = source_language
-            new_task.target_language = target_language
-            new_task.system_id = system_id
-            new_task.reference = reference_text
-            new_task.candidate = candidate_text
-            new_task.save()
+        _imported = 0
+        with open_xml_file(_tasks_file) as tasks_file, atomic():
+            tasks = iter_tasks(tasks_file)
+            batch = list(islice(tasks, TASKS_PER_BULK_INSERT))
+            while batch:
+                if not args.dry_run_enabled:
+                    # One MetaData instance is created per task, as before;
+                    # these are not linked to tasks, as the beta16 views
+                    # assign tasks without metadata to annotators.
+                    MetaData.objects.bulk_create([MetaData() for _ in batch])
+                    AbsoluteScoringTask.objects.bulk_create(batch)
+
+                _imported = _imported + len(batch)
+                batch = list(islice(tasks, TASKS_PER_BULK_INSERT))
+
+        print
+        print '[{0}]'.format(_tasks_file)
+        print 'Successfully imported {0} tasks.'.format(_imported)
+        print
@@ -8,8 +8,15 @@ usage: python import_wmt16_xml.py
                [-h] [--wait SLEEP_SECONDS] [--dry-run] [--mturk-only]
                hits-file [hits-file ...]
 
-Imports HITs from a given XML file into the Django database. Uses
-appraise.wmt16.validators.validate_hits_xml_file() for validation.
+Imports HITs from a given XML file into the Django database.  Each <hit>
+element is validated using appraise.wmt16.validators.validate_hit_xml()
+while the file is streamed.
+
+HITs are parsed incrementally and imported using set-based inserts, so
+that memory use does not depend on file size;  .gz and .xz compressed files
+are decompressed on the fly.  Each file is imported all or nothing, in a
+single transaction:  if any HIT is invalid, no HITs are imported from this
+file.  Other files are still imported.
 
 positional arguments:
   hits-file             XML file(s) containing HITs. Can be multiple files
@@ -27,11 +34,12 @@ import argparse
 import os
 import sys
 
-from xml.etree.ElementTree import fromstring, tostring
+from xml.etree.ElementTree import tostring
 
 PARSER = argparse.ArgumentParser(description="Imports HITs from a given " \
-  "XML file into the Django database.\nUses appraise.wmt16.validators." \
-  "validate_hits_xml_file() for validation.")
+  "XML file into the Django database.\nEach <hit> is validated using " \
+  "appraise.wmt16.validators.validate_hit_xml() while streaming;  if any " \
+  "HIT is invalid, no HITs are imported from this file.")
 PARSER.add_argument("hits_file", metavar="hits-file", help="XML file(s) " \
   "containing HITs.  Can be multiple files using patterns such as '*.xml' " \
   "or similar.", nargs='+')
@@ -44,6 +52,35 @@ PARSER.add_argument("--dry-run", action="store_true", default=False,
 PARSER.add_argument("--mturk-only", action="store_true", default=False,
   dest="mturk_only", help="Enable MTurk-only flag for all HITs.")
 
+# Hotfix potentially wrong ISO codes;  we are using ISO-639-3.
+ISO_639_2_TO_3_MAPPING = {'cze': 'ces', 'fre': 'fra', 'ger': 'deu',
+  'ron': 'rom', 'tur': 'trk', 'eus': 'baq'}
+
+
+def get_language_pair(hit_element):
+    """
+    Returns the language pair for the given <hit> element, e.g., "ces2eng".
+    """
+    language_pair = '{0}2{1}'.format(hit_element.attrib["source-language"],
+      hit_element.attrib["target-language"])
+    
+    for part2_code, part3_code in ISO_639_2_TO_3_MAPPING.items():
+        language_pair = language_pair.replace(part2_code, part3_code)
+    
+    return language_pair
+
+
+def iter_hits(hits_file):
+    """
+    Yields validated (language_pair, element) tuples for the given file.
+    """
+    from appraise.utils import iter_xml_elements
+    from appraise.wmt16.validators import validate_hit_xml
+
+    for _child in iter_xml_elements(hits_file, 'hits'):
+        validate_hit_xml(_child)
+        yield (get_language_pair(_child), _child)
+
 
 if __name__ == "__main__":
     args = PARSER.parse_args()
@@ -54,8 +91,8 @@ if __name__ == "__main__":
     sys.path.append(PROJECT_HOME)
     
     # We have just added appraise to the system path list, hence this works.
+    from appraise.utils import open_xml_file
     from appraise.wmt16.models import HIT, Project
-    from appraise.wmt16.validators import validate_hits_xml_file
     
     # Check if annotation project exists.
     if not Project.objects.filter(name=args.annotation_project).exists():
@@ -78,53 +115,36 @@ if __name__ == "__main__":
         else:
             first_run = False
         
-        hits_xml_string = None
-        with open(_hits_file) as infile:
-            hits_xml_string = unicode(infile.read(), "utf-8")
-        
-        # Validate XML before trying to import anything from the given file.
-        validate_hits_xml_file(hits_xml_string)
-    
-        _errors = 0
-        _total = 0
-        _tree = fromstring(hits_xml_string.encode("utf-8"))
-    
-        for _child in _tree:        
-            block_id = _child.attrib["block-id"]
-            language_pair = '{0}2{1}'.format(_child.attrib["source-language"],
-              _child.attrib["target-language"])
-        
-            # Hotfix potentially wrong ISO codes;  we are using ISO-639-3.
-            iso_639_2_to_3_mapping = {'cze': 'ces', 'fre': 'fra', 'ger': 'deu',
-              'ron': 'rom', 'tur': 'trk', 'eus': 'baq'}
-            for part2_code, part3_code in iso_639_2_to_3_mapping.items():
-                language_pair = language_pair.replace(part2_code, part3_code)
-        
-            try:
-                _total = _total + 1
-                _hit_xml = tostring(_child, encoding="utf-8").decode('utf-8')
-            
+        _imported = 0
+        _failed = False
+        try:
+            with open_xml_file(_hits_file) as hits_file:
                 if args.dry_run_enabled:
-                    _ = HIT(block_id=block_id, hit_xml=_hit_xml,
-                      language_pair=language_pair, mturk_only=args.mturk_only)
-            
+                    for language_pair, _child in iter_hits(hits_file):
+                        _ = HIT(block_id=_child.attrib["block-id"],
+                          hit_xml=tostring(_child, encoding="utf-8").decode(
+                          'utf-8'), language_pair=language_pair,
+                          mturk_only=args.mturk_only)
+                        _imported = _imported + 1
+                
                 else:
-                    # Use get_or_create() to avoid exact duplicates.  We do allow
-                    # them for WMT16 to measure intra-annotator agreement...
-                    h = HIT(block_id=block_id, hit_xml=_hit_xml,
-                      language_pair=language_pair, mturk_only=args.mturk_only)
-                    h.save()
-                    
-                    # Add HIT instance to given project.
-                    project_instance.HITs.add(h)
+                    # HITs of a file are imported in a single transaction.
+                    # We do allow exact duplicates for WMT16 to measure
+                    # intra-annotator agreement;  redundant copies are
+                    # identified by their HIT.content_hash.
+                    _imported = HIT.import_hits(iter_hits(hits_file),
+                      project=project_instance, mturk_only=args.mturk_only)
         
-            # pylint: disable-msg=W0703
-            except Exception, msg:
-                print msg
-                _errors = _errors + 1
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            print msg
+            _failed = True
     
         print
         print '[{0}]'.format(_hits_file)
-        print 'Successfully imported {0} HITs, encountered errors for ' \
-          '{1} HITs.'.format(_total, _errors)
+        if _failed:
+            print 'Encountered errors, no HITs have been imported.'
+        
+        else:
+            print 'Successfully imported {0} HITs.'.format(_imported)
         print
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: rebuild_wmt16_statistics.py [-h] --project ANNOTATION_PROJECT
+
+Re-computes pairwise win/loss/tie counts, online system ratings and
+agreement counts for the given annotation project.  Also computes missing
+HIT content hashes used to identify redundant HITs.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --project ANNOTATION_PROJECT
+                        Annotation project name.
+
+"""
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Re-computes pairwise " \
+  "win/loss/tie counts, online system ratings and agreement counts for " \
+  "the given annotation project.")
+PARSER.add_argument("--project", action="store", dest="annotation_project",
+  help="Annotation project name.", type=str, required=True)
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+
+    # We have just added appraise to the system path list, hence this works.
+    from appraise.wmt16.models import PairwiseCount, Project, \
+      SystemRating, AgreementCount, HIT
+
+    # Check if annotation project exists.
+    if not Project.objects.filter(name=args.annotation_project).exists():
+        print "Annotation project named '{0}' does not exist!".format(args.annotation_project)
+        sys.exit(-1)
+    project_instance = Project.objects.filter(name=args.annotation_project)[0]
+
+    print "Computed content hashes for {0} HITs in project '{1}'.".format(
+      HIT.update_content_hashes(project_instance), project_instance.name)
+
+    PairwiseCount.rebuild(project_instance)
+
+    print "Rebuilt {0} pairwise counts for project '{1}'.".format(
+      PairwiseCount.objects.filter(project=project_instance).count(),
+      project_instance.name)
+
+    SystemRating.rebuild(project_instance)
+
+    print "Rebuilt {0} system ratings for project '{1}'.".format(
+      SystemRating.objects.filter(project=project_instance).count(),
+      project_instance.name)
+
+    AgreementCount.rebuild(project_instance)
+
+    print "Rebuilt agreement counts for {0} language pairs in project " \
+      "'{1}'.".format(AgreementCount.objects.filter(
+      project=project_instance).count(), project_instance.name)
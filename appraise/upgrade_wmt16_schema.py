@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+usage: upgrade_wmt16_schema.py [-h] [--dry-run]
+
+Upgrades an existing WMT16 database for HIT content hashes.  Adds the
+content hash columns of HITs and RankingTasks and their indexes if these
+are missing, then computes hashes for all HITs which do not have one yet.
+
+New tables are created by syncdb as usual, which does not alter existing
+tables;  hence this has to be run once for databases created before
+content hashes have been introduced.
+
+optional arguments:
+  -h, --help            Show this help message and exit.
+  --dry-run             Only report missing columns, do not change anything.
+
+"""
+import argparse
+import os
+import sys
+
+PARSER = argparse.ArgumentParser(description="Upgrades an existing WMT16 " \
+  "database for HIT content hashes.")
+PARSER.add_argument("--dry-run", action="store_true", default=False,
+  dest="dry_run_enabled", help="Only report missing columns, do not " \
+  "change anything.")
+
+
+# Columns which have been added to existing WMT16 tables.
+HASH_COLUMNS = (('HIT', 'content_hash'), ('RankingTask', 'segment_hash'))
+
+
+def add_missing_column(connection, model, field_name, dry_run=False):
+    """
+    Adds the column for the given field to the model's table, including
+    its index, unless the table already has it.
+
+    Returns True if the column is missing, False otherwise.
+
+    """
+    from django.core.management.color import no_style
+
+    cursor = connection.cursor()
+    _table = model._meta.db_table
+    _field = model._meta.get_field(field_name)
+    _columns = [x[0] for x in connection.introspection.get_table_description(
+      cursor, _table)]
+    if _field.column in _columns:
+        return False
+
+    if dry_run:
+        return True
+
+    # Existing rows get an empty hash, which marks them for the update.
+    quote_name = connection.ops.quote_name
+    cursor.execute("ALTER TABLE {0} ADD COLUMN {1} {2} NOT NULL " \
+      "DEFAULT ''".format(quote_name(_table), quote_name(_field.column),
+      _field.db_type(connection=connection)))
+
+    for statement in connection.creation.sql_indexes_for_field(model,
+      _field, no_style()):
+        cursor.execute(statement)
+
+    return True
+
+
+if __name__ == "__main__":
+    args = PARSER.parse_args()
+
+    # Properly set DJANGO_SETTINGS_MODULE environment variable.
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    PROJECT_HOME = os.path.normpath(os.getcwd() + "/..")
+    sys.path.append(PROJECT_HOME)
+
+    # We have just added appraise to the system path list, hence this works.
+    from django.db import connection, transaction
+    from appraise.wmt16 import models
+
+    # Django 1.6 has replaced commit_on_success() with atomic().
+    atomic = getattr(transaction, 'atomic', None) \
+      or transaction.commit_on_success
+
+    # Check if WMT16 tables exist, i.e., syncdb has been run before.
+    _tables = connection.introspection.table_names()
+    for model_name, _ in HASH_COLUMNS:
+        _table = getattr(models, model_name)._meta.db_table
+        if not _table in _tables:
+            print "Table {0} does not exist, run syncdb first!".format(_table)
+            sys.exit(-1)
+
+    with atomic():
+        for model_name, field_name in HASH_COLUMNS:
+            _model = getattr(models, model_name)
+            _table = _model._meta.db_table
+            if not add_missing_column(connection, _model, field_name,
+              args.dry_run_enabled):
+                print "Column {0}.{1} exists already.".format(_table,
+                  field_name)
+
+            elif args.dry_run_enabled:
+                print "Column {0}.{1} is missing.".format(_table, field_name)
+
+            else:
+                print "Added column {0}.{1}.".format(_table, field_name)
+
+        if not args.dry_run_enabled:
+            print "Computed content hashes for {0} HITs.".format(
+              models.HIT.update_content_hashes())
@@ -37,6 +37,8 @@ urlpatterns += patterns('appraise.wmt16.views',
   (r'^{0}wmt16/export-to-pairwise-csv/(?P<token>[^/]+)/(?P<project>[^/]+)/$'.format(DEPLOYMENT_PREFIX), 'export_to_pairwise_csv'),
   (r'^{0}wmt16/export-to-ranking-csv/(?P<token>[^/]+)/(?P<project>[^/]+)/$'.format(DEPLOYMENT_PREFIX), 'export_to_ranking_csv'),
   (r'^{0}wmt16/export-to-ranking-xml/(?P<token>[^/]+)/(?P<project>[^/]+)/$'.format(DEPLOYMENT_PREFIX), 'export_to_ranking_xml'),
+  (r'^{0}wmt16/export-to-apf/(?P<token>[^/]+)/(?P<project>[^/]+)/$'.format(DEPLOYMENT_PREFIX), 'export_to_apf'),
+  (r'^{0}wmt16/export-to-npz/(?P<token>[^/]+)/(?P<project>[^/]+)/$'.format(DEPLOYMENT_PREFIX), 'export_to_npz'),
 )
 
 if DEBUG:
@@ -3,6 +3,7 @@
 Project: Appraise evaluation system
  Author: Christian Federmann <cfedermann@gmail.com>
 """
+import gzip
 import logging
 from datetime import timedelta
 
@@ -46,6 +47,133 @@ def seconds_to_timedelta(value):
     _secs = value % 60
     return timedelta(days=_days, hours=_hours, minutes=_mins, seconds=_secs)
 
+
+class XZFile(object):
+    """
+    Reads an .xz compressed file, decompressed by the xz command.
+
+    Raises IOError at the end of the data if xz has failed, e.g., for
+    truncated or corrupt files.  The xz process is reaped on close().
+
+    """
+    def __init__(self, path):
+        """
+        Starts decompressing the given file.
+        """
+        from subprocess import Popen, PIPE
+        with open(path, 'rb') as xz_file:
+            self._process = Popen(['xz', '--decompress', '--stdout'],
+              stdin=xz_file, stdout=PIPE, stderr=PIPE)
+        self._finished = False
+
+    def __enter__(self):
+        """
+        Returns this file for use in with statements.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Closes this file at the end of with statements.
+        """
+        self.close()
+
+    def _wait(self):
+        """
+        Waits for the xz process to exit and returns its error message.
+        """
+        _error = self._process.stderr.read()
+        self._process.stderr.close()
+        self._process.wait()
+        return _error.strip()
+
+    def read(self, size=-1):
+        """
+        Reads at most size bytes of decompressed data.
+        """
+        _data = self._process.stdout.read(size)
+        if not _data and size != 0 and not self._finished:
+            self._finished = True
+            self._process.stdout.close()
+            _error = self._wait()
+            if self._process.returncode != 0:
+                raise IOError('xz exited with status {0}: {1}'.format(
+                  self._process.returncode, _error))
+
+        return _data
+
+    def close(self):
+        """
+        Closes the file and reaps the xz process.
+
+        If the file is closed before all data has been read, the exit status
+        of xz is not checked, as it may have been interrupted by the closed
+        pipe.
+
+        """
+        if not self._finished:
+            self._finished = True
+            self._process.stdout.close()
+            self._wait()
+
+
+def open_xml_file(path):
+    """
+    Opens the given XML file for reading, decompressing .gz and .xz files
+    on the fly.
+
+    Python 2 has no lzma module, hence .xz files are decompressed using the
+    backports.lzma package if installed, or the xz command otherwise.
+
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+
+    if path.endswith('.xz'):
+        try:
+            from backports.lzma import LZMAFile
+            return LZMAFile(path, 'rb')
+
+        except ImportError:
+            return XZFile(path)
+
+    return open(path, 'rb')
+
+
+def iter_xml_elements(xml_file, root_tag=None):
+    """
+    Yields the children of the root element of the given XML file.
+
+    Elements are parsed incrementally and removed from the root element
+    once they have been processed, so that memory use does not depend on
+    the size of the file.  If root_tag is given, raises ValueError for any
+    other root element.
+
+    """
+    from xml.etree.ElementTree import iterparse
+
+    _events = iterparse(xml_file, events=('start', 'end'))
+    _, root = next(_events)
+    if root_tag is not None and root.tag != root_tag:
+        raise ValueError('expected <{0}> on top-level'.format(root_tag))
+
+    depth = 0
+    element = None
+    for event, _element in _events:
+        # The tail of an element is only known once the next tag is parsed.
+        if element is not None:
+            yield element
+            root.clear()
+            element = None
+
+        if event == 'start':
+            depth = depth + 1
+
+        else:
+            depth = depth - 1
+            if depth == 0:
+                element = _element
+
 # pylint: disable-msg=E0102
 class AnnotationTask(AnnotationTask):
     """
@@ -58,22 +186,64 @@ class AnnotationTask(AnnotationTask):
     >>> t1.avg_Ao()
     1.0
     
+    Labels are looked up in a (coder, item) index instead of scanning all of
+    self.data for each call.  As before, the first label of a coder wins.
+    >>> t2 = AnnotationTask(data=[('a','1','x'),('b','1','x'),('a','1','y')])
+    >>> t2.agr('a', 'b', '1')
+    1.0
+    
+    If a coder has no label for an item, Ao() ignores this and all remaining
+    items, as it did with the linear scans.
+    >>> t3 = AnnotationTask(data=[('a','1','x'),('c','1','y'),('a','2','y'),
+    ...   ('a','3','x'),('c','3','x')])
+    >>> t3.Ao('a', 'c')
+    0.0
+    
     """
-    # pylint: disable-msg=C0103,W0221
+    def _get_label_index(self):
+        """
+        Returns the (coder, item) -> (position, labels) index for self.data.
+        
+        The index is re-built if data has been added since it was computed.
+        
+        """
+        _index = getattr(self, '_label_index', None)
+        if _index is None or self._label_index_size != len(self.data):
+            _index = {}
+            for position, x in enumerate(self.data):
+                _key = (x['coder'], x['item'])
+                if not _key in _index:
+                    _index[_key] = (position, x['labels'])
+            
+            self._label_index = _index
+            self._label_index_size = len(self.data)
+        
+        return _index
+    
+    # pylint: disable-msg=C0103,W0221,W0613
     def agr(self, cA, cB, i, data=None):
         """Agreement between two coders on a given item
         
+        The data argument is ignored as NLTK only passes subsets of self.data.
+        
         """
-        data = data or self.data
-        k1 = (x for x in data if x['coder'] in (cA, cB) and x['item']==i).next()
-        if k1['coder'] == cA:
-            k2 = (x for x in data if x['coder']==cB and x['item']==i).next()
-        else:
-            k2 = (x for x in data if x['coder']==cA and x['item']==i).next()
-
-        ret = 1.0 - float(self.distance(k1['labels'], k2['labels']))
+        _index = self._get_label_index()
+        if not (cA, i) in _index or not (cB, i) in _index:
+            # The former linear scans raised StopIteration for a missing
+            # label, which ends the generator summed up in Ao();  remaining
+            # items are hence skipped, as before.
+            raise StopIteration
+        
+        k1 = _index[(cA, i)]
+        k2 = _index[(cB, i)]
+        
+        # Keep order of self.data, in case distance is not symmetric.
+        if k2[0] < k1[0]:
+            k1, k2 = k2, k1
+        
+        ret = 1.0 - float(self.distance(k1[1], k2[1]))
         log.debug("Observed agreement between %s and %s on %s: %f",
                       cA, cB, i, ret)
         log.debug("Distance between \"%r\" and \"%r\": %f",
-                      k1['labels'], k2['labels'], 1.0 - ret)
+                      k1[1], k2[1], 1.0 - ret)
         return ret
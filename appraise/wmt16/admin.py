@@ -7,11 +7,11 @@ import logging
 
 from django.contrib import admin
 from django.http import HttpResponse
-from django.template import Context
-from django.template.loader import get_template
 
+from appraise.wmt16.exports import iter_hits_xml
 from appraise.wmt16.models import HIT, RankingTask, RankingResult, \
-  UserHITMapping, UserInviteToken, Project, TimedKeyValueData
+  UserHITMapping, UserInviteToken, Project, TimedKeyValueData, \
+  PairwiseCount, SystemRating, RankingClusterData, AgreementCount
 
 from appraise.settings import LOG_LEVEL, LOG_HANDLER
 
@@ -25,14 +25,8 @@ def export_hit_xml(modeladmin, request, queryset):
     """
     Exports the tasks in the given queryset to XML format.
     """
-    template = get_template('wmt16/result_export.xml')
-    
-    tasks = []
-    for task in queryset:
-        if isinstance(task, HIT):
-            tasks.append(task.export_to_xml())
-    
-    export_xml = template.render(Context({'tasks': tasks}))
+    tasks = [task for task in queryset if isinstance(task, HIT)]
+    export_xml = u''.join(iter_hits_xml(tasks))
     return HttpResponse(export_xml, mimetype='text/xml; charset=UTF-8')
 
 export_hit_xml.short_description = "Export selected HITs to XML"
@@ -147,8 +141,8 @@ class HITAdmin(admin.ModelAdmin):
     """
     list_display = ('hit_id', 'block_id', 'language_pair', 'id')
     list_filter = ('language_pair', 'active', 'mturk_only', 'completed', 'project__name')
-    search_fields = ('hit_id',)
-    readonly_fields = ('hit_id', 'assigned', 'finished')
+    search_fields = ('hit_id', 'content_hash')
+    readonly_fields = ('hit_id', 'content_hash', 'assigned', 'finished')
     actions = (export_hit_xml, complete_hits, activate_hits, deactivate_hits,
       export_hit_ids_to_csv, export_hit_results_to_apf,
       export_hit_results_agreements)
@@ -162,7 +156,7 @@ class HITAdmin(admin.ModelAdmin):
       }),
       ('Details', {
         'classes': ('wide', 'collapse'),
-        'fields': ('users', 'hit_xml', 'assigned', 'finished')
+        'fields': ('users', 'hit_xml', 'content_hash', 'assigned', 'finished')
       })
     )
     
@@ -261,6 +255,45 @@ class UserInviteTokenAdmin(admin.ModelAdmin):
     search_fields = ('group__name', 'token')
 
 
+class PairwiseCountAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for PairwiseCount instances.
+    """
+    list_display = ('project', 'language_pair', 'system_a', 'system_b',
+      'wins', 'losses', 'ties')
+    list_filter = ('project', 'language_pair')
+    search_fields = ('system_a', 'system_b')
+
+
+class SystemRatingAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for SystemRating instances.
+    """
+    list_display = ('project', 'language_pair', 'system', 'mu', 'sigma',
+      'comparisons')
+    list_filter = ('project', 'language_pair')
+    search_fields = ('system',)
+
+
+class RankingClusterDataAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for RankingClusterData instances.
+    """
+    list_display = ('project', 'language_pair', 'watermark', 'parameters',
+      'resamples', 'date_and_time')
+    list_filter = ('project', 'language_pair')
+    search_fields = ('watermark', 'parameters')
+
+
+class AgreementCountAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin class for AgreementCount instances.
+    """
+    list_display = ('project', 'language_pair', 'identical', 'comparable',
+      'ties', 'total')
+    list_filter = ('project', 'language_pair')
+
+
 class TimedKeyValueDataAdmin(admin.ModelAdmin):
     """
     ModelAdmin class for TimedKeyValueData instances.
@@ -276,4 +309,8 @@ admin.site.register(RankingResult, RankingResultAdmin)
 admin.site.register(UserHITMapping, UserHITMappingAdmin)
 admin.site.register(UserInviteToken, UserInviteTokenAdmin)
 admin.site.register(Project)
+admin.site.register(PairwiseCount, PairwiseCountAdmin)
+admin.site.register(SystemRating, SystemRatingAdmin)
+admin.site.register(RankingClusterData, RankingClusterDataAdmin)
+admin.site.register(AgreementCount, AgreementCountAdmin)
 admin.site.register(TimedKeyValueData, TimedKeyValueDataAdmin)
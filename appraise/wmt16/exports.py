@@ -0,0 +1,931 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Streaming exports of WMT16 annotation results.
+
+Exports are generated row by row from querysets which are iterated in
+primary key order, one chunk at a time;  hence memory use does not depend
+on the size of the export and first bytes can be sent immediately.  Each
+chunk only needs a constant number of queries.
+
+CSV and APF exports are additionally kept as snapshot files per project.
+New results are appended to these as they are saved;  edits and deletions
+mark snapshots as stale, so that they are rewritten on the next download.
+
+Incremental exports return the results after a given cursor, page by page,
+together with the cursor for the next page.
+
+For analytics, results can also be exported as integer-coded NumPy arrays
+in .npz format, see write_npz().  Large exports can be written to a file in
+parallel, sharded by language pair, see export_in_shards().
+
+"""
+from datetime import datetime, timedelta
+import errno
+import fcntl
+import logging
+import os
+import re
+import zlib
+
+from contextlib import contextmanager
+from multiprocessing import Pool
+from shutil import copyfileobj
+from tempfile import mkstemp, TemporaryFile
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
+from django.http import HttpResponse, HttpResponseBadRequest, \
+  StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from appraise.wmt16.models import HIT, Project, RankingResult, \
+  ISO639_3_TO_NAME_MAPPING
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, MEDIA_ROOT
+from appraise.utils import datetime_to_seconds
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.wmt16.exports')
+LOGGER.addHandler(LOG_HANDLER)
+
+# Number of objects loaded from the database at a time.
+EXPORT_CHUNK_SIZE = 1000
+
+# Compression level used for gzip transfer encoding.
+GZIP_COMPRESSION_LEVEL = 6
+
+# Directory containing export snapshots, one subdirectory per project id.
+EXPORT_SNAPSHOT_ROOT = os.path.join(MEDIA_ROOT, 'exports')
+
+# Number of bytes read from snapshot files at a time.
+SNAPSHOT_BLOCK_SIZE = 65536
+
+# Matches a single byte range, e.g., "bytes=0-499" or "bytes=-500".
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Uncompleted HITs without new results for this long, e.g., abandoned by
+# their annotator, no longer hold back incremental exports.
+PENDING_HIT_TIMEOUT = timedelta(days=1)
+
+PAIRWISE_CSV_HEADER = u'srclang,trglang,srcIndex,segmentId,judgeId,' \
+  'system1Id,system1rank,system2Id,system2rank,rankingID'
+
+XML_DECLARATION = u'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+RANKING_CSV_HEADER = u'srclang,trglang,srcIndex,doucmentId,segmentId,' \
+  'judgeId,system1Number,system1Id,system2Number,system2Id,system3Number,' \
+  'system3Id,system4Number,system4Id,system5Number,system5Id,' \
+  'system1rank,system2rank,system3rank,system4rank,system5rank'
+
+
+def iter_in_chunks(queryset, chunk_size=None):
+    """
+    Yields the objects of the given queryset in primary key order.
+
+    Objects are loaded chunk_size at a time using primary key ranges, as
+    iterating over a large queryset would cache all of its objects.
+
+    """
+    if chunk_size is None:
+        chunk_size = EXPORT_CHUNK_SIZE
+
+    last_pk = None
+    while True:
+        _chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            _chunk = _chunk.filter(pk__gt=last_pk)
+
+        _chunk = list(_chunk[:chunk_size])
+        if not _chunk:
+            break
+
+        for instance in _chunk:
+            yield instance
+
+        # A partial chunk is the last one, no need to query again.
+        if len(_chunk) < chunk_size:
+            break
+
+        last_pk = _chunk[-1].pk
+
+
+def _iter_project_results(project, results=None):
+    """
+    Yields results of completed HITs for the given project, or the given
+    results queryset instead.
+
+    Related items, HITs and users are loaded in the same query.
+
+    """
+    if results is None:
+        results = RankingResult.objects.filter(item__hit__completed=True,
+          item__hit__project=project)
+
+    return iter_in_chunks(results.select_related('item__hit', 'user'))
+
+
+def parse_cursor(value):
+    """
+    Parses the given export cursor, which is either a result id or a result
+    completion timestamp in ISO 8601 format, e.g., "2016-05-01T12:00:00".
+
+    Raises ValueError for invalid cursors.
+
+    """
+    if value.isdigit():
+        return int(value)
+
+    _timestamp = parse_datetime(value)
+    if _timestamp is None:
+        raise ValueError('Invalid cursor: {0}'.format(value))
+
+    if timezone.is_aware(_timestamp) and not settings.USE_TZ:
+        _timestamp = timezone.make_naive(_timestamp,
+          timezone.get_default_timezone())
+
+    return _timestamp
+
+
+def _filter_since(queryset, since):
+    """
+    Filters the given results queryset for results after cursor since.
+    """
+    if isinstance(since, datetime):
+        return queryset.filter(completion__gt=since)
+
+    elif since is not None:
+        return queryset.filter(id__gt=since)
+
+    return queryset
+
+
+def get_results_page(project, since=None, limit=None):
+    """
+    Returns the next page of results for the given project.
+
+    since is a cursor as returned by parse_cursor();  only results after it
+    are included.  At most limit results are included, if given.  Returns
+    a tuple (results, next_cursor) where results is a queryset in result id
+    order and next_cursor is the id of the last result, or None if the
+    page is empty.
+
+    Results are exported once their HIT has been completed.  Pages do not
+    extend past results of HITs which are not yet completed, so that these
+    are not skipped by later pages.  This includes inactive HITs, as these
+    may still be completed, e.g., by an administrator.
+
+    As HITs may be abandoned half-way, a HIT only holds back pages while it
+    has received new results within PENDING_HIT_TIMEOUT.  Otherwise, pages
+    would stop advancing for good.  The trade-off is that results of a HIT
+    which is completed after this timeout may already be behind the cursor;
+    these are only contained in full exports.
+
+    """
+    queryset = _filter_since(RankingResult.objects.filter(
+      item__hit__project=project), since)
+    results = queryset.filter(item__hit__completed=True)
+
+    _recent_hits = RankingResult.objects.filter(item__hit__project=project,
+      item__hit__completed=False,
+      completion__gte=timezone.now() - PENDING_HIT_TIMEOUT).values(
+      'item__hit')
+    _pending = queryset.filter(item__hit__completed=False,
+      item__hit__in=_recent_hits).aggregate(Min('id'))['id__min']
+    if _pending is not None:
+        results = results.filter(id__lt=_pending)
+
+    # The last page may have less than limit results.
+    next_cursor = None
+    if limit:
+        _ids = results.order_by('id').values_list('id', flat=True)
+        for next_cursor in _ids[limit - 1:limit]:
+            pass
+
+    if next_cursor is None:
+        next_cursor = results.aggregate(Max('id'))['id__max']
+
+    if next_cursor is None:
+        return (results.none(), None)
+
+    return (results.filter(id__lte=next_cursor).order_by('id'), next_cursor)
+
+
+def _format_pairwise_csv(result):
+    """
+    Returns pairwise CSV rows for the given result, or None.
+    """
+    current_csv = result.export_to_pairwise_csv()
+    if current_csv is None:
+        return None
+
+    return current_csv + u'\n'
+
+
+def _format_ranking_csv(result):
+    """
+    Returns the ranking CSV row for the given result, or None.
+    """
+    # Current implementation of export_to_pairwise_csv() is weird.
+    # By contrast, export_to_csv() generates the right thing...
+    current_csv = result.export_to_csv()
+    if current_csv is None:
+        return None
+
+    return current_csv + u'\n'
+
+
+def _format_apf(result):
+    """
+    Returns Artstein and Poesio (2007) format rows for the given result.
+    """
+    current_apf = result.export_to_apf()
+    if not current_apf:
+        return None
+
+    return current_apf + u'\n'
+
+
+# Maps export formats to (snapshot file name, header, row formatter).
+EXPORT_FORMATS = {
+  'pairwise-csv': ('pairwise.csv', PAIRWISE_CSV_HEADER, _format_pairwise_csv),
+  'ranking-csv': ('ranking.csv', RANKING_CSV_HEADER, _format_ranking_csv),
+  'apf': ('results.apf', None, _format_apf),
+}
+
+
+def iter_export_rows(project, export_format, results=None):
+    """
+    Yields the export in the given format for the given project, line by
+    line, starting with the header if the format has one.
+
+    If results is given, only these results are exported.
+
+    """
+    _, header, formatter = EXPORT_FORMATS[export_format]
+    if header:
+        yield header + u'\n'
+
+    for result in _iter_project_results(project, results):
+        _rows = formatter(result)
+        if _rows is not None:
+            yield _rows
+
+
+def iter_pairwise_csv(project):
+    """
+    Yields the pairwise CSV export for the given project, line by line.
+    """
+    return iter_export_rows(project, 'pairwise-csv')
+
+
+def iter_ranking_csv(project):
+    """
+    Yields the ranking CSV export for the given project, line by line.
+    """
+    return iter_export_rows(project, 'ranking-csv')
+
+
+def iter_hits_xml(hits, result_ids=None):
+    """
+    Yields the ranking XML export for the given HITs, HIT by HIT.
+
+    If result_ids is given, only these results are exported.
+
+    """
+    hits = iter(hits)
+    for hit in hits:
+        yield XML_DECLARATION + u'<wmt16-results>\n\n'
+        yield hit.export_to_xml(result_ids) + u'\n'
+        break
+
+    else:
+        yield XML_DECLARATION + u'<wmt16-results />\n\n'
+        return
+
+    for hit in hits:
+        yield hit.export_to_xml(result_ids) + u'\n'
+
+    yield u'</wmt16-results>\n\n'
+
+
+def _get_project_hits(project, results=None):
+    """
+    Returns completed HITs for the given project as a tuple (hits,
+    result_ids).  If results is given, only HITs containing these are
+    included and result_ids contains their ids, otherwise it is None.
+    """
+    # Related items, results and users are prefetched for each chunk.
+    queryset = HIT.objects.filter(completed=True, project=project) \
+      .prefetch_related('rankingtask_set__rankingresult_set__user')
+
+    result_ids = None
+    if results is not None:
+        result_ids = set(results.values_list('id', flat=True))
+        queryset = queryset.filter(
+          rankingtask__rankingresult__in=results.values('id')).distinct()
+
+    return (queryset, result_ids)
+
+
+def iter_ranking_xml(project, results=None):
+    """
+    Yields the ranking XML export for the given project, HIT by HIT.
+
+    If results is given, only these results are exported.
+
+    """
+    hits, result_ids = _get_project_hits(project, results)
+    return iter_hits_xml(iter_in_chunks(hits), result_ids)
+
+
+def write_npz(project, npz_file, results=None):
+    """
+    Writes results for the given project to npz_file in NumPy .npz format.
+
+    Judgements are stored as columns with one entry per result:
+
+    - result_ids: RankingResult ids;
+    - language_pairs: codes into language_pair_names, e.g., "Czech-English";
+    - segment_ids: source segment ids, i.e., srcIndex in CSV exports;
+    - judges: codes into judge_names;
+    - systems: codes into system_names, one column per translation;
+    - ranks: ranks, one column per translation;
+    - durations: annotation time in seconds, NaN if unknown.
+
+    systems and ranks are padded with -1;  ranks of skipped results, or of
+    results which cannot be parsed, are -1.
+    Multi-systems are joined using "+", as in the ranking CSV export.  If
+    results is given, only these results are exported.
+
+    """
+    import numpy as np
+
+    language_pair_codes, judge_codes, system_codes = {}, {}, {}
+    result_ids, language_pairs, segment_ids, judges = [], [], [], []
+    systems, ranks, durations = [], [], []
+    for result in _iter_project_results(project, results):
+        _attributes = result.item.hit.hit_attributes
+        _language_pair = '{0}-{1}'.format(
+          ISO639_3_TO_NAME_MAPPING[_attributes['source-language']],
+          ISO639_3_TO_NAME_MAPPING[_attributes['target-language']])
+
+        _systems = [x[1]['system'].replace(',', '+')
+          for x in result.item.translations]
+
+        result_ids.append(result.id)
+        language_pairs.append(language_pair_codes.setdefault(_language_pair,
+          len(language_pair_codes)))
+        segment_ids.append(int(result.item.source[1]['id']))
+        judges.append(judge_codes.setdefault(result.user.username,
+          len(judge_codes)))
+        systems.append([system_codes.setdefault(x, len(system_codes))
+          for x in _systems])
+        # Invalid raw results are exported like skipped results.
+        _ranks = result.results
+        if not isinstance(_ranks, list) or len(_ranks) > len(_systems):
+            LOGGER.debug('Invalid ranks for RankingResult {0}'.format(
+              result.id))
+            _ranks = None
+
+        ranks.append(_ranks or [-1] * len(_systems))
+        durations.append(datetime_to_seconds(result.duration)
+          if result.duration else np.nan)
+
+    _columns = max([len(x) for x in systems] or [0])
+    _systems = np.full((len(systems), _columns), -1, dtype=np.int32)
+    _ranks = np.full((len(ranks), _columns), -1, dtype=np.int8)
+    for index, (_system_row, _rank_row) in enumerate(zip(systems, ranks)):
+        _systems[index, :len(_system_row)] = _system_row
+        _ranks[index, :len(_rank_row)] = _rank_row
+
+    # Dictionary tables list names in order of their codes.
+    _tables = [np.array(sorted(x, key=x.get), dtype=np.unicode_)
+      for x in (language_pair_codes, judge_codes, system_codes)]
+
+    np.savez(npz_file, result_ids=np.array(result_ids, dtype=np.int64),
+      language_pairs=np.array(language_pairs, dtype=np.int16),
+      segment_ids=np.array(segment_ids, dtype=np.int32),
+      judges=np.array(judges, dtype=np.int32), systems=_systems,
+      ranks=_ranks, durations=np.array(durations, dtype=np.float64),
+      language_pair_names=_tables[0], judge_names=_tables[1],
+      system_names=_tables[2])
+
+
+def iter_npz(project, results=None):
+    """
+    Yields the .npz export for the given project as byte strings.
+
+    Zip archives cannot be written as a stream, hence the export is written
+    to a temporary file first.
+
+    """
+    npz_file = TemporaryFile()
+    try:
+        write_npz(project, npz_file, results)
+        _size = npz_file.tell()
+
+    except:
+        npz_file.close()
+        raise
+
+    for chunk in _iter_file(npz_file, 0, _size):
+        yield chunk
+
+
+def get_export_shards(project):
+    """
+    Returns the language pairs of completed HITs for the given project.
+    """
+    return sorted(set(HIT.objects.filter(completed=True, project=project)
+      .values_list('language_pair', flat=True)))
+
+
+def write_export_shard(shard):
+    """
+    Writes the export for one language pair of a project to a file.
+
+    shard is a tuple (project_id, export_format, language_pair, since,
+    until, path);  only results after cursor since and up to result id
+    until are exported, if given.  Export formats are those of
+    EXPORT_FORMATS or 'xml', which writes HIT elements only.
+
+    Each result, or HIT for XML, is exported on its own;  failures are
+    collected instead of aborting the shard.  Returns a tuple
+    (language_pair, exported, failures) where failures is a list of
+    (id, error message) tuples.
+
+    """
+    project_id, export_format, language_pair, since, until, path = shard
+    project = Project.objects.get(id=project_id)
+
+    results = _filter_since(RankingResult.objects.filter(
+      item__hit__completed=True, item__hit__project=project,
+      item__hit__language_pair=language_pair), since)
+    if until is not None:
+        results = results.filter(id__lte=until)
+
+    if export_format == 'xml':
+        _paged = since is not None or until is not None
+        hits, result_ids = _get_project_hits(project,
+          results if _paged else None)
+        instances = iter_in_chunks(hits.filter(language_pair=language_pair))
+
+    else:
+        formatter = EXPORT_FORMATS[export_format][2]
+        instances = _iter_project_results(project, results)
+
+    exported = 0
+    failures = []
+    with open(path, 'wb') as shard_file:
+        for instance in instances:
+            try:
+                if export_format == 'xml':
+                    _rows = instance.export_to_xml(result_ids) + u'\n'
+
+                else:
+                    _rows = formatter(instance)
+
+            # pylint: disable-msg=W0703
+            except Exception, msg:
+                LOGGER.exception('Could not export {0} {1}'.format(
+                  type(instance).__name__, instance.id))
+                failures.append((instance.id, repr(msg)))
+                continue
+
+            if _rows is not None:
+                shard_file.write(_rows.encode('utf-8'))
+                exported = exported + 1
+
+    return (language_pair, exported, failures)
+
+
+def export_in_shards(project, export_format, path, processes=1, since=None,
+  until=None):
+    """
+    Exports results for the given project to a file, sharded by language
+    pair, see write_export_shard() for arguments.
+
+    Shards are written by up to processes worker processes, each using its
+    own database connection.  Afterwards, they are concatenated in language
+    pair order, with a single header.  Returns the list of shard reports.
+
+    """
+    _directory = os.path.dirname(os.path.abspath(path))
+    shards = []
+    for language_pair in get_export_shards(project):
+        handle, _path = mkstemp(dir=_directory, prefix='.',
+          suffix='.{0}.part'.format(language_pair))
+        os.close(handle)
+        shards.append((project.id, export_format, language_pair, since,
+          until, _path))
+
+    pool = None
+    try:
+        if processes > 1 and len(shards) > 1:
+            # Forked workers must not share the parent's connections.
+            for connection in connections.all():
+                connection.close()
+
+            pool = Pool(processes=min(processes, len(shards)))
+            reports = pool.map(write_export_shard, shards)
+
+        else:
+            reports = [write_export_shard(x) for x in shards]
+
+        if export_format == 'xml':
+            if any(x[1] for x in reports):
+                header = XML_DECLARATION + u'<wmt16-results>\n\n'
+                footer = u'</wmt16-results>\n\n'
+
+            else:
+                header = XML_DECLARATION + u'<wmt16-results />\n\n'
+                footer = u''
+
+        else:
+            header = EXPORT_FORMATS[export_format][1]
+            header = header + u'\n' if header else u''
+            footer = u''
+
+        with open(path, 'wb') as output_file:
+            output_file.write(header.encode('utf-8'))
+            for shard in shards:
+                with open(shard[-1], 'rb') as shard_file:
+                    copyfileobj(shard_file, output_file)
+
+            output_file.write(footer.encode('utf-8'))
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for shard in shards:
+            os.remove(shard[-1])
+
+    return reports
+
+
+def iter_gzip(chunks, compression_level=None):
+    """
+    Compresses the given chunks using gzip, yielding byte strings.
+
+    Unicode chunks are encoded using UTF-8.
+
+    """
+    if compression_level is None:
+        compression_level = GZIP_COMPRESSION_LEVEL
+
+    # Window size offset 16 makes zlib write gzip header and trailer.
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED,
+      16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+
+        _data = compressor.compress(chunk)
+        if _data:
+            yield _data
+
+    yield compressor.flush()
+
+
+def streaming_response(request, chunks, content_type):
+    """
+    Returns a StreamingHttpResponse for the given Unicode chunks.
+
+    If the client accepts gzip encoding, the response is compressed on the
+    fly using gzip transfer encoding.
+
+    """
+    if _accepts_gzip(request):
+        response = StreamingHttpResponse(iter_gzip(chunks),
+          content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+
+    else:
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _accepts_gzip(request):
+    """
+    Checks whether the client accepts gzip content encoding.
+    """
+    _accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return 'gzip' in [x.split(';')[0].strip() for x in _accepted.split(',')]
+
+
+def _get_snapshot_directory(project):
+    """
+    Returns the directory containing snapshots for the given project.
+    """
+    return os.path.join(EXPORT_SNAPSHOT_ROOT, str(project.id))
+
+
+def get_snapshot_path(project, export_format):
+    """
+    Returns the snapshot file path for the given project and format.
+    """
+    return os.path.join(_get_snapshot_directory(project),
+      EXPORT_FORMATS[export_format][0])
+
+
+@contextmanager
+def _snapshot_lock(project, blocking=True):
+    """
+    Acquires an exclusive lock on all snapshots of the given project.
+
+    Yields True once the lock is held.  If blocking is False and the lock
+    is held by another process, yields False instead of waiting.
+
+    """
+    _directory = _get_snapshot_directory(project)
+    try:
+        os.makedirs(_directory)
+
+    except OSError, msg:
+        if msg.errno != errno.EEXIST:
+            raise
+
+    with open(os.path.join(_directory, '.lock'), 'a') as lock_file:
+        _flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, _flags)
+
+        except IOError, msg:
+            if msg.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+            yield False
+            return
+
+        try:
+            yield True
+
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def invalidate_snapshots(project):
+    """
+    Marks all snapshots of the given project as stale.
+
+    Markers are also created for snapshots which do not exist yet, as these
+    may currently be written from data which is now outdated.
+
+    """
+    if not os.path.isdir(_get_snapshot_directory(project)):
+        return
+
+    for export_format in EXPORT_FORMATS:
+        _path = get_snapshot_path(project, export_format)
+        open(_path + '.stale', 'a').close()
+
+
+def append_to_snapshots(project, results):
+    """
+    Appends the given results to all snapshots of the given project.
+
+    This never waits for the lock:  if a snapshot is being rewritten, it is
+    marked as stale instead, so that it is rewritten once more on the next
+    download.
+
+    """
+    if not os.path.isdir(_get_snapshot_directory(project)):
+        return
+
+    with _snapshot_lock(project, blocking=False) as locked:
+        if not locked:
+            LOGGER.debug('Snapshots for project {0} are locked, marking ' \
+              'them as stale'.format(project.id))
+            invalidate_snapshots(project)
+            return
+
+        for export_format, (_, _, formatter) in EXPORT_FORMATS.items():
+            _path = get_snapshot_path(project, export_format)
+            if not os.path.exists(_path) or os.path.exists(_path + '.stale'):
+                continue
+
+            _rows = [formatter(x) for x in results]
+            _data = u''.join([x for x in _rows if x is not None])
+
+            # A single write keeps rows intact for concurrent readers.
+            with open(_path, 'ab') as snapshot_file:
+                snapshot_file.write(_data.encode('utf-8'))
+
+
+def refresh_snapshots(project, results=None):
+    """
+    Appends the given results to all snapshots of the given project, or
+    marks these as stale if results is None.
+
+    This is called whenever results or HITs are saved, hence errors are
+    logged instead of raised.  If results cannot be appended, snapshots are
+    marked as stale instead.
+
+    """
+    if results is not None:
+        try:
+            append_to_snapshots(project, results)
+            return
+
+        # pylint: disable-msg=W0703
+        except Exception:
+            LOGGER.exception('Could not append to snapshots for project ' \
+              '{0}'.format(project.id))
+
+    try:
+        invalidate_snapshots(project)
+
+    # pylint: disable-msg=W0703
+    except Exception:
+        LOGGER.exception('Could not invalidate snapshots for project ' \
+          '{0}'.format(project.id))
+
+
+def update_snapshot(project, export_format):
+    """
+    Makes sure the snapshot for the given project and format is up to date.
+
+    Missing or stale snapshots are rewritten from the database.  Returns a
+    tuple (snapshot_file, size) where snapshot_file is opened for reading
+    and size is the number of bytes which contain complete rows, as results
+    may be appended or the snapshot may be replaced after this returns.
+
+    """
+    _path = get_snapshot_path(project, export_format)
+    with _snapshot_lock(project):
+        if os.path.exists(_path + '.stale'):
+            os.remove(_path + '.stale')
+
+        elif os.path.exists(_path):
+            return (open(_path, 'rb'), os.path.getsize(_path))
+
+        LOGGER.info('Rewriting {0} snapshot for project {1}'.format(
+          export_format, project.id))
+
+        handle, _temp_path = mkstemp(dir=os.path.dirname(_path),
+          prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as snapshot_file:
+                for chunk in iter_export_rows(project, export_format):
+                    snapshot_file.write(chunk.encode('utf-8'))
+
+            os.rename(_temp_path, _path)
+
+        except:
+            os.remove(_temp_path)
+            raise
+
+        return (open(_path, 'rb'), os.path.getsize(_path))
+
+
+def _iter_file(snapshot_file, start, length):
+    """
+    Yields length bytes of the given file, starting at offset start.
+
+    The file is closed afterwards.
+
+    """
+    with snapshot_file:
+        snapshot_file.seek(start)
+        while length > 0:
+            _data = snapshot_file.read(min(length, SNAPSHOT_BLOCK_SIZE))
+            if not _data:
+                break
+
+            length -= len(_data)
+            yield _data
+
+
+def _parse_byte_range(value, size):
+    """
+    Parses the given Range header value for a file of the given size.
+
+    Returns a tuple (start, end) with inclusive byte offsets, None if the
+    header is missing or not a single byte range, or False if the range
+    cannot be satisfied.
+
+    """
+    _match = BYTE_RANGE.match(value or '')
+    if not _match or not any(_match.groups()):
+        return None
+
+    _first, _last = _match.groups()
+    if not _first:
+        # Suffix ranges request the last bytes of the file.
+        if not int(_last):
+            return False
+
+        return (max(size - int(_last), 0), size - 1)
+
+    start = int(_first)
+    end = min(int(_last), size - 1) if _last else size - 1
+    if start > end:
+        return None if _last and start > int(_last) else False
+
+    return (start, end)
+
+
+def snapshot_response(request, project, export_format, content_type):
+    """
+    Returns a response serving the snapshot for the given project and format.
+
+    Single byte ranges are supported, e.g., to resume downloads.  Without a
+    Range header, the snapshot is compressed on the fly if the client
+    accepts gzip encoding.
+
+    Snapshots are rewritten to a new file, hence the ETag is derived from
+    inode, size and modification time.  Range requests with an If-Range
+    header which does not match the current snapshot get the full snapshot.
+
+    """
+    _file, _size = update_snapshot(project, export_format)
+    _stat = os.fstat(_file.fileno())
+    _modified = _stat.st_mtime
+    _etag = '"{0:x}-{1:x}-{2:x}"'.format(_stat.st_ino, _size,
+      int(_modified))
+
+    _range = _parse_byte_range(request.META.get('HTTP_RANGE'), _size)
+    _if_range = request.META.get('HTTP_IF_RANGE')
+    if _range is not None and _if_range is not None \
+      and not _if_range in (_etag, http_date(_modified)):
+        _range = None
+
+    if _range is False:
+        _file.close()
+        response = HttpResponse(status=416, content_type=content_type)
+        response['Content-Range'] = 'bytes */{0}'.format(_size)
+        return response
+
+    if _range is None and _accepts_gzip(request):
+        response = StreamingHttpResponse(iter_gzip(_iter_file(_file, 0,
+          _size)), content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+        _etag = _etag[:-1] + '-gzip"'
+
+    elif _range is None:
+        response = StreamingHttpResponse(_iter_file(_file, 0, _size),
+          content_type=content_type)
+        response['Content-Length'] = str(_size)
+
+    else:
+        start, end = _range
+        response = StreamingHttpResponse(_iter_file(_file, start,
+          end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end,
+          _size)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = _etag
+    response['Last-Modified'] = http_date(_modified)
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def cursor_response(request, project, export_format, content_type):
+    """
+    Returns a response with the next page of results for the given project.
+
+    The cursor and page size are taken from the "since" and "limit" GET
+    parameters.  The cursor for the following page is returned in the
+    X-Next-Cursor header;  it is unchanged if there are no new results.
+
+    """
+    _since = request.GET.get('since', '').strip()
+    _limit = request.GET.get('limit', '').strip()
+    try:
+        since = parse_cursor(_since) if _since else None
+        limit = int(_limit) if _limit else None
+        if limit is not None and limit < 1:
+            raise ValueError('Invalid limit: {0}'.format(_limit))
+
+    except ValueError, msg:
+        return HttpResponseBadRequest(str(msg), content_type='text/plain')
+
+    results, next_cursor = get_results_page(project, since, limit)
+    if export_format == 'xml':
+        chunks = iter_ranking_xml(project, results)
+
+    elif export_format == 'npz':
+        chunks = iter_npz(project, results)
+
+    else:
+        chunks = iter_export_rows(project, export_format, results)
+
+    response = streaming_response(request, chunks, content_type)
+    if next_cursor is None:
+        next_cursor = _since or 0
+
+    response['X-Next-Cursor'] = next_cursor
+    return response
@@ -7,7 +7,9 @@ import logging
 import uuid
 
 from datetime import datetime
-from xml.etree.ElementTree import fromstring, ParseError, tostring
+from itertools import combinations
+from xml.etree.ElementTree import Element, fromstring, ParseError, tostring
+from xml.sax.saxutils import escape
 
 from django.dispatch import receiver
 
@@ -15,9 +17,8 @@ from django.contrib.auth.models import User, Group
 from django.core.urlresolvers import reverse
 from django.core.validators import RegexValidator
 from django.db import models
-from django.template import Context
-from django.template.loader import get_template
 
+from appraise.wmt16.systems import iter_system_pairs
 from appraise.wmt16.validators import validate_hit_xml, validate_segment_xml
 from appraise.settings import LOG_LEVEL, LOG_HANDLER
 from appraise.utils import datetime_to_seconds, AnnotationTask
@@ -30,6 +31,19 @@ LOGGER.addHandler(LOG_HANDLER)
 # How many users can annotate a given HIT
 MAX_USERS_PER_HIT = 1
 
+# Number of HITs inserted at a time by HIT.import_hits().
+HITS_PER_BULK_INSERT = 250
+
+# Number of ids per "IN" lookup;  SQLite allows at most 999 parameters.
+IDS_PER_QUERY = 500
+
+# How the next HIT for a user is selected:  'random' picks any available HIT,
+# 'uncertainty' prefers HITs comparing systems whose order is still unclear.
+HIT_SELECTION_MODE = 'random'
+
+# Number of available HITs considered for 'uncertainty' selection.
+HIT_SELECTION_CANDIDATES = 25
+
 LANGUAGE_PAIR_CHOICES = (
   # News task languages
   ('eng2ces', 'English → Czech'),
@@ -108,6 +122,95 @@ GROUP_HIT_REQUIREMENTS = {
 }
 
 
+def _normalize_xml(element):
+    """
+    Returns a canonical, nested list representation of the given element.
+
+    Attributes are sorted and whitespace in text content is collapsed, so
+    that formatting differences do not change the result.
+
+    """
+    _text = u' '.join((element.text or u'').split())
+    return [element.tag, sorted(element.attrib.items()), _text,
+      [_normalize_xml(x) for x in element]]
+
+
+def compute_content_hash(xml_string):
+    """
+    Returns the MD5 hash of the normalized XML content, or '' if invalid.
+
+    The given value can either be an XML string or an ElementTree.
+
+    """
+    from hashlib import md5
+    from json import dumps
+
+    if isinstance(xml_string, unicode):
+        xml_string = xml_string.encode('utf-8')
+
+    try:
+        if isinstance(xml_string, Element):
+            _normalized = _normalize_xml(xml_string)
+
+        else:
+            _normalized = _normalize_xml(fromstring(xml_string))
+
+    except ParseError, msg:
+        LOGGER.debug(msg)
+        return ''
+
+    return md5(dumps(_normalized)).hexdigest()
+
+
+# Entities for attribute values in XML exports, in addition to &, < and >.
+# Whitespace characters are escaped as parsers would normalize them.
+XML_ATTRIBUTE_ENTITIES = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;',
+  '\t': '&#9;'}
+
+
+def format_xml_attributes(attributes):
+    """
+    Returns the given (name, value) pairs as escaped XML attributes.
+
+    Each attribute is preceded by a space;  values are converted to Unicode.
+
+    """
+    return u''.join([u' {0}="{1}"'.format(name, escape(unicode(value),
+      XML_ATTRIBUTE_ENTITIES)) for name, value in attributes])
+
+
+def _atomic():
+    """
+    Returns a context manager which runs a block in a transaction.
+    """
+    from django.db import transaction
+
+    # Django 1.6 has replaced commit_on_success() with atomic().
+    atomic = getattr(transaction, 'atomic', None) \
+      or transaction.commit_on_success
+    return atomic()
+
+
+def _get_or_create(model, **kwargs):
+    """
+    Returns the model instance matching kwargs, creating it if necessary.
+
+    If the instance is created concurrently, get_or_create() may violate a
+    unique_together constraint;  the concurrently created instance is then
+    returned instead.  As for get_or_create(), defaults are only used for
+    creating a new instance.
+
+    """
+    from django.db import IntegrityError
+
+    try:
+        return model.objects.get_or_create(**kwargs)[0]
+
+    except IntegrityError:
+        kwargs.pop('defaults', None)
+        return model.objects.get(**kwargs)
+
+
 # pylint: disable-msg=E1101
 class HIT(models.Model):
     """
@@ -137,6 +240,16 @@ class HIT(models.Model):
       verbose_name="HIT source XML"
     )
 
+    content_hash = models.CharField(
+      max_length=32,
+      blank=True,
+      db_index=True,
+      editable=False,
+      help_text="MD5 hash of the normalized HIT source XML;  redundant " \
+        "copies of a HIT share the same hash.",
+      verbose_name="Content hash"
+    )
+
     language_pair = models.CharField(
       max_length=7,
       choices=LANGUAGE_PAIR_CHOICES,
@@ -199,6 +312,9 @@ class HIT(models.Model):
         if not self.hit_id:
             self.hit_id = self.__class__._create_hit_id()
 
+        # Remember completion status to detect changes in export snapshots.
+        self._completed_on_load = self.completed
+
         # If a hit_xml file is available, populate self.hit_attributes.
         self.reload_dynamic_fields()
 
@@ -218,6 +334,89 @@ class HIT(models.Model):
 
         return new_id
 
+    @classmethod
+    def import_hits(cls, hits, project=None, mturk_only=False,
+      batch_size=None):
+        """
+        Creates HITs and their RankingTasks using set-based inserts.
+
+        hits is an iterable of (language_pair, element) tuples where element
+        is a <hit> ElementTree.  HITs are inserted batch_size at a time,
+        all in a single transaction, and added to project if given.  Returns
+        the number of created HITs.
+
+        Unlike save(), this does not validate HIT XML and sends no signals;
+        callers validate each <hit> element using validate_hit_xml() while
+        streaming, see iter_hits() in import_wmt16_xml.py.  Any exception
+        raised by hits rolls back all HITs created so far.
+
+        """
+        from django.core.exceptions import ValidationError
+
+        if batch_size is None:
+            batch_size = HITS_PER_BULK_INSERT
+
+        language_pairs = set([x[0] for x in LANGUAGE_PAIR_CHOICES])
+        used_hit_ids = set(cls.objects.values_list('hit_id', flat=True))
+
+        created = 0
+        with _atomic():
+            batch = []
+            for language_pair, element in hits:
+                if not language_pair in language_pairs:
+                    raise ValidationError('Invalid language pair: ' \
+                      '"{0}".'.format(language_pair))
+
+                # Unique ids are generated in memory, see _create_hit_id().
+                hit_id = uuid.uuid4().hex[:8]
+                while hit_id in used_hit_ids:
+                    hit_id = uuid.uuid4().hex[:8]
+                used_hit_ids.add(hit_id)
+
+                batch.append((cls(hit_id=hit_id, block_id=element.attrib[
+                  'block-id'], hit_xml=tostring(element, encoding='utf-8')
+                  .decode('utf-8'), content_hash=compute_content_hash(element),
+                  language_pair=language_pair, mturk_only=mturk_only),
+                  element))
+
+                if len(batch) >= batch_size:
+                    cls._insert_hits(batch, project)
+                    created = created + len(batch)
+                    batch = []
+
+            if batch:
+                cls._insert_hits(batch, project)
+                created = created + len(batch)
+
+        return created
+
+    @classmethod
+    def _insert_hits(cls, batch, project=None):
+        """
+        Inserts the given (HIT, element) tuples for import_hits().
+        """
+        cls.objects.bulk_create([x[0] for x in batch])
+
+        # bulk_create() does not set primary keys, so these are loaded.
+        _ids = dict(cls.objects.filter(hit_id__in=[x[0].hit_id
+          for x in batch]).values_list('hit_id', 'id'))
+
+        tasks = []
+        for hit, element in batch:
+            for _child in element:
+                # item_xml is set after __init__() to avoid parsing it.
+                task = RankingTask(hit_id=_ids[hit.hit_id])
+                task.item_xml = tostring(_child)
+                task.segment_hash = compute_content_hash(_child)
+                tasks.append(task)
+
+        RankingTask.objects.bulk_create(tasks)
+
+        if project is not None:
+            through = Project.HITs.through
+            through.objects.bulk_create([through(project_id=project.id,
+              hit_id=x) for x in _ids.values()])
+
     @classmethod
     def compute_remaining_hits(cls, language_pair=None):
         """
@@ -302,11 +501,71 @@ class HIT(models.Model):
         combined[1] = combined[2] / float(combined[0] or 1)
         return combined
 
+    @classmethod
+    def compute_duplicate_groups(cls, project=None, language_pair=None):
+        """
+        Computes groups of HITs which are redundant copies of each other.
+
+        If project is given, it constraints on the HITs' project.
+        If language_pair is given, it constraints on the HITs' language pair.
+
+        Returns a dictionary mapping content hashes to lists of hit_ids, for
+        all content hashes shared by two or more HITs.
+
+        """
+        hits_qs = cls.objects.exclude(content_hash='')
+        if project:
+            hits_qs = hits_qs.filter(project=project)
+
+        if language_pair:
+            hits_qs = hits_qs.filter(language_pair=language_pair)
+
+        _duplicates = hits_qs.values('content_hash').annotate(
+          copies=models.Count('id')).filter(copies__gt=1).values(
+          'content_hash')
+
+        groups = {}
+        for content_hash, hit_id in hits_qs.filter(
+          content_hash__in=_duplicates).values_list('content_hash', 'hit_id'):
+            groups.setdefault(content_hash, []).append(hit_id)
+
+        return groups
+
+    @classmethod
+    def update_content_hashes(cls, project=None):
+        """
+        Computes missing content and segment hashes, e.g., for HITs which
+        have been imported before hashes were available.
+
+        Returns the number of updated HITs.
+
+        """
+        hits_qs = cls.objects.filter(content_hash='')
+        if project:
+            hits_qs = hits_qs.filter(project=project)
+
+        updated = 0
+        for hit in hits_qs:
+            cls.objects.filter(id=hit.id).update(
+              content_hash=compute_content_hash(hit.hit_xml))
+
+            for item in RankingTask.objects.filter(hit=hit):
+                RankingTask.objects.filter(id=item.id).update(
+                  segment_hash=compute_content_hash(item.item_xml))
+
+            updated = updated + 1
+
+        return updated
+
     # pylint: disable-msg=E1002
     def save(self, *args, **kwargs):
         """
         Makes sure that validation is run before saving an object instance.
         """
+        # HIT XML cannot be changed once created, hence neither can its hash.
+        if not self.id or not self.content_hash:
+            self.content_hash = compute_content_hash(self.hit_xml)
+
         # Enforce validation before saving HIT objects.
         if not self.id:
             self.full_clean()
@@ -363,36 +622,39 @@ class HIT(models.Model):
             except (ParseError), msg:
                 self.hit_attributes = {'note': msg}
 
-    def export_to_xml(self):
+    def export_to_xml(self, result_ids=None):
         """
         Renders this HIT as XML String.
-        """
-        template = get_template('wmt16/task_result.xml')
 
+        If result_ids is given, only these results and their items are
+        included.
+
+        """
         # If a hit_xml file is available, populate self.hit_attributes.
         self.reload_dynamic_fields()
 
-        _attr = self.hit_attributes.items()
-        attributes = ' '.join(['{}="{}"'.format(k, v) for k, v in _attr])
+        _attributes = [('hit-id', self.hit_id)] + self.hit_attributes.items()
+        output = [u'<HIT{0}>\n'.format(format_xml_attributes(_attributes))]
 
-        results = []
-        for item in RankingTask.objects.filter(hit=self):
-            item.reload_dynamic_fields()
+        # Uses related managers, so that prefetched objects can be used.
+        for item in self.rankingtask_set.all():
+            _results = [x for x in item.rankingresult_set.all()
+              if result_ids is None or x.id in result_ids]
+            if result_ids is not None and not _results:
+                continue
 
             try:
                 source_id = item.source[1]["id"]
             except:
                 source_id = -1
 
-            _results = []
-            for _result in item.rankingresult_set.all():
-                _results.append(_result.export_to_xml())
-
-            results.append((source_id, _results))
+            output.append(u'<ranking-task{0}>\n'.format(
+              format_xml_attributes([('id', source_id)])))
+            output.extend([x.export_to_xml() for x in _results])
+            output.append(u'</ranking-task>\n')
 
-        context = {'hit_id': self.hit_id, 'attributes': attributes,
-          'results': results}
-        return template.render(Context(context))
+        output.append(u'</HIT>\n')
+        return u''.join(output)
 
     def export_to_apf(self):
         """
@@ -491,6 +753,15 @@ class RankingTask(models.Model):
       verbose_name="RankingTask source XML"
     )
 
+    segment_hash = models.CharField(
+      max_length=32,
+      blank=True,
+      db_index=True,
+      editable=False,
+      help_text="MD5 hash of the normalized RankingTask source XML.",
+      verbose_name="Segment hash"
+    )
+
     # These fields are derived from item_xml and NOT stored in the database.
     attributes = None
     source = None
@@ -526,6 +797,8 @@ class RankingTask(models.Model):
         """
         Makes sure that validation is run before saving an object instance.
         """
+        self.segment_hash = compute_content_hash(self.item_xml)
+
         # Enforce validation before saving RankingTask objects.
         self.full_clean()
 
@@ -605,8 +878,13 @@ class RankingResult(models.Model):
         """
         super(RankingResult, self).__init__(*args, **kwargs)
 
-        # If raw_result is available, populate dynamic field.
-        self.reload_dynamic_fields()
+        # Remember which raw_result is reflected in PairwiseCount instances.
+        self._counted_raw_result = self.raw_result if self.id else None
+
+        # If raw_result is available, populate dynamic field.  The related
+        # item may not be loaded yet, e.g., when using select_related(), so
+        # self.systems is only computed by reload_dynamic_fields().
+        self.reload_dynamic_fields(count_systems=False)
 
     def __unicode__(self):
         """
@@ -614,7 +892,7 @@ class RankingResult(models.Model):
         """
         return u'<ranking-result id="{0}">'.format(self.id)
 
-    def reload_dynamic_fields(self):
+    def reload_dynamic_fields(self, count_systems=True):
         """
         Reloads source, reference, and translations from self.item_xml.
         """
@@ -623,12 +901,78 @@ class RankingResult(models.Model):
                 self.results = self.raw_result.split(',')
                 self.results = [int(x) for x in self.results]
 
-                self.systems = sum([len(x[1]['system'].split(',')) for x in self.item.translations])
+                if count_systems:
+                    self.systems = sum([len(x[1]['system'].split(',')) for x in self.item.translations])
 
             # pylint: disable-msg=W0703
             except Exception, msg:
                 self.results = msg
 
+    @classmethod
+    def get_redundant_results(cls, project=None, language_pair=None):
+        """
+        Returns a QuerySet of results for segments occurring in two or more
+        HITs, i.e., all results which may be repeated judgements.
+        """
+        results_qs = cls.objects.exclude(item__segment_hash='')
+        if project:
+            results_qs = results_qs.filter(item__hit__project=project)
+
+        if language_pair:
+            results_qs = results_qs.filter(item__hit__language_pair=language_pair)
+
+        _duplicates = RankingTask.objects.exclude(segment_hash='').values(
+          'segment_hash').annotate(copies=models.Count('id')).filter(
+          copies__gt=1).values('segment_hash')
+
+        return results_qs.filter(item__segment_hash__in=_duplicates)
+
+    @classmethod
+    def compute_repeated_judgements(cls, project=None, language_pair=None):
+        """
+        Computes results for segments which a user has judged repeatedly.
+
+        Segments are identified by their segment hash, hence this finds
+        users who have annotated two or more redundant copies of a HIT.
+
+        Returns a dictionary mapping (user_id, segment_hash) tuples to lists
+        of RankingResult instances, containing two or more results each.
+
+        """
+        judgements = {}
+        for result in cls.get_redundant_results(project,
+          language_pair).select_related('item__hit'):
+            _key = (result.user_id, result.item.segment_hash)
+            judgements.setdefault(_key, []).append(result)
+
+        for key in judgements.keys():
+            if len(judgements[key]) < 2:
+                del judgements[key]
+
+        return judgements
+
+    def iter_pairwise_comparisons(self, results=None):
+        """
+        Yields (systemA, rankA, systemB, rankB) tuples for this RankingResult.
+
+        Systems are paired as by the ranking cluster engine, see
+        iter_system_pairs() in appraise.wmt16.systems;  in particular, system
+        names are cleaned up and systems within the same multi-system are not
+        paired.  If results is given, it is used instead of self.results.
+
+        """
+        if results is None:
+            results = self.results
+
+        if not isinstance(results, list):
+            return iter([])
+
+        judgement = []
+        for index, translation in enumerate(self.item.translations):
+            judgement.append((translation[1]['system'], results[index]))
+
+        return iter_system_pairs(judgement)
+
     def export_to_xml(self):
         """
         Renders this RankingResult as XML String.
@@ -639,30 +983,22 @@ class RankingResult(models.Model):
         """
         Renders this RankingResult as Ranking XML String.
         """
-        template = get_template('wmt16/ranking_result.xml')
-
-        _attr = self.item.attributes.items()
-        attributes = ' '.join(['{}="{}"'.format(k, v) for k, v in _attr])
+        attributes = format_xml_attributes(self.item.attributes.items() + [
+          ('duration', self.duration), ('user', self.user.username)])
 
-        skipped = self.results is None
-
-        translations = []
-        if not skipped:
-            for index, translation in enumerate(self.item.translations):
-                _items = translation[1].items()
-                _attr = ' '.join(['{}="{}"'.format(k, v) for k, v in _items])
-                _rank = self.results[index]
-                translations.append((_attr, _rank))
+        if self.results is None:
+            return u'  <ranking-result{0} skipped="true" />\n'.format(
+              attributes)
 
-        context = {
-          'attributes': attributes,
-          'duration': '{}'.format(self.duration),
-          'skipped': skipped,
-          'translations': translations,
-          'user': self.user,
-        }
+        output = [u'  <ranking-result{0}>\n'.format(attributes)]
+        for index, translation in enumerate(self.item.translations):
+            _attributes = translation[1].items() + [
+              ('rank', self.results[index])]
+            output.append(u'    <translation{0} />\n'.format(
+              format_xml_attributes(_attributes)))
 
-        return template.render(Context(context))
+        output.append(u'  </ranking-result>\n')
+        return u''.join(output)
 
 
     def export_to_pairwise_csv(self):
@@ -676,7 +1012,18 @@ class RankingResult(models.Model):
         skipped = self.results is None
         if skipped:
             return None
-        
+
+        return u"\n".join(self.iter_pairwise_csv_rows())
+
+    def iter_pairwise_csv_rows(self):
+        """
+        Yields pairwise CSV rows for this RankingResult, see above.
+
+        Each row is yielded once, in the order of the original list-based
+        implementation, including pairs within multi-systems which share
+        the same rank.  Duplicates are detected using a set of rows.
+
+        """
         try:
             srcIndex = self.item.source[1]["id"]
         except:
@@ -691,68 +1038,36 @@ class RankingResult(models.Model):
         csv_data.append(srcIndex)                            # srcIndex
         csv_data.append(srcIndex)                            # segmentId
         csv_data.append(self.user.username)                  # judgeID
-        
-        base_values = csv_data
+        _prefix = u",".join(csv_data)
+        _suffix = str(self.item.id)                          # rankingID
 
         systems = set()
         for index, translation in enumerate(self.item.translations):
             name = translation[1]['system'].replace(',', '+')
             rank = self.results[index]
             systems.add((name, rank))
-            
-        csv_output = []
-        from itertools import combinations
+
+        seen = set()
         for (sysA, sysB) in combinations(systems, 2):
             # Compute all systems in sysA, sysB which can be multi systems
             expandedA = sysA[0].split('+')
             expandedB = sysB[0].split('+')
-            
-            # Pairwise comparisons without intra-multi-system pairs
-            for singleA in expandedA:
-                for singleB in expandedB:        
-                    csv_local = []
-                    csv_local.extend(base_values)
-                    csv_local.append(singleA)               # system1Id
-                    csv_local.append(str(sysA[1]))          # system1rank
-                    csv_local.append(singleB)               # system2Id
-                    csv_local.append(str(sysB[1]))          # system2rank
-                    csv_local.append(str(self.item.id))     # rankingID
-                    csv_joint = u",".join(csv_local)
-                    if not csv_joint in csv_output:
-                        csv_output.append(csv_joint)
-            
-            # Intra-multi-system pairs, sharing the same rank
-            # We'll only add these once to prevent duplicate entries
-            if len(expandedA) > 1:
-                for (singleA1, singleA2) in combinations(expandedA, 2):
-                    csv_local = []
-                    csv_local.extend(base_values)
-                    csv_local.append(singleA1)              # system1Id
-                    csv_local.append(str(sysA[1]))          # system1rank
-                    csv_local.append(singleA2)              # system2Id
-                    csv_local.append(str(sysA[1]))          # system2rank
-                    csv_local.append(str(self.item.id))     # rankingID
-                    csv_joint = u",".join(csv_local)
-                    if not csv_joint in csv_output:
-                        csv_output.append(csv_joint)
-                    
-            # Intra-multi-system pairs, sharing the same rank
-            # We'll only add these once to prevent duplicate entries
-            if len(expandedB) > 1:
-                for (singleB1, singleB2) in combinations(expandedB, 2):
-                    csv_local = []
-                    csv_local.extend(base_values)
-                    csv_local.append(singleB1)              # system1Id
-                    csv_local.append(str(sysB[1]))          # system1rank
-                    csv_local.append(singleB2)              # system2Id
-                    csv_local.append(str(sysB[1]))          # system2rank
-                    csv_local.append(str(self.item.id))     # rankingID
-                    csv_joint = u",".join(csv_local)
-                    if not csv_joint in csv_output:
-                        csv_output.append(csv_joint)
-
-        return u"\n".join(csv_output)
-        
+
+            # Pairwise comparisons without intra-multi-system pairs, followed
+            # by intra-multi-system pairs sharing the same rank.
+            pairs = [(x, sysA[1], y, sysB[1])
+              for x in expandedA for y in expandedB]
+            pairs.extend((x, sysA[1], y, sysA[1])
+              for x, y in combinations(expandedA, 2))
+            pairs.extend((x, sysB[1], y, sysB[1])
+              for x, y in combinations(expandedB, 2))
+
+            for systemA, rankA, systemB, rankB in pairs:
+                csv_joint = u"{0},{1},{2},{3},{4},{5}".format(_prefix,
+                  systemA, rankA, systemB, rankB, _suffix)
+                if not csv_joint in seen:
+                    seen.add(csv_joint)
+                    yield csv_joint
 
     def export_to_ranking_csv(self):
         """
@@ -943,8 +1258,9 @@ class RankingResult(models.Model):
         #   units.  This may happen for both sides, e.g., systems A, B.
         #
         # Note that srcIndex is 1-indexed for compatibility with evaluation
-        # scripts from previous editions of the WMT.
-        for a, b in combinations(range(5), 2):
+        # scripts from previous editions of the WMT.  Segments may have less
+        # than five translations if identical outputs have been merged.
+        for a, b in combinations(range(len(_systems)), 2):
             _c = self.user.username
             _i = '{0}.{1}.{2}'.format(item.source[1]['id'], a+1, b+1)
 
@@ -968,6 +1284,969 @@ class RankingResult(models.Model):
         return u'\n'.join(results)
 
 
+class PairwiseCount(models.Model):
+    """
+    Pairwise win/loss/tie counts for two systems.
+
+    Counts are kept per annotation project and language pair and are updated
+    whenever a RankingResult is saved or deleted, or its HIT is added to or
+    removed from a project.  By convention, system_a sorts before system_b
+    and wins counts how often system_a was ranked better than system_b.
+    Translations with rank -1 are not counted.  Systems are paired and named
+    as by the ranking cluster engine, see iter_system_pairs().
+
+    """
+    project = models.ForeignKey(
+      Project,
+      db_index=True
+    )
+
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+
+    system_a = models.CharField(max_length=200)
+
+    system_b = models.CharField(max_length=200)
+
+    wins = models.IntegerField(default=0)
+
+    losses = models.IntegerField(default=0)
+
+    ties = models.IntegerField(default=0)
+
+    class Meta:
+        """
+        Metadata options for the PairwiseCount object model.
+        """
+        ordering = ('project', 'language_pair', 'system_a', 'system_b')
+        unique_together = ('project', 'language_pair', 'system_a', 'system_b')
+        verbose_name = "Pairwise count"
+        verbose_name_plural = "Pairwise counts"
+
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this PairwiseCount object.
+        """
+        return u'<pairwise-count project="{0}" language-pair="{1}" ' \
+          'systems="{2},{3}" counts="{4}/{5}/{6}">'.format(self.project_id,
+          self.language_pair, self.system_a, self.system_b, self.wins,
+          self.losses, self.ties)
+
+    @classmethod
+    def compute_deltas(cls, result, raw_result):
+        """
+        Computes count deltas implied by the given result and raw_result.
+
+        Returns a dictionary mapping (system_a, system_b) tuples to lists of
+        [wins, losses, ties] deltas.
+
+        """
+        deltas = {}
+        if not raw_result or raw_result == 'SKIPPED':
+            return deltas
+
+        try:
+            results = [int(x) for x in raw_result.split(',')]
+            comparisons = list(result.iter_pairwise_comparisons(results))
+
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            LOGGER.debug(msg)
+            return deltas
+
+        for systemA, rankA, systemB, rankB in comparisons:
+            if rankA == -1 or rankB == -1 or systemA == systemB:
+                continue
+
+            if systemB < systemA:
+                systemA, rankA, systemB, rankB = systemB, rankB, systemA, rankA
+
+            _delta = deltas.setdefault((systemA, systemB), [0, 0, 0])
+            if rankA < rankB:
+                _delta[0] += 1
+            elif rankA > rankB:
+                _delta[1] += 1
+            else:
+                _delta[2] += 1
+
+        return deltas
+
+    @classmethod
+    def update_counts(cls, result, raw_result, sign=1, projects=None):
+        """
+        Adds (sign=1) or removes (sign=-1) counts for the given result.
+
+        Counts are updated for the given projects, by default for all
+        projects of the result's HIT.
+
+        """
+        deltas = cls.compute_deltas(result, raw_result)
+        if not deltas:
+            return
+
+        hit = result.item.hit
+        if projects is None:
+            projects = hit.project_set.all()
+
+        for project in projects:
+            with _atomic():
+                cls._add_deltas(project, hit.language_pair, deltas, sign)
+
+    @classmethod
+    def _add_deltas(cls, project, language_pair, deltas, sign=1):
+        """
+        Adds sign times the given deltas to the counts for the given project
+        and language pair.
+
+        Missing counts are created in bulk and counts with identical deltas
+        are updated using a single query, so that the number of queries does
+        not depend on the number of system pairs.
+
+        """
+        from django.db import IntegrityError
+
+        counts = cls.objects.filter(project=project,
+          language_pair=language_pair)
+        ids = dict(((x[0], x[1]), x[2]) for x in counts.values_list(
+          'system_a', 'system_b', 'id'))
+
+        missing = [x for x in deltas.keys() if not x in ids]
+        if missing:
+            try:
+                with _atomic():
+                    cls.objects.bulk_create([cls(project=project,
+                      language_pair=language_pair, system_a=x[0],
+                      system_b=x[1]) for x in missing])
+
+            # Some counts have been created concurrently.
+            except IntegrityError:
+                for system_a, system_b in missing:
+                    _get_or_create(cls, project=project,
+                      language_pair=language_pair, system_a=system_a,
+                      system_b=system_b)
+
+            ids = dict(((x[0], x[1]), x[2]) for x in counts.values_list(
+              'system_a', 'system_b', 'id'))
+
+        updates = {}
+        for systems, _delta in deltas.items():
+            updates.setdefault(tuple(_delta), []).append(ids[systems])
+
+        for (wins, losses, ties), _ids in updates.items():
+            for first in range(0, len(_ids), IDS_PER_QUERY):
+                cls.objects.filter(id__in=_ids[first:first + IDS_PER_QUERY]) \
+                  .update(wins=models.F('wins') + sign * wins,
+                  losses=models.F('losses') + sign * losses,
+                  ties=models.F('ties') + sign * ties)
+
+    @classmethod
+    def rebuild(cls, project):
+        """
+        Re-computes all counts for the given project from scratch.
+        """
+        cls.objects.filter(project=project).delete()
+
+        counts = {}
+        for result in RankingResult.objects.filter(
+          item__hit__project=project).select_related('item__hit'):
+            _language_pair = result.item.hit.language_pair
+            deltas = cls.compute_deltas(result, result.raw_result)
+            for systems, _delta in deltas.items():
+                _count = counts.setdefault((_language_pair,) + systems,
+                  [0, 0, 0])
+                for i in range(3):
+                    _count[i] += _delta[i]
+
+        cls.objects.bulk_create([cls(project=project, language_pair=key[0],
+          system_a=key[1], system_b=key[2], wins=value[0], losses=value[1],
+          ties=value[2]) for key, value in counts.items()])
+
+    @classmethod
+    def compute_win_ratios(cls, project, language_pair):
+        """
+        Computes expected win ratios for the given project and language pair.
+
+        Like the ranking clusters, ties are ignored.  Returns a list of
+        (win_ratio, system) tuples, sorted by descending win ratio.
+
+        """
+        ratios = {}
+        for count in cls.objects.filter(project=project,
+          language_pair=language_pair):
+            _total = count.wins + count.losses
+            if not _total:
+                continue
+            ratios.setdefault(count.system_a, []).append(
+              count.wins / float(_total))
+            ratios.setdefault(count.system_b, []).append(
+              count.losses / float(_total))
+
+        win_ratios = []
+        for system, _ratios in ratios.items():
+            _ratio = sum(_ratios) / float(max(len(ratios) - 1, 1))
+            win_ratios.append((_ratio, system))
+        win_ratios.sort(reverse=True)
+
+        return win_ratios
+
+
+class SystemRating(models.Model):
+    """
+    Online TrueSkill rating of a system.
+
+    Ratings are kept per annotation project and language pair and are
+    updated whenever a new RankingResult is saved.  As online updates cannot
+    be undone, edited or deleted results are only reflected after rebuild().
+
+    """
+    project = models.ForeignKey(
+      Project,
+      db_index=True
+    )
+
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+
+    system = models.CharField(max_length=200)
+
+    mu = models.FloatField()
+
+    sigma = models.FloatField()
+
+    comparisons = models.IntegerField(default=0)
+
+    class Meta:
+        """
+        Metadata options for the SystemRating object model.
+        """
+        ordering = ('project', 'language_pair', '-mu')
+        unique_together = ('project', 'language_pair', 'system')
+        verbose_name = "System rating"
+        verbose_name_plural = "System ratings"
+
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this SystemRating object.
+        """
+        return u'<system-rating project="{0}" language-pair="{1}" ' \
+          'system="{2}" mu="{3:.3f}" sigma="{4:.3f}">'.format(self.project_id,
+          self.language_pair, self.system, self.mu, self.sigma)
+
+    def conservative_score(self):
+        """
+        Returns a conservative skill estimate for this system.
+        """
+        from appraise.wmt16.ratings import conservative_score
+        return conservative_score(self.mu, self.sigma)
+
+    @classmethod
+    def _compute_comparisons(cls, result, raw_result):
+        """
+        Returns pairwise comparisons implied by the given raw_result.
+        """
+        if not raw_result or raw_result == 'SKIPPED':
+            return []
+
+        try:
+            results = [int(x) for x in raw_result.split(',')]
+            return list(result.iter_pairwise_comparisons(results))
+
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            LOGGER.debug(msg)
+            return []
+
+    @classmethod
+    def update_ratings(cls, result, raw_result):
+        """
+        Updates ratings with the comparisons for the given result.
+
+        Ratings of the compared systems are locked while they are updated,
+        so that concurrent updates are not lost.
+
+        """
+        from appraise.wmt16.ratings import INITIAL_MU, INITIAL_SIGMA, \
+          rate_comparisons
+
+        comparisons = cls._compute_comparisons(result, raw_result)
+        counts = cls._count_comparisons(comparisons)
+        if not counts:
+            return
+
+        hit = result.item.hit
+        systems = sorted(counts.keys())
+        for project in hit.project_set.all():
+            with _atomic():
+                for system in systems:
+                    _get_or_create(cls, project=project,
+                      language_pair=hit.language_pair, system=system,
+                      defaults={'mu': INITIAL_MU, 'sigma': INITIAL_SIGMA})
+
+                instances = {}
+                for rating in cls.objects.select_for_update().filter(
+                  project=project, language_pair=hit.language_pair,
+                  system__in=systems).order_by('system'):
+                    instances[rating.system] = rating
+
+                ratings = dict((x.system, (x.mu, x.sigma))
+                  for x in instances.values())
+                for system in rate_comparisons(ratings, comparisons):
+                    _rating = instances[system]
+                    _rating.mu, _rating.sigma = ratings[system]
+                    _rating.comparisons += counts[system]
+                    _rating.save()
+
+    @classmethod
+    def _count_comparisons(cls, comparisons):
+        """
+        Returns a dictionary mapping systems to their number of comparisons.
+        """
+        counts = {}
+        for systemA, rankA, systemB, rankB in comparisons:
+            if rankA == -1 or rankB == -1 or systemA == systemB:
+                continue
+
+            counts[systemA] = counts.get(systemA, 0) + 1
+            counts[systemB] = counts.get(systemB, 0) + 1
+
+        return counts
+
+    @classmethod
+    def rebuild(cls, project):
+        """
+        Re-computes all ratings for the given project from scratch.
+
+        Results are replayed in order of their creation.
+
+        """
+        from appraise.wmt16.ratings import rate_comparisons
+
+        cls.objects.filter(project=project).delete()
+
+        ratings = {}
+        counts = {}
+        for result in RankingResult.objects.filter(
+          item__hit__project=project).select_related('item__hit').order_by(
+          'id'):
+            _language_pair = result.item.hit.language_pair
+            comparisons = cls._compute_comparisons(result, result.raw_result)
+            rate_comparisons(ratings.setdefault(_language_pair, {}),
+              comparisons)
+
+            _counts = counts.setdefault(_language_pair, {})
+            for system, count in cls._count_comparisons(comparisons).items():
+                _counts[system] = _counts.get(system, 0) + count
+
+        instances = []
+        for language_pair, _ratings in ratings.items():
+            for system, (mu, sigma) in _ratings.items():
+                instances.append(cls(project=project,
+                  language_pair=language_pair, system=system, mu=mu,
+                  sigma=sigma, comparisons=counts[language_pair][system]))
+
+        cls.objects.bulk_create(instances)
+
+
+class RankingClusterData(models.Model):
+    """
+    Stores computed ranking clusters for a language pair.
+
+    Instances are keyed by annotation project, language pair, a watermark
+    identifying the underlying results, and the algorithm parameters.  Next
+    to the clusters, pairwise win ratios and p-values are stored.  If
+    project is None, clusters have been computed over all projects.  Older
+    versions are kept s.t. they can be compared to more recent ones.
+
+    """
+    project = models.ForeignKey(
+      Project,
+      blank=True,
+      db_index=True,
+      null=True
+    )
+
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+
+    watermark = models.CharField(max_length=100)
+
+    parameters = models.CharField(max_length=200)
+
+    clusters = models.TextField()
+
+    significance = models.TextField(blank=True)
+
+    resamples = models.IntegerField(default=0)
+
+    date_and_time = models.DateTimeField(
+      auto_now_add=True,
+      editable=False
+    )
+
+    class Meta:
+        """
+        Metadata options for the RankingClusterData object model.
+        """
+        ordering = ('-date_and_time',)
+        unique_together = ('project', 'language_pair', 'watermark',
+          'parameters')
+        verbose_name = "Ranking cluster data"
+        verbose_name_plural = "Ranking cluster data"
+
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this RankingClusterData object.
+        """
+        return u'<ranking-clusters project="{0}" language-pair="{1}" ' \
+          'watermark="{2}" parameters="{3}">'.format(self.project_id,
+          self.language_pair, self.watermark, self.parameters)
+
+    @classmethod
+    def encode_parameters(cls, **parameters):
+        """
+        Encodes the given algorithm parameters as canonical JSON String.
+        """
+        from json import dumps
+        return dumps(parameters, sort_keys=True)
+
+    @classmethod
+    def lookup(cls, project, language_pair, watermark, parameters):
+        """
+        Returns the matching RankingClusterData instance or None.
+        """
+        _data = cls.objects.filter(project=project,
+          language_pair=language_pair, watermark=watermark,
+          parameters=parameters)
+        if _data.exists():
+            return _data[0]
+
+        return None
+
+    @classmethod
+    def latest(cls, project, language_pair):
+        """
+        Returns the most recent RankingClusterData instance or None.
+        """
+        _data = cls.objects.filter(project=project,
+          language_pair=language_pair).order_by('-date_and_time', '-id')
+        if _data.exists():
+            return _data[0]
+
+        return None
+
+    def get_clusters(self):
+        """
+        Returns the decoded list of clusters.
+        """
+        from json import loads
+        return loads(self.clusters)
+
+    def set_clusters(self, clusters):
+        """
+        Encodes the given list of clusters.
+        """
+        from json import dumps
+        self.clusters = dumps(clusters)
+
+    def get_significance(self):
+        """
+        Returns the decoded pairwise significance data or None.
+        """
+        if not self.significance:
+            return None
+
+        from json import loads
+        return loads(self.significance)
+
+    def set_significance(self, significance):
+        """
+        Encodes the given pairwise significance data.
+        """
+        from json import dumps
+        self.significance = dumps(significance)
+
+
+# AgreementItem fields counting A>B, A<B and A=B verdicts;  verdicts are
+# encoded as indices into this tuple.
+VERDICT_FIELDS = ('better', 'worse', 'ties')
+
+
+class AgreementItem(models.Model):
+    """
+    Counts verdicts of all annotators for one item.
+
+    Items are defined as in compute_agreement_scores.py:  a source segment
+    and an ordered pair of (multi-)systems as displayed to the annotator.
+    As keys can get long, items are identified by their MD5 hash.
+
+    """
+    project = models.ForeignKey(
+      Project,
+      db_index=True
+    )
+
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+
+    item_hash = models.CharField(max_length=32, db_index=True)
+
+    better = models.IntegerField(default=0)
+
+    worse = models.IntegerField(default=0)
+
+    ties = models.IntegerField(default=0)
+
+    class Meta:
+        """
+        Metadata options for the AgreementItem object model.
+        """
+        unique_together = ('project', 'language_pair', 'item_hash')
+        verbose_name = "Agreement item"
+        verbose_name_plural = "Agreement items"
+
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this AgreementItem object.
+        """
+        return u'<agreement-item project="{0}" language-pair="{1}" ' \
+          'hash="{2}" counts="{3}/{4}/{5}">'.format(self.project_id,
+          self.language_pair, self.item_hash, self.better, self.worse,
+          self.ties)
+
+    @classmethod
+    def compute_decisions(cls, result, raw_result):
+        """
+        Returns (item_hash, verdict) tuples for the given raw_result.
+
+        Verdicts are indices into VERDICT_FIELDS.  Translations with rank -1
+        are skipped as these don't contribute.
+
+        """
+        from hashlib import md5
+
+        if not raw_result or raw_result == 'SKIPPED':
+            return []
+
+        try:
+            results = [int(x) for x in raw_result.split(',')]
+            _source_id = result.item.source[1]['id']
+            _systems = [x[1]['system'].replace(',', '+')
+              for x in result.item.translations]
+
+        # pylint: disable-msg=W0703
+        except Exception, msg:
+            LOGGER.debug(msg)
+            return []
+
+        decisions = []
+        for a in range(len(_systems)):
+            for b in range(a + 1, len(_systems)):
+                if results[a] == -1 or results[b] == -1:
+                    continue
+
+                _key = u'{0}.{1}.{2}'.format(_source_id, _systems[a],
+                  _systems[b])
+                _hash = md5(_key.encode('utf-8')).hexdigest()
+
+                if results[a] < results[b]:
+                    decisions.append((_hash, 0))
+                elif results[a] > results[b]:
+                    decisions.append((_hash, 1))
+                else:
+                    decisions.append((_hash, 2))
+
+        return decisions
+
+
+class AgreementCount(models.Model):
+    """
+    Inter-annotator agreement counts for a language pair.
+
+    These are the (identical, comparable, ties, total) counts which are also
+    computed by compute_agreement_scores.py.  Counts are updated whenever a
+    RankingResult is saved or deleted, using per-item verdict counts.
+
+    """
+    project = models.ForeignKey(
+      Project,
+      db_index=True
+    )
+
+    language_pair = models.CharField(
+      max_length=7,
+      choices=LANGUAGE_PAIR_CHOICES,
+      db_index=True
+    )
+
+    identical = models.IntegerField(default=0)
+
+    comparable = models.IntegerField(default=0)
+
+    ties = models.IntegerField(default=0)
+
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        """
+        Metadata options for the AgreementCount object model.
+        """
+        ordering = ('project', 'language_pair')
+        unique_together = ('project', 'language_pair')
+        verbose_name = "Agreement count"
+        verbose_name_plural = "Agreement counts"
+
+    def __unicode__(self):
+        """
+        Returns a Unicode String for this AgreementCount object.
+        """
+        return u'<agreement-count project="{0}" language-pair="{1}" ' \
+          'counts="{2}/{3}/{4}/{5}">'.format(self.project_id,
+          self.language_pair, self.identical, self.comparable, self.ties,
+          self.total)
+
+    def compute_kappa(self):
+        """
+        Returns a tuple (pA, pE, kappa) as in compute_agreement_scores.py.
+
+        If all verdicts are ties, p(E) is 1 and kappa is undefined;  it is
+        None in this case.
+
+        """
+        # Compute p(A) probability.
+        pA = self.identical / float(self.comparable or 1)
+
+        # Compute p(E) empirically, based on the number of observed ties.
+        pTies = self.ties / float(self.total or 1)
+        pNoTies = 1.0 - pTies
+        pE = pTies**2 + (pNoTies/2.0)**2 + (pNoTies/2.0)**2
+
+        kappa = None
+        if pE < 1.0:
+            kappa = (pA - pE) / float(1.0 - pE)
+
+        return (pA, pE, kappa)
+
+    @classmethod
+    def update_counts(cls, result, raw_result, sign=1, projects=None):
+        """
+        Adds (sign=1) or removes (sign=-1) verdicts for the given result.
+
+        Adding a verdict to an item with n verdicts, n_v of which are the
+        same, adds n comparable and n_v identical pairs.  If projects is None,
+        counts are updated for all projects containing the result's HIT.
+
+        """
+        decisions = AgreementItem.compute_decisions(result, raw_result)
+        if not decisions:
+            return
+
+        hit = result.item.hit
+        if projects is None:
+            projects = hit.project_set.all()
+
+        # Items are locked in a fixed order, so that concurrent updates can
+        # neither compute deltas from outdated verdict counts nor deadlock.
+        decisions = sorted(decisions, key=lambda x: x[0])
+        for project in projects:
+            with _atomic():
+                deltas = [0, 0, 0, 0]
+                for item_hash, verdict in decisions:
+                    _item = _get_or_create(AgreementItem, project=project,
+                      language_pair=hit.language_pair, item_hash=item_hash)
+                    _item = AgreementItem.objects.select_for_update().get(
+                      id=_item.id)
+
+                    _field = VERDICT_FIELDS[verdict]
+                    _counts = [_item.better, _item.worse, _item.ties]
+                    if sign < 0:
+                        _counts[verdict] -= 1
+
+                    deltas[0] += sign * _counts[verdict]
+                    deltas[1] += sign * sum(_counts)
+                    deltas[2] += sign * (verdict == 2)
+                    deltas[3] += sign
+
+                    AgreementItem.objects.filter(id=_item.id).update(
+                      **{_field: models.F(_field) + sign})
+
+                _count = _get_or_create(cls, project=project,
+                  language_pair=hit.language_pair)
+                cls.objects.filter(id=_count.id).update(
+                  identical=models.F('identical') + deltas[0],
+                  comparable=models.F('comparable') + deltas[1],
+                  ties=models.F('ties') + deltas[2],
+                  total=models.F('total') + deltas[3])
+
+    @classmethod
+    def rebuild(cls, project):
+        """
+        Re-computes all items and counts for the given project from scratch.
+        """
+        AgreementItem.objects.filter(project=project).delete()
+        cls.objects.filter(project=project).delete()
+
+        items = {}
+        for result in RankingResult.objects.filter(
+          item__hit__project=project).select_related('item__hit'):
+            _language_pair = result.item.hit.language_pair
+            for item_hash, verdict in AgreementItem.compute_decisions(result,
+              result.raw_result):
+                _counts = items.setdefault((_language_pair, item_hash),
+                  [0, 0, 0])
+                _counts[verdict] += 1
+
+        counts = {}
+        for (language_pair, _), _counts in items.items():
+            _total = sum(_counts)
+            _data = counts.setdefault(language_pair, [0, 0, 0, 0])
+            _data[0] += sum(x * (x - 1) // 2 for x in _counts)
+            _data[1] += _total * (_total - 1) // 2
+            _data[2] += _counts[2]
+            _data[3] += _total
+
+        AgreementItem.objects.bulk_create([AgreementItem(project=project,
+          language_pair=key[0], item_hash=key[1], better=value[0],
+          worse=value[1], ties=value[2]) for key, value in items.items()])
+        cls.objects.bulk_create([cls(project=project, language_pair=key,
+          identical=value[0], comparable=value[1], ties=value[2],
+          total=value[3]) for key, value in counts.items()])
+
+    @classmethod
+    def compute_intra_counts(cls, project):
+        """
+        Computes intra-annotator agreement counts for the given project.
+
+        Only verdicts of the same user on the same item of a repeatedly
+        judged segment are compared, as in compute_agreement_scores.py.
+
+        Returns a list of unsaved AgreementCount instances, one for each
+        language pair with repeated judgements.
+
+        """
+        counts = {}
+        for results in RankingResult.compute_repeated_judgements(
+          project).values():
+            _language_pair = results[0].item.hit.language_pair
+            items = {}
+            for result in results:
+                for item_hash, verdict in AgreementItem.compute_decisions(
+                  result, result.raw_result):
+                    items.setdefault(item_hash, [0, 0, 0])[verdict] += 1
+
+            # Skipped or partial repetitions may not yield any comparisons.
+            if max([sum(x) for x in items.values()] or [0]) < 2:
+                continue
+
+            _data = counts.setdefault(_language_pair, [0, 0, 0, 0])
+            for _counts in items.values():
+                _total = sum(_counts)
+                _data[0] += sum(x * (x - 1) // 2 for x in _counts)
+                _data[1] += _total * (_total - 1) // 2
+                _data[2] += _counts[2]
+                _data[3] += _total
+
+        return [cls(project=project, language_pair=key, identical=value[0],
+          comparable=value[1], ties=value[2], total=value[3])
+          for key, value in sorted(counts.items())]
+
+
+@receiver(models.signals.post_save, sender=RankingResult)
+def update_result_statistics(sender, instance, created, **kwargs):
+    """
+    Updates PairwiseCount, SystemRating and AgreementCount instances for
+    the given RankingResult.
+    """
+    if instance._counted_raw_result == instance.raw_result:
+        return
+
+    PairwiseCount.update_counts(instance, instance._counted_raw_result, -1)
+    PairwiseCount.update_counts(instance, instance.raw_result)
+
+    AgreementCount.update_counts(instance, instance._counted_raw_result, -1)
+    AgreementCount.update_counts(instance, instance.raw_result)
+
+    # Online ratings are only updated for newly available results.
+    if not instance._counted_raw_result:
+        SystemRating.update_ratings(instance, instance.raw_result)
+
+    instance._counted_raw_result = instance.raw_result
+
+
+@receiver(models.signals.post_delete, sender=RankingResult)
+def remove_result_statistics(sender, instance, **kwargs):
+    """
+    Removes PairwiseCount and AgreementCount contributions of the given
+    RankingResult.
+    """
+    try:
+        PairwiseCount.update_counts(instance, instance._counted_raw_result, -1)
+        AgreementCount.update_counts(instance, instance._counted_raw_result,
+          -1)
+        instance._counted_raw_result = None
+
+    except (HIT.DoesNotExist, RankingTask.DoesNotExist):
+        pass
+
+
+@receiver(models.signals.m2m_changed, sender=Project.HITs.through)
+def update_project_statistics(sender, instance, action, reverse, pk_set,
+  **kwargs):
+    """
+    Adds or removes PairwiseCount and AgreementCount contributions of HITs
+    which are added to or removed from a project.
+    """
+    # Clearing a project removes all of its counts.
+    if action == 'post_clear' and not reverse:
+        PairwiseCount.objects.filter(project=instance).delete()
+        AgreementItem.objects.filter(project=instance).delete()
+        AgreementCount.objects.filter(project=instance).delete()
+        return
+
+    if not action in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+
+    # For reverse relations, instance is a HIT and pk_set has project ids.
+    # Removed HITs are still related, added HITs are related already.
+    if reverse:
+        hits = [instance]
+        projects = instance.project_set.all()
+        if action != 'pre_clear':
+            projects = projects.filter(id__in=pk_set)
+
+    elif action == 'pre_clear':
+        return
+
+    else:
+        hits = instance.HITs.filter(id__in=pk_set)
+        projects = [instance]
+
+    projects = list(projects)
+    if not projects:
+        return
+
+    sign = 1 if action == 'post_add' else -1
+    for result in RankingResult.objects.filter(item__hit__in=hits) \
+      .select_related('item__hit'):
+        PairwiseCount.update_counts(result, result._counted_raw_result, sign,
+          projects)
+        AgreementCount.update_counts(result, result._counted_raw_result, sign,
+          projects)
+
+
+@receiver(models.signals.post_save, sender=RankingResult)
+def update_result_snapshots(sender, instance, created, **kwargs):
+    """
+    Appends new results for completed HITs to export snapshots.  Snapshots
+    containing an edited result are marked as stale instead.
+    """
+    from appraise.wmt16.exports import refresh_snapshots
+
+    hit = instance.item.hit
+    if created and not hit.completed:
+        return
+
+    instance.reload_dynamic_fields()
+    for project in hit.project_set.all():
+        refresh_snapshots(project, [instance] if created else None)
+
+
+@receiver(models.signals.post_delete, sender=RankingResult)
+def remove_result_snapshots(sender, instance, **kwargs):
+    """
+    Marks export snapshots containing the given RankingResult as stale.
+    """
+    from appraise.wmt16.exports import refresh_snapshots
+
+    try:
+        for project in instance.item.hit.project_set.all():
+            refresh_snapshots(project)
+
+    except (HIT.DoesNotExist, RankingTask.DoesNotExist):
+        pass
+
+
+@receiver(models.signals.post_save, sender=HIT)
+def update_hit_snapshots(sender, instance, created, **kwargs):
+    """
+    Appends results to export snapshots once a HIT has been completed.
+    """
+    if instance.completed == instance._completed_on_load:
+        return
+
+    from appraise.wmt16.exports import refresh_snapshots
+
+    instance._completed_on_load = instance.completed
+    results = None
+    if instance.completed:
+        results = list(RankingResult.objects.filter(item__hit=instance)
+          .select_related('item__hit', 'user'))
+
+    for project in instance.project_set.all():
+        refresh_snapshots(project, results)
+
+
+@receiver(models.signals.pre_delete, sender=HIT)
+def remove_hit_snapshots(sender, instance, **kwargs):
+    """
+    Marks export snapshots containing results for the given HIT as stale.
+    """
+    from appraise.wmt16.exports import refresh_snapshots
+
+    if instance.completed:
+        for project in instance.project_set.all():
+            refresh_snapshots(project)
+
+
+@receiver(models.signals.m2m_changed, sender=Project.HITs.through)
+def update_project_snapshots(sender, instance, action, reverse, pk_set,
+  **kwargs):
+    """
+    Marks export snapshots as stale if completed HITs are added to or
+    removed from a project.
+    """
+    if not action in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    from appraise.wmt16.exports import refresh_snapshots
+
+    # For reverse relations, instance is a HIT and pk_set has project ids.
+    if reverse:
+        if not instance.completed:
+            return
+
+        if action == 'pre_clear':
+            projects = instance.project_set.all()
+        else:
+            projects = Project.objects.filter(id__in=pk_set)
+
+    else:
+        results = RankingResult.objects.filter(item__hit__completed=True)
+        if action == 'pre_clear':
+            results = results.filter(item__hit__project=instance)
+        else:
+            results = results.filter(item__hit__id__in=pk_set)
+
+        if not results.exists():
+            return
+
+        projects = [instance]
+
+    for project in projects:
+        refresh_snapshots(project)
+
+
 @receiver(models.signals.post_save, sender=RankingResult)
 def update_user_hit_mappings(sender, instance, created, **kwargs):
     """
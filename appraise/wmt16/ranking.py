@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Computes ranking clusters based on expected win ratios and bootstrap
+resampling.  This is a port of Philipp Koehn's compute_ranking_clusters.perl
+which works on integer-coded pairwise win counts instead of text files.
+
+"""
+import logging
+
+import numpy as np
+
+from appraise.bootstrap import compute_bootstrap_shards, create_pool, \
+  iter_shard_results
+from appraise.settings import LOG_LEVEL, LOG_HANDLER
+from appraise.wmt16.systems import iter_system_pairs
+
+# Setup logging support.
+logging.basicConfig(level=LOG_LEVEL)
+LOGGER = logging.getLogger('appraise.wmt16.ranking')
+LOGGER.addHandler(LOG_HANDLER)
+
+# Number of bootstrap resamples computed by a single worker task.
+RESAMPLES_PER_SHARD = 25
+
+# Adaptive bootstrap settings:  resamples are added in batches until rank
+# ranges have not changed for STABLE_BATCHES successive batches.  The Perl
+# code used a fixed number of 100 resamples;  we never compute fewer, hence
+# adaptive resampling only adds resamples for unstable language pairs.
+RESAMPLES_PER_BATCH = 25
+STABLE_BATCHES = 2
+MINIMUM_RESAMPLES = 100
+MAXIMUM_RESAMPLES = 2000
+
+# Probability mass which has to be covered by a system's rank range.
+RANK_RANGE_CONFIDENCE = 0.95
+
+
+def encode_judgements(judgements):
+    """
+    Integer-encodes the given ranking judgements for one language pair.
+
+    Each judgement is a list of (systems, rank) tuples, one per translation
+    of the ranked segment.  Multi-systems are given as a comma-separated
+    systems value and expanded into their individual systems, see
+    iter_system_pairs().  Ranks of -1 denote translations which have not
+    been ranked and are ignored.
+
+    Returns a tuple (systems, judgement_index, winners, losers) where systems
+    is the sorted list of system names and the three integer arrays contain
+    one entry per pairwise win implied by the judgements.
+
+    """
+    system_names = set()
+    judgement_index = []
+    winners = []
+    losers = []
+
+    for index, judgement in enumerate(judgements):
+        for systemA, rankA, systemB, rankB in iter_system_pairs(judgement):
+            # Ties do not contribute to expected win ratios.
+            if rankA == -1 or rankB == -1 or rankA == rankB:
+                continue
+
+            if rankB < rankA:
+                systemA, systemB = systemB, systemA
+
+            judgement_index.append(index)
+            winners.append(systemA)
+            losers.append(systemB)
+            system_names.update((systemA, systemB))
+
+    systems = sorted(system_names)
+    _codes = dict((system, code) for code, system in enumerate(systems))
+
+    judgement_index = np.array(judgement_index, dtype=np.int64)
+    winners = np.array([_codes[x] for x in winners], dtype=np.int64)
+    losers = np.array([_codes[x] for x in losers], dtype=np.int64)
+
+    return (systems, judgement_index, winners, losers)
+
+
+def compute_win_matrix(number_of_systems, winners, losers, weights=None):
+    """
+    Computes the number_of_systems x number_of_systems matrix of wins.
+
+    If weights is given, each pairwise win is counted with its weight.
+
+    """
+    cells = winners * number_of_systems + losers
+    wins = np.bincount(cells, weights=weights,
+      minlength=number_of_systems * number_of_systems)
+    return wins.reshape((number_of_systems, number_of_systems))
+
+
+def compute_count_win_matrix(counts):
+    """
+    Computes the matrix of wins from the given pairwise counts.
+
+    counts contains (system_a, system_b, wins, losses) tuples, e.g., from
+    PairwiseCount instances, where wins are those of system_a over system_b.
+    Returns a tuple (systems, wins) where systems is the sorted list of
+    system names, as for encode_judgements() and compute_win_matrix().
+
+    """
+    systems = sorted(set(x[0] for x in counts) | set(x[1] for x in counts))
+    _codes = dict((system, code) for code, system in enumerate(systems))
+
+    wins = np.zeros((len(systems), len(systems)), dtype=np.int64)
+    for system_a, system_b, _wins, _losses in counts:
+        wins[_codes[system_a], _codes[system_b]] += _wins
+        wins[_codes[system_b], _codes[system_a]] += _losses
+
+    return (systems, wins)
+
+
+def compute_expected_win_ratios(wins):
+    """
+    Computes the expected win ratio for each system from the given wins.
+
+    Systems without any comparisons get a ratio of NaN.
+
+    """
+    totals = wins + wins.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(totals > 0, wins / totals.astype(float), 0.0)
+
+    compared = totals.sum(axis=1) > 0
+    number_of_compared = compared.sum()
+
+    expected = ratios.sum(axis=1) / float(max(number_of_compared - 1, 1))
+    expected[~compared] = np.nan
+    return expected
+
+
+def compute_pairwise_win_ratios(wins):
+    """
+    Computes the matrix of head-to-head win ratios from the given wins.
+
+    Entry [i, j] is the ratio of comparisons between systems i and j which
+    system i has won;  pairs without any comparisons get a ratio of NaN.
+
+    """
+    totals = wins + wins.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = wins / totals.astype(float)
+
+    ratios[totals == 0] = np.nan
+    return ratios
+
+
+def compute_sign_test_p_values(wins):
+    """
+    Computes two-sided sign test p-values for all pairs of systems.
+
+    Ties have already been dropped from the given wins.  For each pair, the
+    binomial tail probabilities are computed from a table of log factorials,
+    vectorized over all pairs at once.  Pairs without any comparisons get a
+    p-value of NaN.
+
+    """
+    _systems = wins.shape[0]
+    p_values = np.empty((_systems, _systems))
+    p_values.fill(np.nan)
+
+    totals = (wins + wins.T).astype(np.int64)
+    first, second = np.triu_indices(_systems, 1)
+    _totals = totals[first, second]
+    compared = _totals > 0
+    if not compared.any():
+        return p_values
+
+    first, second, _totals = first[compared], second[compared], \
+      _totals[compared]
+    _minimum = np.minimum(wins[first, second], wins[second, first]).astype(
+      np.int64)
+
+    log_factorials = np.concatenate(([0.0],
+      np.cumsum(np.log(np.arange(1, _totals.max() + 1)))))
+
+    # Matrix of binomial log probabilities, one row per pair of systems.
+    _outcomes = np.arange(_minimum.max() + 1)
+    _valid = _outcomes[np.newaxis, :] <= _minimum[:, np.newaxis]
+    _others = np.where(_valid, _totals[:, np.newaxis] - _outcomes, 0)
+    log_probabilities = log_factorials[_totals][:, np.newaxis] \
+      - log_factorials[np.where(_valid, _outcomes, 0)] \
+      - log_factorials[_others] - _totals[:, np.newaxis] * np.log(2)
+
+    tails = np.where(_valid, np.exp(log_probabilities), 0.0).sum(axis=1)
+    _p_values = np.minimum(2 * tails, 1.0)
+
+    p_values[first, second] = _p_values
+    p_values[second, first] = _p_values
+    return p_values
+
+
+def compute_bootstrap_p_values(wins, reversals, number_of_resamples):
+    """
+    Computes two-sided bootstrap p-values for all pairs of systems.
+
+    reversals[i, j] counts resamples in which system i has not won more
+    comparisons against system j than it lost.  For pairs where system i
+    wins on the full data, the p-value is twice the share of such resamples.
+    Pairs without any comparisons get a p-value of NaN.
+
+    """
+    p_values = np.ones(wins.shape)
+    if number_of_resamples:
+        _better = wins > wins.T
+        _shares = np.minimum(2 * reversals / float(number_of_resamples), 1.0)
+        p_values[_better] = _shares[_better]
+        p_values[_better.T] = _shares.T[_better.T]
+
+    p_values[(wins + wins.T) == 0] = np.nan
+    return p_values
+
+
+def bootstrap_rank_histogram(systems, judgement_index, winners, losers,
+  number_of_judgements, number_of_resamples, random_state, reversals=None):
+    """
+    Computes a histogram of bootstrapped ranks for the given systems.
+
+    Each resample draws number_of_judgements judgements with replacement.
+    Returns a len(systems) x len(systems) array where [i, r] is the number of
+    resamples in which system i has been ranked at position r+1.
+
+    If reversals is given, [i, j] is incremented for each resample in which
+    system i has not won more comparisons against system j than it lost.
+
+    """
+    _systems = len(systems)
+    histogram = np.zeros((_systems, _systems), dtype=np.int64)
+    if not _systems or not number_of_judgements:
+        return histogram
+
+    # Systems are ranked by descending score, ties are broken by descending
+    # system name just like `reverse sort` does in the Perl code.
+    name_order = np.arange(_systems)
+
+    for _ in range(number_of_resamples):
+        sample = random_state.randint(0, number_of_judgements,
+          size=number_of_judgements)
+        counts = np.bincount(sample, minlength=number_of_judgements)
+        wins = compute_win_matrix(_systems, winners, losers,
+          weights=counts[judgement_index])
+
+        scores = np.round(compute_expected_win_ratios(wins), 4)
+        compared = ~np.isnan(scores)
+        scores[~compared] = -np.inf
+
+        order = np.lexsort((-name_order, -scores))
+        ranks = np.empty(_systems, dtype=np.int64)
+        ranks[order] = np.arange(_systems)
+
+        histogram[name_order[compared], ranks[compared]] += 1
+
+        if reversals is not None:
+            reversals += wins <= wins.T
+
+    return histogram
+
+
+def compute_rank_range(ranks, confidence=RANK_RANGE_CONFIDENCE):
+    """
+    Computes the rank range for the given bootstrap rank counts.
+
+    Starting from the most frequent rank, the range is greedily extended to
+    the more frequent neighbour until it covers the given confidence mass.
+    Returns a (start, end) tuple of 1-based ranks.
+
+    """
+    _total = ranks.sum()
+    if not _total:
+        return (None, None)
+
+    start = end = int(np.argmax(ranks))
+    covered = ranks[start]
+    while covered < _total * confidence:
+        _left = ranks[start - 1] if start > 0 else 0
+        _right = ranks[end + 1] if end + 1 < len(ranks) else 0
+
+        if not _left and end + 1 < len(ranks):
+            end += 1
+            covered += ranks[end]
+        elif not _right and start > 0:
+            start -= 1
+            covered += ranks[start]
+        elif _left > _right:
+            start -= 1
+            covered += ranks[start]
+        elif end + 1 < len(ranks):
+            end += 1
+            covered += ranks[end]
+        else:
+            break
+
+    return (start + 1, end + 1)
+
+
+def format_rank_range(rank_range):
+    """
+    Formats the given (start, end) rank range as in the Perl code.
+    """
+    start, end = rank_range
+    if start == end:
+        return '{0}'.format(start)
+    return '{0}-{1}'.format(start, end)
+
+
+def compute_clusters(systems, win_ratios, rank_ranges):
+    """
+    Groups the given systems into clusters of non-overlapping rank ranges.
+
+    Returns a list of (cluster_id, [(win_ratio, rank_range, system), ...])
+    tuples, sorted by descending expected win ratio.
+
+    """
+    _data = []
+    for index, system in enumerate(systems):
+        if np.isnan(win_ratios[index]) or rank_ranges[index][0] is None:
+            continue
+        _data.append((round(win_ratios[index], 3),
+          format_rank_range(rank_ranges[index]), system))
+    _data.sort(reverse=True)
+
+    clusters = []
+    last_rank = None
+    for win_ratio, rank_range, system in _data:
+        _from, _to = rank_ranges[systems.index(system)]
+        if last_rank is None or _from > last_rank:
+            clusters.append((len(clusters) + 1, []))
+        last_rank = _to
+        clusters[-1][1].append((win_ratio, rank_range, system))
+
+    return clusters
+
+
+def _bootstrap_shard(encoded_judgements, number_of_resamples, random_state):
+    """
+    Computes the rank histogram and pairwise reversal counts for a bootstrap
+    shard of the given encoded judgements, see iter_shard_results().
+    """
+    systems, judgement_index, winners, losers, number_of_judgements = \
+      encoded_judgements
+
+    reversals = np.zeros((len(systems), len(systems)), dtype=np.int64)
+    histogram = bootstrap_rank_histogram(systems, judgement_index, winners,
+      losers, number_of_judgements, number_of_resamples, random_state,
+      reversals)
+    return (histogram, reversals)
+
+
+def _matrix_to_list(matrix):
+    """
+    Converts the given matrix into nested lists, NaN values become None.
+    """
+    return [[None if np.isnan(x) else round(float(x), 6) for x in row]
+      for row in matrix]
+
+
+def compute_significance(systems, wins, reversals, number_of_resamples):
+    """
+    Computes pairwise significance data for the given systems.
+
+    Returns a dictionary containing the list of systems and, as nested lists
+    in the same order, head-to-head win ratios as well as sign test and
+    bootstrap p-values.  Entries for pairs without comparisons are None.
+
+    """
+    return {
+      'systems': list(systems),
+      'win_ratios': _matrix_to_list(compute_pairwise_win_ratios(wins)),
+      'sign_test': _matrix_to_list(compute_sign_test_p_values(wins)),
+      'bootstrap': _matrix_to_list(compute_bootstrap_p_values(wins,
+        reversals, number_of_resamples)),
+    }
+
+
+def compute_all_ranking_clusters(judgements, number_of_resamples=None,
+  seed=None, processes=1, maximum_resamples=MAXIMUM_RESAMPLES):
+    """
+    Computes ranking clusters for the given judgements of all language pairs.
+
+    judgements maps language pairs to lists of judgements, see the docstring
+    of encode_judgements() for details.  Bootstrap resamples are split into
+    shards which are computed using the given number of processes.  Given a
+    seed, results are reproducible, regardless of the number of processes.
+
+    If number_of_resamples is None, resampling is adaptive:  we keep adding
+    batches of RESAMPLES_PER_BATCH resamples to a language pair until it has
+    at least MINIMUM_RESAMPLES resamples and its rank ranges have been stable
+    for STABLE_BATCHES successive batches, or maximum_resamples is reached.
+    Otherwise, a fixed number of resamples is computed for each language
+    pair, as in the Perl code.
+
+    Returns a dictionary mapping language pairs to dictionaries containing
+    the list of clusters as computed by compute_clusters(), the number of
+    resamples used, and the pairwise significance data as computed by
+    compute_significance().
+
+    """
+    if seed is None:
+        seed = np.random.RandomState().randint(2**31)
+        LOGGER.info('Computing ranking clusters with seed {0}'.format(seed))
+
+    encoded_judgements = {}
+    win_matrices = {}
+    win_ratios = {}
+    histograms = {}
+    reversals = {}
+    for language_pair, _judgements in judgements.items():
+        _judgements = list(_judgements)
+        systems, judgement_index, winners, losers = \
+          encode_judgements(_judgements)
+        if not systems:
+            continue
+
+        encoded_judgements[language_pair] = (systems, judgement_index,
+          winners, losers, len(_judgements))
+        wins = compute_win_matrix(len(systems), winners, losers)
+        win_matrices[language_pair] = wins
+        win_ratios[language_pair] = compute_expected_win_ratios(wins)
+        histograms[language_pair] = np.zeros((len(systems), len(systems)),
+          dtype=np.int64)
+        reversals[language_pair] = np.zeros((len(systems), len(systems)),
+          dtype=np.int64)
+
+    if number_of_resamples is None:
+        batch_size = RESAMPLES_PER_BATCH
+        maximum_resamples = max(maximum_resamples, MINIMUM_RESAMPLES)
+    else:
+        batch_size = number_of_resamples
+        maximum_resamples = number_of_resamples
+
+    pool = create_pool(encoded_judgements, processes)
+
+    resamples = dict((x, 0) for x in encoded_judgements.keys())
+    rank_ranges = dict((x, None) for x in encoded_judgements.keys())
+    stable_batches = dict((x, 0) for x in encoded_judgements.keys())
+    pending = sorted(encoded_judgements.keys())
+    try:
+        while pending:
+            # Compute next batch of resamples for all pending language pairs.
+            shards = []
+            for language_pair in pending:
+                _first_shard = resamples[language_pair] // RESAMPLES_PER_SHARD
+                _resamples = min(batch_size,
+                  maximum_resamples - resamples[language_pair])
+                shards.extend(compute_bootstrap_shards(language_pair,
+                  _resamples, seed, RESAMPLES_PER_SHARD, _first_shard))
+                resamples[language_pair] += _resamples
+
+            # Rank histograms of individual shards are merged as they arrive.
+            for language_pair, _, (histogram, _reversals) in \
+              iter_shard_results(_bootstrap_shard, shards, pool):
+                histograms[language_pair] += histogram
+                reversals[language_pair] += _reversals
+
+            # Language pairs are done once their rank ranges are stable.
+            _pending = []
+            for language_pair in pending:
+                _ranges = [compute_rank_range(x)
+                  for x in histograms[language_pair]]
+                if _ranges == rank_ranges[language_pair]:
+                    stable_batches[language_pair] += 1
+                else:
+                    stable_batches[language_pair] = 0
+                rank_ranges[language_pair] = _ranges
+
+                if resamples[language_pair] >= maximum_resamples:
+                    continue
+
+                if resamples[language_pair] >= MINIMUM_RESAMPLES and \
+                  stable_batches[language_pair] >= STABLE_BATCHES:
+                    continue
+
+                _pending.append(language_pair)
+            pending = _pending
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    clusters = {}
+    for language_pair in encoded_judgements.keys():
+        systems = encoded_judgements[language_pair][0]
+        LOGGER.info('Computed {0} resamples for language pair {1}'.format(
+          resamples[language_pair], language_pair))
+        clusters[language_pair] = {
+          'clusters': compute_clusters(systems, win_ratios[language_pair],
+            rank_ranges[language_pair]),
+          'resamples': resamples[language_pair],
+          'significance': compute_significance(systems,
+            win_matrices[language_pair], reversals[language_pair],
+            resamples[language_pair]),
+        }
+
+    return clusters
+
+
+def compute_ranking_clusters(judgements, number_of_resamples=None, seed=None,
+  processes=1):
+    """
+    Computes ranking clusters for the given judgements of one language pair.
+
+    See encode_judgements() for the expected judgements format.  Returns the
+    list of clusters as computed by compute_clusters().
+
+    """
+    clusters = compute_all_ranking_clusters({None: judgements},
+      number_of_resamples, seed, processes)
+    if not None in clusters:
+        return []
+    return clusters[None]['clusters']
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+Online TrueSkill ratings for pairwise system comparisons.
+
+Each pairwise comparison is treated as a two player match which either one
+of the systems wins or which ends in a draw.  This implements the closed form
+update rules for the two player case of TrueSkill, see Herbrich et al., 2007.
+
+"""
+from math import erf, exp, pi, sqrt
+
+# Default TrueSkill parameters.
+INITIAL_MU = 25.0
+INITIAL_SIGMA = INITIAL_MU / 3
+BETA = INITIAL_SIGMA / 2
+TAU = INITIAL_SIGMA / 100
+
+# Relative rankings contain many ties, hence draw probability is fairly high.
+DRAW_PROBABILITY = 0.25
+
+# Guards against numerical underflow in the truncated Gaussian corrections.
+MINIMUM_DENOMINATOR = 1e-12
+
+
+def _pdf(value):
+    """
+    Returns the standard normal probability density at value.
+    """
+    return exp(-value * value / 2) / sqrt(2 * pi)
+
+
+def _cdf(value):
+    """
+    Returns the standard normal cumulative distribution at value.
+    """
+    return (1 + erf(value / sqrt(2))) / 2
+
+
+def _ppf(probability, lower=-10.0, upper=10.0):
+    """
+    Returns the inverse of the standard normal cumulative distribution.
+
+    Uses bisection as this is only needed to compute the draw margin.
+
+    """
+    for _ in range(100):
+        middle = (lower + upper) / 2
+        if _cdf(middle) < probability:
+            lower = middle
+        else:
+            upper = middle
+
+    return (lower + upper) / 2
+
+
+def compute_draw_margin(draw_probability=DRAW_PROBABILITY, beta=BETA):
+    """
+    Computes the draw margin for the given draw probability.
+    """
+    return _ppf((draw_probability + 1) / 2) * sqrt(2) * beta
+
+
+DRAW_MARGIN = compute_draw_margin()
+
+
+def _win_corrections(difference, margin):
+    """
+    Returns (v, w) corrections for a win, given normalised mean difference.
+    """
+    _value = difference - margin
+    denominator = _cdf(_value)
+    if denominator < MINIMUM_DENOMINATOR:
+        # Extreme upsets:  limits of v and w for very negative values.
+        return -_value, 1.0
+
+    v = _pdf(_value) / denominator
+    return v, v * (v + _value)
+
+
+def _draw_corrections(difference, margin):
+    """
+    Returns (v, w) corrections for a draw, given normalised mean difference.
+    """
+    _absolute = abs(difference)
+    _upper = margin - _absolute
+    _lower = -margin - _absolute
+
+    denominator = _cdf(_upper) - _cdf(_lower)
+    if denominator < MINIMUM_DENOMINATOR:
+        return -_absolute, 1.0
+
+    v = (_pdf(_lower) - _pdf(_upper)) / denominator
+    w = v * v + (_upper * _pdf(_upper) - _lower * _pdf(_lower)) / denominator
+
+    # Corrections have been computed for the absolute difference.
+    if difference < 0:
+        v = -v
+
+    return v, w
+
+
+def rate_1vs1(rating_a, rating_b, outcome, beta=BETA, tau=TAU,
+  draw_margin=DRAW_MARGIN):
+    """
+    Updates the given (mu, sigma) ratings for a single comparison.
+
+    The outcome is 1 if system A has won, -1 if system B has won, and 0 for a
+    draw.  Returns a tuple of updated (mu, sigma) ratings for A and B.
+
+    """
+    mu_a, sigma_a = rating_a
+    mu_b, sigma_b = rating_b
+
+    # Dynamics factor keeps ratings from freezing over time.
+    variance_a = sigma_a * sigma_a + tau * tau
+    variance_b = sigma_b * sigma_b + tau * tau
+
+    # For wins, we always look at the match from the winner's perspective.
+    if outcome < 0:
+        variance_a, variance_b = variance_b, variance_a
+        mu_a, mu_b = mu_b, mu_a
+
+    c = sqrt(2 * beta * beta + variance_a + variance_b)
+    difference = (mu_a - mu_b) / c
+    margin = draw_margin / c
+
+    if outcome == 0:
+        v, w = _draw_corrections(difference, margin)
+    else:
+        v, w = _win_corrections(difference, margin)
+
+    mu_a += variance_a / c * v
+    mu_b -= variance_b / c * v
+    sigma_a = sqrt(variance_a * max(1 - variance_a / (c * c) * w, 0.0))
+    sigma_b = sqrt(variance_b * max(1 - variance_b / (c * c) * w, 0.0))
+
+    if outcome < 0:
+        mu_a, mu_b = mu_b, mu_a
+        sigma_a, sigma_b = sigma_b, sigma_a
+
+    return (mu_a, sigma_a), (mu_b, sigma_b)
+
+
+def conservative_score(mu, sigma):
+    """
+    Returns a conservative skill estimate, used to rank systems.
+    """
+    return mu - 3 * sigma
+
+
+def rate_comparisons(ratings, comparisons):
+    """
+    Updates the given ratings dictionary with the given comparisons.
+
+    Ratings map system names to (mu, sigma) tuples;  missing systems start
+    with the default rating.  Comparisons are (systemA, rankA, systemB, rankB)
+    tuples as yielded by RankingResult.iter_pairwise_comparisons().  Lower
+    ranks are better and comparisons involving rank -1 are ignored.
+
+    Returns the set of system names whose rating has changed.
+
+    """
+    changed = set()
+    for systemA, rankA, systemB, rankB in comparisons:
+        if rankA == -1 or rankB == -1 or systemA == systemB:
+            continue
+
+        _rating_a = ratings.get(systemA, (INITIAL_MU, INITIAL_SIGMA))
+        _rating_b = ratings.get(systemB, (INITIAL_MU, INITIAL_SIGMA))
+        _outcome = cmp(rankB, rankA)
+
+        ratings[systemA], ratings[systemB] = rate_1vs1(_rating_a, _rating_b,
+          _outcome)
+        changed.update((systemA, systemB))
+
+    return changed
+
+
+def rating_uncertainty(rating_a, rating_b):
+    """
+    Returns how uncertain the relative order of two rated systems is.
+
+    This is the two-sided probability mass of the skill difference beyond
+    zero, in (0, 1];  1 means both systems are indistinguishable.
+
+    """
+    mu_a, sigma_a = rating_a
+    mu_b, sigma_b = rating_b
+    _deviation = sqrt(sigma_a * sigma_a + sigma_b * sigma_b)
+    if not _deviation:
+        return 0.0
+
+    return 2 * _cdf(-abs(mu_a - mu_b) / _deviation)
+
+
+def count_uncertainty(wins, losses):
+    """
+    Returns how uncertain the relative order of two counted systems is.
+
+    Uses the normal approximation of a two-sided sign test, ignoring ties;
+    1 means there is no evidence for either system being better.
+
+    """
+    _total = wins + losses
+    if not _total:
+        return 1.0
+
+    return 2 * _cdf(-abs(wins - losses) / sqrt(_total))
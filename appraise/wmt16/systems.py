@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Project: Appraise evaluation system
+ Author: Christian Federmann <cfedermann@gmail.com>
+
+System names and multi-system expansion for pairwise system comparisons.
+
+Pairwise counts, online ratings, uncertainty-driven HIT selection and the
+ranking cluster engine all pair systems using iter_system_pairs(), so that
+they agree on system names and on which systems have been compared.  This
+module does not depend on NumPy, as it is used whenever a result is saved.
+
+"""
+import re
+
+# Clean up rules from clean_up_system_name() in the Perl code;  a count of 0
+# replaces all occurrences, like the /g modifier does in Perl.
+SYSTEM_NAME_CLEAN_UP_RULES = (
+  (re.compile(r'^newstest2013...-...'), '', 1),
+  (re.compile(r'\.\d+$'), '', 1),
+  (re.compile(r'_NLP_Groups_Phrasal_Toolkit_-_Primary', re.I), '', 1),
+  (re.compile(r'heafield-unconstrained'), 'heafield', 1),
+  (re.compile(r'_'), '-', 0),
+  (re.compile(r'.primary', re.I), '', 1),
+  (re.compile(r'_multifrontend'), '', 1),
+  (re.compile(r'translate_[a-z]+-to-[a-z]+'), '', 1),
+  (re.compile(r'uppsala-unviersity'), '', 1),
+  (re.compile(r'[\_\:\)\-]+$'), '', 1),
+)
+
+
+def clean_up_system_name(name):
+    """
+    Normalises the given system name in the same way the Perl code does.
+    """
+    name = name.lower()
+    for pattern, replacement, count in SYSTEM_NAME_CLEAN_UP_RULES:
+        name = pattern.sub(replacement, name, count=count)
+    return name
+
+
+def iter_system_pairs(judgement):
+    """
+    Yields (systemA, rankA, systemB, rankB) tuples for the given judgement.
+
+    A judgement is a list of (systems, rank) tuples, one per translation of
+    a segment, where systems is a comma-separated multi-system value.  These
+    are expanded into individual systems, normalised by clean_up_system_name().
+
+    Only systems from different translations are paired, as systems inside
+    the same multi-system produced identical output and have therefore not
+    been compared;  pairs of identical systems are skipped.  Ranks are passed
+    on as given, including -1 for translations which have not been ranked.
+
+    """
+    expanded = []
+    for systems, rank in judgement:
+        _systems = set()
+        for system in systems.split(','):
+            _systems.add(clean_up_system_name(system))
+        expanded.append((sorted(_systems), rank))
+
+    for index, (systemsA, rankA) in enumerate(expanded):
+        for systemsB, rankB in expanded[index+1:]:
+            for systemA in systemsA:
+                for systemB in systemsB:
+                    if systemA != systemB:
+                        yield (systemA, rankA, systemB, rankB)
@@ -7,27 +7,28 @@ import logging
 
 from datetime import datetime, timedelta
 from hashlib import md5
-from os.path import join
 from random import seed, shuffle
-from subprocess import check_output
-from tempfile import gettempdir
 from urllib import unquote
+from xml.etree.ElementTree import fromstring, ParseError
 
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group, User
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.models import Q
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template import Context
-from django.template.loader import get_template
 
+from appraise.wmt16.exports import cursor_response, iter_npz, \
+  iter_ranking_xml, snapshot_response, streaming_response
 from appraise.wmt16.models import LANGUAGE_PAIR_CHOICES, UserHITMapping, \
   HIT, RankingTask, RankingResult, UserHITMapping, UserInviteToken, Project, \
   GROUP_HIT_REQUIREMENTS, MAX_USERS_PER_HIT, initialize_database, \
-  TimedKeyValueData
-from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG, ROOT_PATH, STATIC_URL
+  TimedKeyValueData, SystemRating, PairwiseCount, HIT_SELECTION_MODE, \
+  HIT_SELECTION_CANDIDATES, RankingClusterData, AgreementCount
+from appraise.wmt16.systems import iter_system_pairs
+from appraise.settings import LOG_LEVEL, LOG_HANDLER, COMMIT_TAG, STATIC_URL
 from appraise.utils import datetime_to_seconds, seconds_to_timedelta
 
 # Setup logging support.
@@ -48,6 +49,10 @@ BASE_CONTEXT = {
 STATUS_CACHE = {}
 RANKINGS_CACHE = {}
 
+# Intra-annotator agreement counts are kept per project, together with the
+# watermark of the redundant results they have been computed from.
+INTRA_AGREEMENT_CACHE = {}
+
 # Initalized database
 initialize_database()
 
@@ -136,8 +141,13 @@ def _compute_next_task_for_user(user, project, language_pair):
         shuffle(hit_ids)
         LOGGER.debug("HIT IDs = {0}".format(hit_ids))
         
+        # For uncertainty selection, we consider several available HITs.
+        max_candidates = 1
+        if HIT_SELECTION_MODE == 'uncertainty':
+            max_candidates = HIT_SELECTION_CANDIDATES
+        
         # Find the next HIT for the current user.
-        random_hit = None
+        candidate_hits = []
         for hit_id in hit_ids:
             for hit in hits.filter(hit_id=hit_id):
                 hit_users = list(hit.users.all())
@@ -150,12 +160,20 @@ def _compute_next_task_for_user(user, project, language_pair):
                 
                 if not user in hit_users:
                     if len(hit_users) < MAX_USERS_PER_HIT:
-                        random_hit = hit
+                        candidate_hits.append(hit)
                         break
             
-            if random_hit:
+            if len(candidate_hits) >= max_candidates:
                 break
         
+        random_hit = None
+        if len(candidate_hits) > 1:
+            random_hit = _select_uncertain_hit(candidate_hits, project,
+              language_pair)
+        
+        elif candidate_hits:
+            random_hit = candidate_hits[0]
+        
         # If we still haven't found a next HIT, there simply is none...
         if not random_hit:
             # TODO: We should now investigate if there is any HIT assigned
@@ -188,6 +206,81 @@ def _compute_next_task_for_user(user, project, language_pair):
     return current_hitmap.hit
 
 
+def _compute_hit_system_pairs(hit):
+    """
+    Returns the list of system pairs compared within the given HIT.
+
+    Systems are paired as for PairwiseCount and SystemRating instances, see
+    iter_system_pairs() in appraise.wmt16.systems.
+
+    """
+    system_pairs = []
+    try:
+        _hit_xml = fromstring(hit.hit_xml.encode('utf-8'))
+    
+    except ParseError, msg:
+        LOGGER.debug(msg)
+        return system_pairs
+    
+    for _seg in _hit_xml.iter('seg'):
+        _judgement = [(x.attrib['system'], None)
+          for x in _seg.iter('translation')]
+        for systemA, _, systemB, _ in iter_system_pairs(_judgement):
+            system_pairs.append(tuple(sorted((systemA, systemB))))
+    
+    return system_pairs
+
+
+def _select_uncertain_hit(hits, project, language_pair):
+    """
+    Selects the HIT whose system pairs have the most uncertain order.
+
+    The uncertainty of a system pair is the larger one of its rating based
+    and its pairwise count based uncertainty;  a pair is only considered to
+    be resolved if both agree.  HITs are scored by their mean pair uncertainty.
+
+    """
+    from appraise.wmt16.ratings import count_uncertainty, rating_uncertainty
+    
+    ratings = {}
+    for rating in SystemRating.objects.filter(project=project,
+      language_pair=language_pair):
+        ratings[rating.system] = (rating.mu, rating.sigma)
+    
+    counts = {}
+    for count in PairwiseCount.objects.filter(project=project,
+      language_pair=language_pair):
+        counts[(count.system_a, count.system_b)] = (count.wins, count.losses)
+    
+    best_hit = None
+    best_score = -1
+    for hit in hits:
+        system_pairs = _compute_hit_system_pairs(hit)
+        if not system_pairs:
+            continue
+        
+        score = 0.0
+        for systemA, systemB in system_pairs:
+            _uncertainty = count_uncertainty(*counts.get((systemA, systemB),
+              (0, 0)))
+            if systemA in ratings and systemB in ratings:
+                _uncertainty = max(_uncertainty,
+                  rating_uncertainty(ratings[systemA], ratings[systemB]))
+            
+            score += _uncertainty
+        
+        score /= len(system_pairs)
+        if score > best_score:
+            best_hit = hit
+            best_score = score
+    
+    LOGGER.debug('Selected HIT {0} with uncertainty {1:.3f}'.format(best_hit,
+      best_score))
+    
+    # If no HIT could be scored, we fall back to the first, random one.
+    return best_hit or hits[0]
+
+
 def _save_results(item, user, duration, raw_result):
     """
     Creates or updates the RankingResult for the given item and user.
@@ -531,6 +624,10 @@ def status(request):
       'group_stats': STATUS_CACHE['group_stats'],
       'user_stats': STATUS_CACHE['user_stats'],
       'clusters': RANKINGS_CACHE.get('clusters', []),
+      'ratings': _compute_system_ratings(),
+      'win_ratios': _compute_pairwise_win_ratios(),
+      'agreement_stats': _compute_agreement_stats(),
+      'intra_agreement_stats': _compute_agreement_stats(intra=True),
       'admin_url': admin_url,
       'title': 'WMT16 Status',
     }
@@ -543,14 +640,13 @@ def update_ranking(request=None):
     """
     Updates the in-memory RANKINGS_CACHE dictionary.
     
-    In order to get things up and running quickly, for WMT16 we will fall back
-    to calling an external Perl script provided by Philipp Koehn;  after the
-    evaluation has ended, we will re-work this into a fully integrated, Python
-    based solution...
+    Web requests re-load the clusters last computed by compute_ranking_clusters.py
+    as computing them from scratch may take a while.  Otherwise, clusters are
+    only re-computed for language pairs with new or changed results.
     
     """
     if request is not None:
-        RANKINGS_CACHE['clusters'] = _compute_ranking_clusters(load_file=True)
+        RANKINGS_CACHE['clusters'] = _compute_ranking_clusters(load_latest=True)
         return HttpResponse('Ranking updated successfully')
     
     else:
@@ -778,75 +874,292 @@ def _compute_user_stats():
     return user_stats
 
 
-def _compute_ranking_clusters(load_file=False):
+def _get_ranking_results(project=None, language_pairs=None):
     """
-    Computes ranking clusters using Philipp Koehn's Perl code.
+    Returns the RankingResult QuerySet used to compute ranking clusters.
     """
-    # Define file names.
-    TMP_PATH = gettempdir()
-    _script = join(ROOT_PATH, '..', 'scripts',
-      'compute_ranking_clusters.perl')
-    _wmt16 = join(TMP_PATH, 'wmt16-researcher-results.csv')
-    _dump = join(TMP_PATH, 'wmt16-ranking-clusters.txt')
+    results = RankingResult.objects.filter(item__hit__completed=True,
+      item__hit__mturk_only=False)
     
-    # If not loading cluster data from file, re-compute everything.
-    if not load_file:
-        results = [u'srclang,trglang,srcIndex,documentId,segmentId,judgeId,' \
-          'system1Number,system1Id,system2Number,system2Id,system3Number,' \
-          'system3Id,system4Number,system4Id,system5Number,system5Id,' \
-          'system1rank,system2rank,system3rank,system4rank,system5rank']
-        
-        # Compute current dump of WMT16 results in CSV format. We ignore any
-        # results which are incomplete, i.e. have been SKIPPED.
-        for result in RankingResult.objects.filter(item__hit__completed=True,
-          item__hit__mturk_only=False):
-            _csv_output = result.export_to_csv()
-            if not _csv_output.endswith('-1,-1,-1,-1,-1'):
-                results.append(_csv_output)
-        
-        results.append('')
-        export_csv = u"\n".join(results)
-        
-        # Write current dump of results to file.
-        with open(_wmt16, 'w') as outfile:
-            outfile.write(export_csv)
-        
-        # Run Philipp's Perl script to compute ranking clusters.
-        PERL_OUTPUT = check_output(['perl', _script, _wmt16], shell=True)
-        
-        with open(_dump, 'w') as outfile:
-            outfile.write(PERL_OUTPUT)
+    if project is not None:
+        results = results.filter(item__hit__project=project)
     
-    else:
-        PERL_OUTPUT = ''
-        with open(_dump, 'r') as infile:
-            PERL_OUTPUT = infile.read()
-    
-    # Compute ranking cluster data for status page.
-    CLUSTER_DATA = {}
-    for line in PERL_OUTPUT.split("\n"):
-        _data = line.strip().split(',')
-        if not len(_data) == 5 or _data[0] == 'task':
-            continue
-        
-        _data[0] = _data[0].replace('-', u' → ')
-        if not CLUSTER_DATA.has_key(_data[0]):
-            CLUSTER_DATA[_data[0]] = {}
-        
-        if not CLUSTER_DATA[_data[0]].has_key(_data[1]):
-            CLUSTER_DATA[_data[0]][_data[1]] = []
-        
-        CLUSTER_DATA[_data[0]][_data[1]].append(_data[2:])
+    if language_pairs is not None:
+        results = results.filter(item__hit__language_pair__in=language_pairs)
     
+    return results
+
+
+def _collect_ranking_judgements(project=None, language_pairs=None):
+    """
+    Collects ranking judgements for all WMT16 language pairs.
+
+    Returns a dictionary mapping language pair codes to lists of judgements
+    in the format expected by appraise.wmt16.ranking.encode_judgements().
+    If project or language_pairs are given, only matching results are used.
+
+    """
+    judgements = {}
+
+    # We ignore any results which are incomplete, i.e. have been SKIPPED.
+    for result in _get_ranking_results(project, language_pairs).select_related(
+      'item__hit'):
+        if not isinstance(result.results, list):
+            continue
+
+        _judgement = []
+        for index, translation in enumerate(result.item.translations):
+            _judgement.append((translation[1]['system'], result.results[index]))
+
+        if all([x[1] == -1 for x in _judgement]):
+            continue
+
+        _language_pair = result.item.hit.language_pair
+        judgements.setdefault(_language_pair, []).append(_judgement)
+
+    return judgements
+
+
+def _compute_ranking_watermarks(project=None):
+    """
+    Computes a watermark of the ranking results for each language pair.
+
+    Watermarks have format count:max_id:md5 where the MD5 digest covers ids
+    and raw results, hence any new, changed or deleted result changes them.
+    This does not need to parse any XML and is therefore cheap to compute.
+
+    """
+    digests = {}
+    for _id, raw_result, language_pair in _get_ranking_results(
+      project).order_by('id').values_list('id', 'raw_result',
+      'item__hit__language_pair'):
+        _data = digests.setdefault(language_pair, [0, 0, md5()])
+        _data[0] += 1
+        _data[1] = max(_data[1], _id)
+        _data[2].update(u'{0}:{1};'.format(_id, raw_result).encode('utf-8'))
+
+    watermarks = {}
+    for language_pair, (count, max_id, digest) in digests.items():
+        watermarks[language_pair] = '{0}:{1}:{2}'.format(count, max_id,
+          digest.hexdigest())
+
+    return watermarks
+
+
+def _compute_intra_agreement_counts(project):
+    """
+    Computes intra-annotator AgreementCount instances for the given project.
+
+    Counts are cached in INTRA_AGREEMENT_CACHE and only re-computed once
+    the watermark of the project's redundant results has changed;  as for
+    _compute_ranking_watermarks(), this does not need to parse any XML.
+
+    """
+    digest = md5()
+    for _id, raw_result in RankingResult.get_redundant_results(project) \
+      .order_by('id').values_list('id', 'raw_result'):
+        digest.update(u'{0}:{1};'.format(_id, raw_result).encode('utf-8'))
+
+    watermark = digest.hexdigest()
+    cached = INTRA_AGREEMENT_CACHE.get(project.id)
+    if cached is None or cached[0] != watermark:
+        cached = (watermark, AgreementCount.compute_intra_counts(project))
+        INTRA_AGREEMENT_CACHE[project.id] = cached
+
+    return cached[1]
+
+
+def _compute_agreement_stats(intra=False):
+    """
+    Computes live inter-annotator agreement for all projects and language
+    pairs.  If intra is True, computes intra-annotator agreement based on
+    redundant copies of HITs instead.
+
+    Returns a list of (project name, language pair, pA, pE, kappa,
+    comparable) tuples;  kappa is None if all verdicts are ties.  Language
+    pairs without comparable judgements are skipped.
+
+    """
+    counts = {}
+    if intra:
+        for project in Project.objects.all():
+            for count in _compute_intra_agreement_counts(project):
+                if count.comparable:
+                    counts[(project.name, count.language_pair)] = count
+
+    else:
+        for count in AgreementCount.objects.select_related('project'):
+            if count.comparable:
+                counts[(count.project.name, count.language_pair)] = count
+
+    agreement_stats = []
+    for project_name in sorted(set(x[0] for x in counts.keys())):
+        for code, name in LANGUAGE_PAIR_CHOICES:
+            _count = counts.get((project_name, code))
+            if _count is None:
+                continue
+
+            agreement_stats.append((project_name, name.decode('utf-8'))
+              + _count.compute_kappa() + (_count.comparable,))
+
+    return agreement_stats
+
+
+def _compute_system_ratings():
+    """
+    Computes live system ratings for all projects and language pairs.
+
+    Systems are ranked by their conservative TrueSkill score.  Returns a list
+    of (project name, language pair, ratings) tuples where ratings is a list
+    of (rank, mu, sigma, score, comparisons, system) tuples.
+
+    """
+    ratings = {}
+    for rating in SystemRating.objects.select_related('project'):
+        _key = (rating.project.name, rating.language_pair)
+        ratings.setdefault(_key, []).append((rating.conservative_score(),
+          rating.mu, rating.sigma, rating.comparisons, rating.system))
+
+    system_ratings = []
+    for project_name in sorted(set(x[0] for x in ratings.keys())):
+        for code, name in LANGUAGE_PAIR_CHOICES:
+            _ratings = ratings.get((project_name, code))
+            if not _ratings:
+                continue
+
+            _ratings.sort(reverse=True)
+            system_ratings.append((project_name, name.decode('utf-8'),
+              [(index + 1, mu, sigma, score, comparisons, system)
+               for index, (score, mu, sigma, comparisons, system)
+               in enumerate(_ratings)]))
+
+    return system_ratings
+
+
+def _compute_pairwise_win_ratios():
+    """
+    Computes live head-to-head win ratios for all projects and language pairs
+    from PairwiseCount instances, i.e., without parsing any results.
+
+    Systems are sorted by their expected win ratio.  Returns a list of
+    (project name, language pair, systems, rows) tuples where rows is a list
+    of (system, expected win ratio, win ratios) tuples;  win ratios contains
+    the head-to-head win ratio against each of the systems, or None if both
+    have not been compared.
+
+    """
+    import numpy as np
+    from appraise.wmt16.ranking import compute_count_win_matrix, \
+      compute_expected_win_ratios, compute_pairwise_win_ratios
+
+    # Pairs which have only been tied do not contribute to win ratios.
+    counts = {}
+    for count in PairwiseCount.objects.select_related('project').filter(
+      Q(wins__gt=0) | Q(losses__gt=0)):
+        _key = (count.project.name, count.language_pair)
+        counts.setdefault(_key, []).append((count.system_a, count.system_b,
+          count.wins, count.losses))
+
+    win_ratios = []
+    for project_name in sorted(set(x[0] for x in counts.keys())):
+        for code, name in LANGUAGE_PAIR_CHOICES:
+            _counts = counts.get((project_name, code))
+            if not _counts:
+                continue
+
+            systems, wins = compute_count_win_matrix(_counts)
+            expected = compute_expected_win_ratios(wins)
+            ratios = compute_pairwise_win_ratios(wins)
+
+            order = sorted(range(len(systems)),
+              key=lambda x: (-expected[x], systems[x]))
+            rows = []
+            for first in order:
+                rows.append((systems[first], float(expected[first]),
+                  [None if np.isnan(ratios[first, second])
+                   else float(ratios[first, second]) for second in order]))
+
+            win_ratios.append((project_name, name.decode('utf-8'),
+              [systems[x] for x in order], rows))
+
+    return win_ratios
+
+
+def _compute_ranking_clusters(load_latest=False, project=None, **options):
+    """
+    Computes ranking clusters using appraise.wmt16.ranking.
+
+    This replaces Philipp Koehn's Perl code which we used to call for WMT16.
+    Computed clusters are stored as RankingClusterData instances, keyed by
+    project, language pair, results watermark and algorithm parameters.
+    Language pairs for which matching data exists are not re-computed.
+
+    Returns a list of (language pair name, clusters, resamples, significance)
+    tuples;  see compute_significance() in appraise.wmt16.ranking for the
+    pairwise significance data.
+
+    If load_latest is True, the most recent clusters are returned instead.
+    If project is None, clusters are computed over all projects.  Any other
+    options are passed on to compute_all_ranking_clusters().
+
+    """
     _cluster_data = []
-    _sorted_language_pairs = [x[1].decode('utf-8') for x in LANGUAGE_PAIR_CHOICES]
-    for language_pair in _sorted_language_pairs:
-        _language_data = []
-        for cluster_id in sorted(CLUSTER_DATA[language_pair].keys()):
-           _data = CLUSTER_DATA[language_pair][cluster_id]
-           _language_data.append((cluster_id, _data))
-        _cluster_data.append((language_pair, _language_data))
-    
+
+    # If loading cluster data, return the most recent version.
+    if load_latest:
+        for code, name in LANGUAGE_PAIR_CHOICES:
+            _data = RankingClusterData.latest(project, code)
+            if _data is not None:
+                _cluster_data.append((name.decode('utf-8'),
+                  _data.get_clusters(), _data.resamples,
+                  _data.get_significance()))
+        
+        return _cluster_data
+
+    from appraise.wmt16.ranking import compute_all_ranking_clusters, \
+      MAXIMUM_RESAMPLES
+
+    # The number of processes does not change results, hence is not part of
+    # the parameters.
+    parameters = RankingClusterData.encode_parameters(
+      number_of_resamples=options.get('number_of_resamples'),
+      seed=options.get('seed'),
+      maximum_resamples=options.get('maximum_resamples', MAXIMUM_RESAMPLES))
+
+    watermarks = _compute_ranking_watermarks(project)
+    cached = {}
+    for language_pair, watermark in watermarks.items():
+        _data = RankingClusterData.lookup(project, language_pair, watermark,
+          parameters)
+        if _data is not None:
+            cached[language_pair] = _data
+
+    # Only re-compute clusters for language pairs which have changed.
+    stale_pairs = [x for x in watermarks.keys() if not x in cached]
+    if stale_pairs:
+        LOGGER.info('Computing ranking clusters for {0}.'.format(
+          ', '.join(sorted(stale_pairs))))
+        judgements = _collect_ranking_judgements(project, stale_pairs)
+        clusters = compute_all_ranking_clusters(judgements, **options)
+
+        for language_pair, language_data in clusters.items():
+            _data = RankingClusterData(project=project,
+              language_pair=language_pair,
+              watermark=watermarks[language_pair], parameters=parameters,
+              resamples=language_data['resamples'])
+            _data.set_clusters(language_data['clusters'])
+            _data.set_significance(language_data['significance'])
+            _data.save()
+            cached[language_pair] = _data
+
+    for code, name in LANGUAGE_PAIR_CHOICES:
+        if not code in cached:
+            continue
+
+        _cluster_data.append((name.decode('utf-8'),
+          cached[code].get_clusters(), cached[code].resamples,
+          cached[code].get_significance()))
+
     return _cluster_data
 
 
@@ -1098,29 +1411,21 @@ def export_to_pairwise_csv(request, token, project):
     Exports all annotations for the given project in pairwise CSV format.
     
     Requires that given token matches the secret token set in local config.
+    Results after a given cursor can be exported using "since" and "limit"
+    GET parameters.
     """
     from appraise.local_settings import EXPORT_TOKEN
     if not token == EXPORT_TOKEN:
         return HttpResponseForbidden()
         
     annotation_project = get_object_or_404(Project, name=project)
-        
-    queryset = RankingResult.objects.filter(item__hit__completed=True)
-
-    results = [u'srclang,trglang,srcIndex,segmentId,judgeId,' \
-      'system1Id,system1rank,system2Id,system2rank,rankingID']
     
-    for result in queryset:
-        if isinstance(result, RankingResult):
-            if result.item.hit.project_set.filter(id=annotation_project.id):
-                current_csv = result.export_to_pairwise_csv()
-                if current_csv is None:
-                    continue
-                results.append(current_csv)
+    if 'since' in request.GET or 'limit' in request.GET:
+        return cursor_response(request, annotation_project, 'pairwise-csv',
+          'text/plain')
     
-    export_csv = u"\n".join(results)
-    export_csv = export_csv + u"\n"
-    return HttpResponse(export_csv, mimetype='text/plain')
+    return snapshot_response(request, annotation_project, 'pairwise-csv',
+      'text/plain')
 
 
 def export_to_ranking_csv(request, token, project):
@@ -1128,33 +1433,65 @@ def export_to_ranking_csv(request, token, project):
     Exports all annotations for the given project in ranking CSV format.
     
     Requires that given token matches the secret token set in local config.
+    Results after a given cursor can be exported using "since" and "limit"
+    GET parameters.
     """
     from appraise.local_settings import EXPORT_TOKEN
     if not token == EXPORT_TOKEN:
         return HttpResponseForbidden()
         
     annotation_project = get_object_or_404(Project, name=project)
+    
+    if 'since' in request.GET or 'limit' in request.GET:
+        return cursor_response(request, annotation_project, 'ranking-csv',
+          'text/plain')
+    
+    return snapshot_response(request, annotation_project, 'ranking-csv',
+      'text/plain')
+
+
+def export_to_apf(request, token, project):
+    """
+    Exports all annotations for the given project in APF format.
+    
+    Requires that given token matches the secret token set in local config.
+    Results after a given cursor can be exported using "since" and "limit"
+    GET parameters.
+    """
+    from appraise.local_settings import EXPORT_TOKEN
+    if not token == EXPORT_TOKEN:
+        return HttpResponseForbidden()
         
-    queryset = RankingResult.objects.filter(item__hit__completed=True)
+    annotation_project = get_object_or_404(Project, name=project)
+    
+    if 'since' in request.GET or 'limit' in request.GET:
+        return cursor_response(request, annotation_project, 'apf',
+          'text/plain')
+    
+    return snapshot_response(request, annotation_project, 'apf',
+      'text/plain')
 
-    results = [u'srclang,trglang,srcIndex,doucmentId,segmentId,judgeId,' \
-      'system1Number,system1Id,system2Number,system2Id,system3Number,' \
-      'system3Id,system4Number,system4Id,system5Number,system5Id,' \
-      'system1rank,system2rank,system3rank,system4rank,system5rank']
+
+def export_to_npz(request, token, project):
+    """
+    Exports all annotations for the given project in NumPy .npz format.
+    
+    Requires that given token matches the secret token set in local config.
+    Results after a given cursor can be exported using "since" and "limit"
+    GET parameters.
+    """
+    from appraise.local_settings import EXPORT_TOKEN
+    if not token == EXPORT_TOKEN:
+        return HttpResponseForbidden()
+        
+    annotation_project = get_object_or_404(Project, name=project)
     
-    for result in queryset:
-        if isinstance(result, RankingResult):
-            if result.item.hit.project_set.filter(id=annotation_project.id):
-                # Current implementation of export_to_pairwise_csv() is weird.
-                # By contrast, export_to_csv() generates the right thing...
-                current_csv = result.export_to_csv()
-                if current_csv is None:
-                    continue
-                results.append(current_csv)
+    if 'since' in request.GET or 'limit' in request.GET:
+        return cursor_response(request, annotation_project, 'npz',
+          'application/octet-stream')
     
-    export_csv = u"\n".join(results)
-    export_csv = export_csv + u"\n"
-    return HttpResponse(export_csv, mimetype='text/plain')
+    return streaming_response(request, iter_npz(annotation_project),
+      'application/octet-stream')
 
 
 def export_to_ranking_xml(request, token, project):
@@ -1162,6 +1499,8 @@ def export_to_ranking_xml(request, token, project):
     Exports all annotations for the given project in ranking XML format.
     
     Requires that given token matches the secret token set in local config.
+    Results after a given cursor can be exported using "since" and "limit"
+    GET parameters.
     """
     from appraise.local_settings import EXPORT_TOKEN
     if not token == EXPORT_TOKEN:
@@ -1169,15 +1508,9 @@ def export_to_ranking_xml(request, token, project):
         
     annotation_project = get_object_or_404(Project, name=project)
     
-    template = get_template('wmt16/result_export.xml')
-    
-    queryset = HIT.objects.filter(completed=True)
-    
-    results = []
-    for task in queryset:
-        if isinstance(task, HIT):
-            if task.project_set.filter(id=annotation_project.id):
-                results.append(task.export_to_xml())
+    if 'since' in request.GET or 'limit' in request.GET:
+        return cursor_response(request, annotation_project, 'xml',
+          'text/xml; charset=UTF-8')
     
-    export_xml = template.render(Context({'tasks': results}))
-    return HttpResponse(export_xml, mimetype='text/xml; charset=UTF-8')
+    return streaming_response(request, iter_ranking_xml(annotation_project),
+      'text/xml; charset=UTF-8')